@@ -0,0 +1,187 @@
+"""
+Benchmark the text and binary data file formats of the SV testbench. The same
+testbench is generated with each format and, if Vivado's simulator is found,
+simulated with each one so the time spent reading the data file can be
+compared.
+
+Run from the root of the repository with:
+
+    python -m benchmarks.data_format
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from sonar.core import generate
+from sonar.testbench import Module, Testbench, TestVector
+
+DATA_FORMATS = ("text", "bin")
+
+DUT = """\
+module bench (
+    input clk,
+    input rst,
+    input [63:0] data_in,
+    output reg [63:0] data_out
+);
+    always @(posedge clk) begin
+        data_out <= rst ? 0 : data_in;
+    end
+endmodule
+"""
+
+
+def build_testbench(vector_num, thread_num, command_num):
+    """
+    Build a testbench for a register with the given number of vectors, threads
+    per vector and commands per thread
+
+    Args:
+        vector_num (int): Number of test vectors
+        thread_num (int): Number of threads in each test vector
+        command_num (int): Number of commands in each thread
+
+    Returns:
+        Testbench: The testbench
+    """
+    testbench = Testbench.default("bench")
+    testbench.set_metadata("Timeout_Value", "1s")
+    dut = Module.default("DUT")
+    dut.add_clock_port("clk", "10ns")
+    dut.add_reset_port("rst")
+    dut.add_port("data_in", "input", 64)
+    dut.add_port("data_out", "output", 64)
+    testbench.add_dut(dut)
+    for _ in range(vector_num):
+        vector = TestVector()
+        for _ in range(thread_num):
+            thread = vector.add_thread()
+            for i in range(command_num):
+                thread.set_signal("data_in", (i * 0x9E3779B97F4A7C15) % 2**64)
+        vector.threads[-1].end_vector()
+        testbench.add_test_vector(vector)
+    return testbench
+
+
+def simulate(directory):
+    """
+    Compile and simulate the generated testbench with Vivado's simulator
+
+    Args:
+        directory (str): Directory holding the generated testbench
+
+    Returns:
+        float: Time in seconds spent in the simulation
+    """
+    subprocess.run(
+        ["xvlog", "--sv", "bench.sv", "bench_tb.sv"],
+        cwd=directory,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    subprocess.run(
+        ["xelab", "bench_tb", "-s", "bench_sim"],
+        cwd=directory,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    start = time.perf_counter()
+    subprocess.run(
+        ["xsim", "bench_sim", "-R"],
+        cwd=directory,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - start
+
+
+def run(testbench, data_format, directory, simulator):
+    """
+    Generate the testbench with a data format and optionally simulate it
+
+    Args:
+        testbench (Testbench): The testbench
+        data_format (str): Format of the data file (text|bin)
+        directory (str): Directory to generate the testbench in
+        simulator (bool): Simulate the testbench
+
+    Returns:
+        tuple(float, int, float): Time to generate the testbench, size of the
+            data file and time to simulate it (None if not simulated)
+    """
+    tb_filepath = os.path.join(directory, "bench.py")
+    start = time.perf_counter()
+    generate.sonar(
+        testbench,
+        tb_filepath,
+        "sv",
+        force=True,
+        legalize=False,
+        data_format=data_format,
+    )
+    generate_time = time.perf_counter() - start
+    size = os.path.getsize(generate.get_data_filepath(tb_filepath, "sv"))
+
+    sim_time = None
+    if simulator:
+        _, build_dir = generate.parse_sonar_tb(tb_filepath)
+        with open(os.path.join(build_dir, "bench.sv"), "w") as f:
+            f.write(DUT)
+        sim_time = simulate(build_dir)
+    return generate_time, size, sim_time
+
+
+def main():
+    """
+    Compare the data file formats for a testbench of a given size
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--vectors", type=int, default=4, help="Number of test vectors"
+    )
+    parser.add_argument(
+        "--threads", type=int, default=4, help="Number of threads per vector"
+    )
+    parser.add_argument(
+        "--commands",
+        type=int,
+        default=10000,
+        help="Number of commands in each thread",
+    )
+    parser.add_argument(
+        "--no-sim",
+        action="store_true",
+        help="Only generate the testbenches, don't simulate them",
+    )
+    args = parser.parse_args()
+
+    simulator = not args.no_sim and shutil.which("xsim") is not None
+    if not args.no_sim and not simulator:
+        print("xsim not found: only generating the testbenches")
+
+    testbench = build_testbench(args.vectors, args.threads, args.commands)
+    testbench = generate.legalize_config(testbench)
+    print(
+        f"{'format':>8} {'generate (s)':>14} {'size (B)':>12} {'sim (s)':>10}"
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        for data_format in DATA_FORMATS:
+            generate_time, size, sim_time = run(
+                testbench,
+                data_format,
+                os.path.join(directory, data_format),
+                simulator,
+            )
+            sim_str = "-" if sim_time is None else f"{sim_time:.4f}"
+            print(
+                f"{data_format:>8} {generate_time:>14.4f} {size:>12} "
+                f"{sim_str:>10}"
+            )
+
+
+if __name__ == "__main__":
+    main()
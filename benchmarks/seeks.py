@@ -0,0 +1,114 @@
+"""
+Benchmark how long it takes to write the SV data file, including computing
+the seek table, as the number of test vectors and threads grows.
+
+Run from the root of the repository with:
+
+    python -m benchmarks.seeks
+"""
+
+import argparse
+import os
+import time
+
+from sonar.core.backends.data_file import DataFile
+from sonar.core.backends.sv import write_data_file
+from sonar.testbench import Testbench, TestVector
+
+
+def build_testbench(vector_num, thread_num, command_num):
+    """
+    Build a testbench with the given number of vectors, threads per vector and
+    commands per thread. Only the test vectors are populated since that's all
+    that is needed to write the data file.
+
+    Args:
+        vector_num (int): Number of test vectors
+        thread_num (int): Number of threads in each test vector
+        command_num (int): Number of commands in each thread
+
+    Returns:
+        Testbench: The testbench
+    """
+    testbench = Testbench.default("bench")
+    for _ in range(vector_num):
+        vector = TestVector()
+        for _ in range(thread_num):
+            thread = vector.add_thread()
+            for i in range(command_num):
+                thread.set_signal("signal", i)
+        vector.threads[-1].end_vector()
+        testbench.add_test_vector(vector)
+    return testbench
+
+
+def time_data_file(vector_num, thread_num, command_num, repeat):
+    """
+    Time writing the data file for a testbench of the given size
+
+    Args:
+        vector_num (int): Number of test vectors
+        thread_num (int): Number of threads in each test vector
+        command_num (int): Number of commands in each thread
+        repeat (int): Number of times to repeat the measurement
+
+    Returns:
+        float: The best time in seconds
+    """
+    testbench = build_testbench(vector_num, thread_num, command_num)
+    best = float("inf")
+    with open(os.devnull, "wb") as f:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            write_data_file(testbench, DataFile(f, 2))
+            best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    """
+    Time writing the data file while scaling the vectors and threads
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--vectors",
+        type=int,
+        nargs="+",
+        default=[10, 100, 1000],
+        help="Numbers of test vectors to measure",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        nargs="+",
+        default=[1, 4, 16],
+        help="Numbers of threads per vector to measure",
+    )
+    parser.add_argument(
+        "--commands",
+        type=int,
+        default=10,
+        help="Number of commands in each thread",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of times to repeat each measurement",
+    )
+    args = parser.parse_args()
+
+    print(f"{'vectors':>8} {'threads':>8} {'lines':>10} {'time (s)':>10}")
+    for vector_num in args.vectors:
+        for thread_num in args.threads:
+            elapsed = time_data_file(
+                vector_num, thread_num, args.commands, args.repeat
+            )
+            lines = vector_num * thread_num * (args.commands + 1)
+            print(
+                f"{vector_num:>8} {thread_num:>8} {lines:>10} {elapsed:>10.4f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Benchmark generating synthetic testbenches. Each case builds a testbench and
+generates it for a set of languages in a fresh process so that its peak memory
+is measured on its own. The results are written as JSON and can be compared
+against the results of an earlier run to find regressions.
+
+Run from the root of the repository with:
+
+    python -m benchmarks.suite --output results.json [--compare old.json]
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import sonar
+from benchmarks.synthetic import build_testbench, count_commands
+from sonar.core import generate
+from sonar.core.profiler import get_peak_rss
+
+PARAMETERS = ("vectors", "threads", "beats", "waits", "endpoints")
+
+
+def run_case(case, profile):
+    """
+    Build and generate the testbench for one case
+
+    Args:
+        case (dict): The parameters of the testbench and the languages
+        profile (bool): Include the per-stage profile of the generation
+
+    Returns:
+        dict: The results of the case
+    """
+    start = time.perf_counter()
+    testbench = build_testbench(
+        case["vectors"],
+        case["threads"],
+        case["beats"],
+        case["waits"],
+        case["endpoints"],
+    )
+    build_time = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as directory:
+        tb_filepath = os.path.join(directory, "synthetic.py")
+        start = time.perf_counter()
+        report = generate.sonar(
+            testbench,
+            tb_filepath,
+            case["languages"],
+            force=True,
+            profile=profile,
+        )
+        generate_time = time.perf_counter() - start
+        _, build_dir = generate.parse_sonar_tb(tb_filepath)
+        data_size = sum(
+            os.path.getsize(os.path.join(build_dir, filename))
+            for filename in os.listdir(build_dir)
+            if filename.endswith(".dat")
+        )
+
+    commands = count_commands(testbench)
+    result = {
+        **case,
+        "commands": commands,
+        "build_time": build_time,
+        "generate_time": generate_time,
+        "commands_per_second": commands / generate_time,
+        "data_file_size": data_size,
+        "peak_rss": get_peak_rss(),
+    }
+    if profile:
+        result["profile"] = report
+    return result
+
+
+def run_isolated(case, profile):
+    """
+    Run a case in a new process
+
+    Args:
+        case (dict): The parameters of the testbench and the languages
+        profile (bool): Include the per-stage profile of the generation
+
+    Returns:
+        dict: The results of the case
+    """
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(1, mp_context=context) as executor:
+        return executor.submit(run_case, case, profile).result()
+
+
+def case_key(case):
+    """
+    Identify a case by its parameters so results can be matched between runs
+
+    Args:
+        case (dict): The case
+
+    Returns:
+        tuple: The parameters and languages of the case
+    """
+    return tuple(case[parameter] for parameter in PARAMETERS) + (
+        case["languages"],
+    )
+
+
+def compare(results, baseline):
+    """
+    Print how each case changed relative to a baseline
+
+    Args:
+        results (list): Results of this run
+        baseline (dict): Results of an earlier run as read from its JSON file
+    """
+    old_results = {case_key(case): case for case in baseline["cases"]}
+    print(
+        f"\nCompared to sonar {baseline['sonar_version']} "
+        f"({baseline['timestamp']}):"
+    )
+    print(f"{'case':>40} {'throughput':>12} {'peak memory':>12}")
+    for case in results:
+        old_case = old_results.get(case_key(case))
+        if old_case is None:
+            continue
+        throughput = (
+            case["commands_per_second"] / old_case["commands_per_second"]
+        )
+        memory = case["peak_rss"] / old_case["peak_rss"]
+        name = " ".join(str(value) for value in case_key(case))
+        print(f"{name:>40} {throughput:>11.2f}x {memory:>11.2f}x")
+
+
+def main():
+    """
+    Run the cases given on the command line and write the results
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    defaults = {
+        "vectors": [4],
+        "threads": [4],
+        "beats": [1000, 10000],
+        "waits": [10],
+        "endpoints": [1],
+    }
+    for parameter in PARAMETERS:
+        parser.add_argument(
+            f"--{parameter}",
+            type=int,
+            nargs="+",
+            default=defaults[parameter],
+            help=f"Numbers of {parameter} to measure",
+        )
+    parser.add_argument(
+        "--languages",
+        nargs="+",
+        default=["sv", "cpp", "all"],
+        choices=["sv", "cpp", "all"],
+        help="Languages to generate",
+    )
+    parser.add_argument(
+        "--output", help="Path of the JSON file to write the results to"
+    )
+    parser.add_argument(
+        "--compare", help="Path of a JSON file with results to compare to"
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Include the per-stage profile of each case in the results",
+    )
+    args = parser.parse_args()
+
+    results = []
+    print(
+        f"{'vectors':>8} {'threads':>8} {'beats':>8} {'waits':>6} "
+        f"{'endpts':>6} {'langs':>6} {'commands':>10} {'time (s)':>9} "
+        f"{'cmds/s':>10} {'peak (MB)':>10}"
+    )
+    for values in itertools.product(
+        *(getattr(args, parameter) for parameter in PARAMETERS),
+        args.languages,
+    ):
+        case = dict(zip(PARAMETERS + ("languages",), values))
+        result = run_isolated(case, args.profile)
+        results.append(result)
+        print(
+            f"{result['vectors']:>8} {result['threads']:>8} "
+            f"{result['beats']:>8} {result['waits']:>6} "
+            f"{result['endpoints']:>6} {result['languages']:>6} "
+            f"{result['commands']:>10} {result['generate_time']:>9.3f} "
+            f"{result['commands_per_second']:>10.0f} "
+            f"{result['peak_rss'] / 2**20:>10.1f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "sonar_version": sonar.__version__,
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "timestamp": datetime.datetime.now().isoformat(),
+                    "cases": results,
+                },
+                f,
+                indent=2,
+            )
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
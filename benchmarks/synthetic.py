@@ -0,0 +1,89 @@
+"""
+Build synthetic testbenches for benchmarking. The DUT streams data in and out
+over AXI4-Stream interfaces and every dimension of the testbench that affects
+the cost of generating it can be scaled independently.
+"""
+
+from sonar.interfaces.axi4_stream import AXI4Stream
+from sonar.testbench import Module, Testbench, TestVector
+
+
+def build_testbench(
+    vector_num=1, thread_num=1, beat_num=100, wait_num=0, endpoint_num=1
+):
+    """
+    Build a synthetic testbench. Even threads write beats to the input stream
+    and odd threads read beats from the output stream.
+
+    Args:
+        vector_num (int, optional): Number of test vectors. Defaults to 1.
+        thread_num (int, optional): Number of threads in each test vector.
+            Defaults to 1.
+        beat_num (int, optional): Number of stream beats in each thread.
+            Defaults to 100.
+        wait_num (int, optional): Number of waits in each thread, each on a
+            different condition. Defaults to 0.
+        endpoint_num (int, optional): Number of endpoints of each interface.
+            Defaults to 1.
+
+    Returns:
+        Testbench: The testbench
+    """
+    testbench = Testbench.default("synthetic")
+    testbench.set_metadata("Timeout_Value", "1s")
+    dut = Module.default("DUT")
+    dut.add_clock_port("clk", "10ns")
+    dut.add_reset_port("rst")
+    streams = []
+    for name, direction in (("axis_in", "slave"), ("axis_out", "master")):
+        stream = AXI4Stream(name, direction, "clk", "rst")
+        stream.init_signals("default", 64, False)
+        stream.iClass = "axis_t"
+        stream.flit = "axis_word_t"
+        for _ in range(endpoint_num):
+            stream.add_endpoint("manual")
+        dut.add_interface(stream)
+        streams.append(stream)
+    testbench.add_dut(dut)
+
+    for _ in range(vector_num):
+        vector = TestVector()
+        for i in range(thread_num):
+            thread = vector.add_thread()
+            for j in range(wait_num):
+                thread.wait_level(f"axis_out_tdata >= {j}")
+            beats = [
+                {"tdata": (j * 0x9E3779B97F4A7C15) % 2**64, "tlast": 0}
+                for j in range(beat_num)
+            ]
+            if beats:
+                beats[-1]["tlast"] = 1
+            if i % 2 == 0:
+                streams[0].writes(thread, beats)
+            else:
+                streams[1].reads(thread, beats)
+        vector.threads[-1].end_vector()
+        testbench.add_test_vector(vector)
+    return testbench
+
+
+def count_commands(testbench):
+    """
+    Count the commands in a testbench, counting each beat of a stream
+    transaction as a command since each is a line in the data file
+
+    Args:
+        testbench (Testbench): The testbench
+
+    Returns:
+        int: Number of commands
+    """
+    count = 0
+    for vector in testbench.vectors:
+        for thread in vector.threads:
+            for command in thread.commands:
+                if "interface" in command:
+                    count += len(command["interface"]["payload"])
+                else:
+                    count += 1
+    return count
@@ -16,6 +16,7 @@ import toml
 
 import sonar.database
 import sonar.include
+from sonar.core import script_cache
 from sonar.core.include import Constants, configure_logging
 from sonar.exceptions import ReturnValue, SonarException
 from sonar.make import MakeFile
@@ -582,6 +583,23 @@ class Database:
         sonar.database.print_db()
 
 
+def testbench(args):
+    """
+    Generate the testbenches of a sonar script, skipping the script if it and
+    the modules it imports are unchanged since it was last run this way
+
+    Args:
+        args (object): Holds attributes
+            script (str): Path to the script
+            args (list): Arguments to pass to the script
+            force (bool): Run the script even if it's unchanged
+    """
+    if script_cache.run(args.script, args.args, args.force):
+        logger.info("Ran %s and saved its testbenches", args.script)
+    else:
+        logger.info("Generated the saved testbenches of %s", args.script)
+
+
 def check_database():
     """
     Checks to see if the sonar database exists. If it does not, performs the
@@ -541,6 +541,41 @@ def create(parser):
     add_help(subparser)
 
 
+def testbench(parser):
+    """
+    Parse the "testbench" argument
+
+    Args:
+        parser (argparse._SubParserAction): The parser object
+    """
+    subparser = parser.add_parser(
+        "testbench",
+        help="Generate the testbenches of a script",
+        add_help=False,
+        description=textwrap.dedent(
+            """\
+            Runs a sonar testbench script, saving the testbenches it generates
+            to its build directory. If the script and the modules it imports
+            are unchanged the next time, the saved testbenches are generated
+            without running the script.
+            """
+        ),
+    )
+    command_group = subparser.add_argument_group("Arguments")
+    command_group.add_argument("script", type=str, help="Path to the script")
+    command_group.add_argument(
+        "args", nargs="*", help="Arguments to pass to the script"
+    )
+    command_group.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="Run the script even if it's unchanged",
+    )
+    subparser.set_defaults(func=api.testbench)
+    add_help(subparser)
+
+
 def add_help(parser):
     """
     Add generic help message to parsers
@@ -0,0 +1,504 @@
+"""
+Compact storage for the commands in a thread. Each command is a dictionary
+with one key, its type (e.g. "signal" or "interface"), mapping to its
+arguments. Common commands are stored as an opcode and two integer operands in
+arrays, with any strings in them interned in a table, instead of as nested
+dictionaries. Other commands are kept as they are. The commands are converted
+back to dictionaries as they are accessed. For threads with more commands than
+fit in memory, the commands can instead be spilled to a log in a temporary
+file.
+"""
+
+import os
+import pickle
+import tempfile
+from array import array
+from collections.abc import MutableSequence
+
+from sonar.exceptions import SonarInvalidOpError
+
+# opcodes of the commands stored compactly
+OP_OBJECT = 0
+OP_SIGNAL = 1
+OP_DELAY = 2
+OP_TIMESTAMP = 3
+OP_DISPLAY = 4
+OP_CALL_DUT = 5
+OP_SET_FLAG = 6
+OP_CLEAR_FLAG = 7
+
+# commands whose only operand is a string
+STRING_OPCODES = {
+    "delay": OP_DELAY,
+    "timestamp": OP_TIMESTAMP,
+    "display": OP_DISPLAY,
+}
+FLAG_OPCODES = {"set_flag": OP_SET_FLAG, "clear_flag": OP_CLEAR_FLAG}
+
+# spilled commands are written to and read from their file in blocks of this
+# many bytes
+SPILL_BLOCK_SIZE = 2**20
+
+INT64_MIN = -(2**63)
+INT64_MAX = 2**63 - 1
+UINT64_MAX = 2**64 - 1
+
+
+def command_type(command):
+    """
+    Get the type of a command. The backends look up how to write each command
+    by its type.
+
+    Args:
+        command (dict): The command
+
+    Returns:
+        str: The type of the command
+    """
+    return next(iter(command))
+
+
+def _is_int64(value):
+    """
+    Check if a value is an integer (not a bool) that fits in 64 bits
+
+    Args:
+        value (object): The value
+
+    Returns:
+        bool: True if the value can be stored as an operand
+    """
+    return type(value) is int and INT64_MIN <= value <= INT64_MAX
+
+
+# convert each opcode and its operands back to a command
+DECODERS = (
+    lambda commands, a, _b: commands.objects[a],
+    lambda commands, a, b: {
+        "signal": {"name": commands.strings[a], "value": b}
+    },
+    lambda commands, a, _b: {"delay": commands.strings[a]},
+    lambda commands, a, _b: {"timestamp": commands.strings[a]},
+    lambda commands, a, _b: {"display": commands.strings[a]},
+    lambda _commands, a, _b: {"call_dut": a},
+    lambda _commands, a, _b: {"flag": {"set_flag": a}},
+    lambda _commands, a, _b: {"flag": {"clear_flag": a}},
+)
+
+
+class Commands(MutableSequence):
+    """
+    A list of commands stored compactly. Macros, waits and interface
+    transactions are stored as the original objects since the backends modify
+    them in place during legalization and generation. All other commands are
+    created anew each time they're accessed so modifying them has no effect.
+    """
+
+    def __init__(self, commands=()):
+        """
+        Initialize the commands
+
+        Args:
+            commands (Iterable, optional): Initial commands. Defaults to ().
+        """
+        self.opcodes = array("B")
+        self.operands = array("q")
+        self.values = array("Q")
+        self.strings = []
+        self.string_ids = {}
+        self.objects = []
+        self.extend(commands)
+
+    def _intern(self, string):
+        """
+        Get the index of a string in the table, adding it if needed
+
+        Args:
+            string (str): The string
+
+        Returns:
+            int: Index of the string
+        """
+        string_id = self.string_ids.get(string)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(string)
+            self.string_ids[string] = string_id
+        return string_id
+
+    def _encode(self, command):
+        """
+        Convert a command to its opcode and operands
+
+        Args:
+            command (dict): The command
+
+        Returns:
+            tuple(int, int, int): The opcode and operands
+        """
+        if type(command) is dict and len(command) == 1:
+            ((key, value),) = command.items()
+            if key == "signal":
+                if (
+                    type(value) is dict
+                    and tuple(value) == ("name", "value")
+                    and type(value["name"]) is str
+                    and type(value["value"]) is int
+                    and 0 <= value["value"] <= UINT64_MAX
+                ):
+                    return (
+                        OP_SIGNAL,
+                        self._intern(value["name"]),
+                        value["value"],
+                    )
+            elif key in STRING_OPCODES:
+                if type(value) is str:
+                    return STRING_OPCODES[key], self._intern(value), 0
+            elif key == "call_dut":
+                if _is_int64(value):
+                    return OP_CALL_DUT, value, 0
+            elif key == "flag":
+                if type(value) is dict and len(value) == 1:
+                    ((flag_key, flag_id),) = value.items()
+                    if flag_key in FLAG_OPCODES and _is_int64(flag_id):
+                        return FLAG_OPCODES[flag_key], flag_id, 0
+        self.objects.append(command)
+        return OP_OBJECT, len(self.objects) - 1, 0
+
+    def _decode(self, index):
+        """
+        Convert the command at an index back to a dictionary
+
+        Args:
+            index (int): Index of the command
+
+        Returns:
+            dict: The command
+        """
+        return DECODERS[self.opcodes[index]](
+            self, self.operands[index], self.values[index]
+        )
+
+    def _check_index(self, index):
+        """
+        Convert an index to a positive one and check that it's in range
+
+        Args:
+            index (int): Index of a command
+
+        Raises:
+            IndexError: Raised if the index is out of range
+
+        Returns:
+            int: The positive index
+        """
+        if index < 0:
+            index += len(self.opcodes)
+        if not 0 <= index < len(self.opcodes):
+            raise IndexError("Command index out of range")
+        return index
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._decode(i) for i in range(*index.indices(len(self)))]
+        return self._decode(self._check_index(index))
+
+    def __iter__(self):
+        # signals and objects are handled inline since they're the most common
+        strings = self.strings
+        objects = self.objects
+        for opcode, operand, value in zip(
+            self.opcodes, self.operands, self.values
+        ):
+            if opcode == OP_SIGNAL:
+                yield {"signal": {"name": strings[operand], "value": value}}
+            elif opcode == OP_OBJECT:
+                yield objects[operand]
+            else:
+                yield DECODERS[opcode](self, operand, value)
+
+    def __setitem__(self, index, command):
+        if isinstance(index, slice):
+            commands = list(self)
+            commands[index] = command
+            self.clear()
+            self.extend(commands)
+            return
+        index = self._check_index(index)
+        replaced = self.opcodes[index]
+        (
+            self.opcodes[index],
+            self.operands[index],
+            self.values[index],
+        ) = self._encode(command)
+        if replaced == OP_OBJECT:
+            self._compact_objects()
+
+    def _compact_objects(self):
+        """
+        Remove the objects that no command refers to anymore
+        """
+        objects = []
+        operands = self.operands
+        for index, opcode in enumerate(self.opcodes):
+            if opcode == OP_OBJECT:
+                objects.append(self.objects[operands[index]])
+                operands[index] = len(objects) - 1
+        self.objects = objects
+
+    def __delitem__(self, index):
+        if not isinstance(index, slice):
+            index = self._check_index(index)
+        deleted = self.opcodes[index]
+        del self.opcodes[index]
+        del self.operands[index]
+        del self.values[index]
+        if deleted == OP_OBJECT or (
+            isinstance(index, slice) and OP_OBJECT in deleted
+        ):
+            self._compact_objects()
+
+    def insert(self, index, command):
+        opcode, operand, value = self._encode(command)
+        if index < 0:
+            index = max(index + len(self), 0)
+        index = min(index, len(self))
+        self.opcodes.insert(index, opcode)
+        self.operands.insert(index, operand)
+        self.values.insert(index, value)
+
+    def append(self, command):
+        opcode, operand, value = self._encode(command)
+        self.opcodes.append(opcode)
+        self.operands.append(operand)
+        self.values.append(value)
+
+    def clear(self):
+        self.opcodes = array("B")
+        self.operands = array("q")
+        self.values = array("Q")
+        self.strings = []
+        self.string_ids = {}
+        self.objects = []
+
+    def __eq__(self, other):
+        if isinstance(other, (Commands, list)):
+            return len(self) == len(other) and all(
+                a == b for a, b in zip(self, other)
+            )
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class SpilledCommands(MutableSequence):
+    """
+    A list of commands kept in an append-only log in a temporary file rather
+    than in memory. Each command is pickled as it's added and unpickled as
+    it's read so only the offsets of the commands in the file are held in
+    memory. Like the compactly stored commands, modifying a command after
+    adding it has no effect. Commands can only be added and removed at the
+    end.
+
+    The file is only accessed at explicit offsets so processes forked while
+    the commands are being read, e.g. to generate testbenches in parallel,
+    can share it.
+    """
+
+    def __init__(self, commands=(), directory=None):
+        """
+        Initialize the commands
+
+        Args:
+            commands (Iterable, optional): Initial commands. Defaults to ().
+            directory (str, optional): Directory to create the temporary file
+                in. Defaults to None, the default temporary directory.
+        """
+        self.directory = directory
+        self.file = tempfile.TemporaryFile(dir=directory)
+        # the offset of each command in the file followed by the end of the
+        # last one
+        self.offsets = array("Q", [0])
+        # commands added but not written to the file yet
+        self.buffer = bytearray()
+        self.flushed = 0
+        self.extend(commands)
+
+    def flush(self):
+        """
+        Write the buffered commands to the file
+        """
+        view = memoryview(self.buffer)
+        while view:
+            written = os.pwrite(self.file.fileno(), view, self.flushed)
+            self.flushed += written
+            view = view[written:]
+        view.release()
+        self.buffer.clear()
+
+    def _read(self, start, end):
+        """
+        Read part of the log
+
+        Args:
+            start (int): Offset to start reading from
+            end (int): Offset to stop reading at
+
+        Returns:
+            bytes: The data
+        """
+        self.flush()
+        data = bytearray()
+        while start + len(data) < end:
+            block = os.pread(
+                self.file.fileno(),
+                end - start - len(data),
+                start + len(data),
+            )
+            if not block:
+                raise EOFError("The spilled commands have been truncated")
+            data += block
+        return bytes(data)
+
+    def blocks(self):
+        """
+        Read the log in blocks
+
+        Yields:
+            bytes: The next block of the log
+        """
+        end = self.offsets[-1]
+        for start in range(0, end, SPILL_BLOCK_SIZE):
+            yield self._read(start, min(start + SPILL_BLOCK_SIZE, end))
+
+    def _check_index(self, index):
+        """
+        Convert an index to a positive one and check that it's in range
+
+        Args:
+            index (int): Index of a command
+
+        Raises:
+            IndexError: Raised if the index is out of range
+
+        Returns:
+            int: The positive index
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Command index out of range")
+        return index
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = self._check_index(index)
+        return pickle.loads(
+            self._read(self.offsets[index], self.offsets[index + 1])
+        )
+
+    def __iter__(self):
+        offsets = self.offsets
+        index = 0
+        while index < len(self):
+            # read as many whole commands as fit in a block, or one command
+            # if it's larger than a block
+            start = offsets[index]
+            stop = index + 1
+            while (
+                stop < len(self)
+                and offsets[stop + 1] - start <= SPILL_BLOCK_SIZE
+            ):
+                stop += 1
+            data = memoryview(self._read(start, offsets[stop]))
+            for i in range(index, stop):
+                yield pickle.loads(
+                    data[offsets[i] - start : offsets[i + 1] - start]
+                )
+            index = stop
+
+    def __setitem__(self, index, command):
+        raise SonarInvalidOpError("Spilled commands can't be replaced")
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            indices = range(*index.indices(len(self)))
+            if not indices:
+                return
+            if indices.step < 0:
+                indices = indices[::-1]
+            if indices.step != 1 or indices.stop != len(self):
+                raise SonarInvalidOpError(
+                    "Only the last spilled commands can be deleted"
+                )
+            start = indices.start
+        else:
+            start = self._check_index(index)
+            if start != len(self) - 1:
+                raise SonarInvalidOpError(
+                    "Only the last spilled commands can be deleted"
+                )
+        self.flush()
+        end = self.offsets[start]
+        del self.offsets[start + 1 :]
+        self.file.truncate(end)
+        self.flushed = end
+
+    def insert(self, index, command):
+        if index < 0:
+            index = max(index + len(self), 0)
+        if index < len(self):
+            raise SonarInvalidOpError(
+                "Spilled commands can only be added at the end"
+            )
+        self.append(command)
+
+    def append(self, command):
+        data = pickle.dumps(command, pickle.HIGHEST_PROTOCOL)
+        self.buffer += data
+        self.offsets.append(self.offsets[-1] + len(data))
+        if len(self.buffer) >= SPILL_BLOCK_SIZE:
+            self.flush()
+
+    def clear(self):
+        del self[:]
+
+    def close(self):
+        """
+        Close and delete the temporary file
+        """
+        self.file.close()
+
+    def __eq__(self, other):
+        if isinstance(other, (Commands, SpilledCommands, list)):
+            return len(self) == len(other) and all(
+                a == b for a, b in zip(self, other)
+            )
+        return NotImplemented
+
+    def __getstate__(self):
+        # the log is copied as it is so the commands are never unpickled to
+        # objects, which take far more memory than the log
+        return {
+            "directory": self.directory,
+            "offsets": self.offsets,
+            "log": list(self.blocks()),
+        }
+
+    def __setstate__(self, state):
+        self.__init__(directory=state["directory"])
+        for block in state["log"]:
+            self.buffer += block
+            self.flush()
+        self.offsets = state["offsets"]
+
+    def __repr__(self):
+        return f"SpilledCommands(<{len(self)} commands>)"
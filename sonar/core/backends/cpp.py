@@ -5,13 +5,29 @@ The C++ backend for generating testbenches
 import itertools
 import logging
 import os
-from shlex import split as quoteSplit
+import tempfile
 
 import sonar.core.backends.include as include
+from sonar.commands import command_type
+from sonar.core import profiler
+from sonar.core.backends.data_file import make_data_file
 from sonar.interfaces.axi4_lite_slave import AXI4LiteSlave
 from sonar.interfaces.axi4_stream import AXI4Stream
 
 TAB_SIZE = "    "
+# strings that the template compares the fields of the data file against
+TEMPLATE_STRINGS = (
+    "timestamp",
+    "display",
+    "INIT",
+    "call_dut",
+    "end",
+    "finish",
+    "repeat",
+    "loop",
+    "begin",
+    "pattern",
+)
 
 logger = logging.getLogger(__name__)
 
@@ -98,9 +114,7 @@ def set_signals(testbench_config, testbench):
         if "type" not in signal:
             if ifelse_signal != "":
                 ifelse_signal += leading_spaces + "else "
-            ifelse_signal += (
-                'if(!strcmp(interfaceType, "' + signal.name + '")){\n'
-            )
+            ifelse_signal += f"if(SONAR_IS(interfaceType, {signal.name})){{\n"
             ifelse_signal += (
                 leading_spaces + TAB_SIZE + signal.name + " = args[0];\n"
             )
@@ -138,9 +152,7 @@ def set_interfaces(testbench_config, testbench):
     for interface in itertools.chain(interfaces_slave, interfaces_mixed):
         if replace_str != "":
             replace_str += leading_spaces + "else "
-        replace_str += (
-            'if(!strcmp(interfaceType, "' + interface.name + '")){\n'
-        )
+        replace_str += f"if(SONAR_IS(interfaceType, {interface.name})){{\n"
         # in cpp, only consider first endpoint
         endpoint = interface.endpoints[0]
         replace_str = include.command_var_replace(
@@ -165,9 +177,7 @@ def set_interfaces(testbench_config, testbench):
             replace_str_2 += (
                 leading_spaces + "else "
             )  # TODO fix this on first one. too many spaces
-        replace_str_2 += (
-            'if(!strcmp(interfaceType, "' + interface.name + '")){\n'
-        )
+        replace_str_2 += f"if(SONAR_IS(interfaceType, {interface.name})){{\n"
         # in cpp, only consider first endpoint
         endpoint = interface.endpoints[0]
         replace_str_2 = include.command_var_replace(
@@ -185,93 +195,251 @@ def set_interfaces(testbench_config, testbench):
     return testbench
 
 
+def write_interface(data_file, transaction, _vector_id):
+    """
+    Write an interface transaction to the data file
+
+    Args:
+        data_file (DataFile): The data file to write to
+        transaction (dict): The transaction
+        _vector_id (int): Index of the current test vector
+
+    Returns:
+        DataFile: Updated data_file
+    """
+    curr_interface = include.get_interface(transaction["type"])
+    if "pattern" in transaction:
+        # the pattern record applies to the line after it so neither can be
+        # part of a run
+        for line in curr_interface.cpp_lines(transaction):
+            data_file.append_once(line)
+    else:
+        data_file.extend(curr_interface.cpp_lines(transaction))
+    return data_file
+
+
+def write_nothing(data_file, _args, _vector_id):
+    """
+    Skip a command that this backend has no use for
+
+    Args:
+        data_file (DataFile): The data file to write to
+        _args (object): The arguments of the command
+        _vector_id (int): Index of the current test vector
+
+    Returns:
+        DataFile: The unchanged data_file
+    """
+    return data_file
+
+
+def write_display(data_file, string, _vector_id):
+    """
+    Write a display to the data file
+
+    Args:
+        data_file (DataFile): The data file to write to
+        string (str): The string to display
+        _vector_id (int): Index of the current test vector
+
+    Returns:
+        DataFile: Updated data_file
+    """
+    data_file.append('display "' + str(string) + '" ' + "NULL 1" + " " + "0")
+    return data_file
+
+
+def write_call_dut(data_file, num, _vector_id):
+    """
+    Write calling the DUT to the data file
+
+    Args:
+        data_file (DataFile): The data file to write to
+        num (int): Number of times to call the DUT
+        _vector_id (int): Index of the current test vector
+
+    Returns:
+        DataFile: Updated data_file
+    """
+    data_file.append("call_dut " + "NULL" + " " + "NULL 1 " + str(num))
+    return data_file
+
+
+def write_loop(data_file, loop, _vector_id):
+    """
+    Write the beginning or end of a loop to the data file
+
+    Args:
+        data_file (DataFile): The data file to write to
+        loop (dict): The beginning or end of the loop
+        _vector_id (int): Index of the current test vector
+
+    Returns:
+        DataFile: Updated data_file
+    """
+    # these change which line is read next so they're never repeated
+    if "begin" in loop:
+        data_file.append_once("loop begin NULL 1 " + str(loop["begin"]))
+    else:
+        data_file.append_once("loop end NULL 0")
+    return data_file
+
+
+def write_timestamp(data_file, timestamp, _vector_id):
+    """
+    Write a timestamp to the data file
+
+    Args:
+        data_file (DataFile): The data file to write to
+        timestamp (str): The timestamp
+        _vector_id (int): Index of the current test vector
+
+    Returns:
+        DataFile: Updated data_file
+    """
+    data_file.append(
+        "timestamp " + str(timestamp) + " " + "NULL 1" + " " + str(0)
+    )
+    return data_file
+
+
+def write_macro(data_file, macro, vector_id):
+    """
+    Write a macro to the data file
+
+    Args:
+        data_file (DataFile): The data file to write to
+        macro (str): The macro
+        vector_id (int): Index of the current test vector
+
+    Returns:
+        DataFile: Updated data_file
+    """
+    if macro == "END":
+        data_file.append(
+            "end " + "Vector_" + str(vector_id) + " NULL 1 " + str(0)
+        )
+    return data_file
+
+
+# writes each type of command to the data file. Signals, waits, delays and
+# flags have no meaning in the C++ testbench
+WRITERS = {
+    "interface": write_interface,
+    "wait": write_nothing,
+    "signal": write_nothing,
+    "delay": write_nothing,
+    "display": write_display,
+    "call_dut": write_call_dut,
+    "flag": write_nothing,
+    "loop": write_loop,
+    "timestamp": write_timestamp,
+    "macro": write_macro,
+}
+
+
 def write_line(data_file, command, vector_id):
     """
     Write one line to the data file
 
     Args:
-        data_file (list): List of commands for the data file
+        data_file (DataFile): The data file to write to
         command (dict): Current command to write
         vector_id (int): Index of the current test vector
 
     Returns:
-        list: Updated data_file
+        DataFile: Updated data_file
     """
-    if "interface" in command:
-        curr_interface = include.get_interface(command["interface"]["type"])
-        line = curr_interface.write_cpp(command["interface"])
-        if line != "":
-            data_file.append(line)
-    elif "wait" in command:
-        pass
-    elif "signal" in command:
-        # data_file.append(
-        #     "signal "
-        #     + str(command["signal"]["name"])
-        #     + " "
-        #     + str(1)
-        #     + " "
-        #     + str(command["signal"]["value"])
-        # )
-        pass
-    elif "delay" in command:
-        pass
-    elif "display" in command:
-        data_file.append(
-            'display "' + str(command["display"]) + '" ' + "NULL 1" + " " + "0"
-        )
-    elif "call_dut" in command:
-        data_file.append(
-            "call_dut " + "NULL" + " " + "NULL 1 " + str(command["call_dut"])
-        )
-    elif "flag" in command:
-        pass
-    elif "timestamp" in command:
-        data_file.append(
-            "timestamp "
-            + str(command["timestamp"])
-            + " "
-            + "NULL 1"
-            + " "
-            + str(0)
-        )
-    elif "macro" in command:
-        if command["macro"] == "END":
-            data_file.append(
-                "end " + "Vector_" + str(vector_id) + " NULL 1 " + str(0)
-            )
-    else:
+    key = command_type(command)
+    writer = WRITERS.get(key)
+    if writer is None:
         logger.error("Unhandled packet type: %s", str(command))
+        return data_file
+    return writer(data_file, command[key], vector_id)
 
-    return data_file
 
-
-def write_data_file(testbench_config):
+def get_strings(testbench_config):
     """
-    Based on the test vectors, write the data file
+    Get the strings that the testbench compares the fields of the data file
+    against
 
     Args:
         testbench_config (Testbench): The testbench configuration
 
     Returns:
-        list: List of commands to write to the data file
+        list: The strings
     """
-    data_file = []
-    for i, vector in enumerate(testbench_config.vectors):
-        for thread in vector.threads:
-            for command in thread.commands:
-                data_file = write_line(
-                    data_file,
-                    command,
-                    i,
-                )
+    dut = testbench_config.modules["DUT"]
+    strings = list(TEMPLATE_STRINGS)
+    for signal in dut.ports.get_signals("input"):
+        strings.append(signal.name)
+    for interface in testbench_config.get_from_dut("interfaces"):
+        strings.append(interface.name)
+    return strings
+
+
+def set_string_ids(testbench, data_file, strings):
+    """
+    Define the indices of the strings in the string table of a binary data
+    file so the testbench can compare fields by their indices
+
+    Args:
+        testbench (str): The testbench being generated
+        data_file (BinaryDataFile): The data file
+        strings (list): Strings that the testbench compares fields against
+
+    Returns:
+        str: Updated testbench
+    """
+    string_ids = ""
+    for string in dict.fromkeys(strings):
+        string_ids += (
+            f"#define SONAR_ID_{string} {data_file.strings[string]}\n"
+        )
+    testbench = include.replace_in_testbenches(
+        testbench, "SONAR_STRING_IDS", string_ids[:-1]
+    )
+    return testbench
+
+
+def write_data_file(testbench_config, data_file):
+    """
+    Based on the test vectors, write the data file. The lines are first
+    streamed to a temporary file since the preamble of the data file (if any)
+    depends on them.
+
+    Args:
+        testbench_config (Testbench): The testbench configuration
+        data_file (DataFile): The data file to write to
 
-    data_file.append("finish NULL NULL 0 0")
+    Returns:
+        DataFile: The written data_file
+    """
+    with tempfile.TemporaryFile() as packets_file:
+        packets = data_file.fork(packets_file)
+        for i, vector in enumerate(testbench_config.vectors):
+            for thread in vector.threads:
+                for command in thread.commands:
+                    packets = write_line(
+                        packets,
+                        command,
+                        i,
+                    )
+
+        packets.append("finish NULL NULL 0 0")
+        packets.flush()
+
+        data_file.update(packets)
+        data_file.write_preamble()
+        packets_file.seek(0)
+        data_file.copy(packets_file, packets.size)
 
     return data_file
 
 
-def create_testbench(testbench_config, testbench, directory):
+def create_testbench(
+    testbench_config, testbench, directory, data_file, data_format="text"
+):
     """
     Create the testbench for this language backend
 
@@ -279,42 +447,55 @@ def create_testbench(testbench_config, testbench, directory):
         testbench_config (Testbench): The testbench configuration
         testbench (str): The testbench being generated
         directory (str): Path to the directory to place generated files
+        data_file (file): File opened in binary mode to write the data file to
+        data_format (str, optional): Format of the data file (text|bin).
+            Defaults to "text".
 
     Returns:
-        Tuple(str, str): The testbench and the data file
+        str: The testbench
     """
-    testbench = include.set_metadata(testbench_config, testbench)
-    testbench = include.replace_in_testbenches(
-        testbench,
-        "SONAR_DATA_FILE",
-        '"'
-        + os.path.join(
-            directory, f'{testbench_config.metadata["Module_Name"]}_cpp.dat"'
-        ),
-    )
-
-    # this is currently not used: no signals can be set in cpp
-    testbench = include.replace_in_testbenches(
-        testbench, "SONAR_IF_ELSE_SIGNAL", ""
-    )
+    with profiler.stage("substitute_template"):
+        testbench = include.set_metadata(testbench_config, testbench)
+        testbench = include.replace_in_testbenches(
+            testbench,
+            "SONAR_DATA_FILE",
+            '"'
+            + os.path.join(
+                directory,
+                f'{testbench_config.metadata["Module_Name"]}_cpp.dat"',
+            ),
+        )
 
-    # testbench = instantiate_dut(testbench_config, testbench)
-    testbench = declare_signals(testbench_config, testbench)
-    testbench = set_signals(testbench_config, testbench)
-    testbench = set_interfaces(testbench_config, testbench)
+        # this is currently not used: no signals can be set in cpp
+        testbench = include.replace_in_testbenches(
+            testbench, "SONAR_IF_ELSE_SIGNAL", ""
+        )
 
-    data_file = write_data_file(testbench_config)
+        # testbench = instantiate_dut(testbench_config, testbench)
+        testbench = declare_signals(testbench_config, testbench)
+        testbench = set_signals(testbench_config, testbench)
+        testbench = set_interfaces(testbench_config, testbench)
 
-    max_args = 0
-    for line in data_file:
-        first_word = line.split(" ")[0]
-        if first_word not in ["TestVector", "ParallelSection", "Packet"]:
-            arg_count = int(quoteSplit(line)[3])
-            if arg_count > max_args:
-                max_args = arg_count
+    with profiler.stage("write_data_file"):
+        strings = get_strings(testbench_config)
+        data_file = make_data_file(data_file, 3, data_format)
+        data_file.reserve(strings)
+        data_file = write_data_file(testbench_config, data_file)
 
     testbench = include.replace_in_testbenches(
-        testbench, "SONAR_MAX_ARG_NUM", max_args
+        testbench, "SONAR_MAX_ARG_NUM", data_file.max_args
     )
+    if data_format == "bin":
+        testbench = include.replace_in_testbenches(
+            testbench, "SONAR_DATA_FORMAT", "#define SONAR_BINARY_DATA"
+        )
+        testbench = set_string_ids(testbench, data_file, strings)
+    else:
+        testbench = include.replace_in_testbenches(
+            testbench, "SONAR_DATA_FORMAT", ""
+        )
+        testbench = include.replace_in_testbenches(
+            testbench, "SONAR_STRING_IDS", ""
+        )
 
-    return testbench, "\n".join(data_file)
+    return testbench
@@ -0,0 +1,489 @@
+"""
+Writers for the data files that the generated testbenches read at runtime
+"""
+
+import struct
+from shlex import split as quoteSplit
+
+from sonar.exceptions import SonarInvalidArgError
+
+COPY_CHUNK_SIZE = 1 << 20
+
+BINARY_MAGIC = b"SONR"
+BINARY_VERSION = 1
+# strings used in the headers of the data file so they're always in the string
+# table, even though the header is written after the string table
+BINARY_RESERVED_STRINGS = (
+    "TestVector",
+    "ParallelSection",
+    "Packet",
+    "count",
+    "seek",
+)
+
+DATA_FORMATS = ("text", "bin")
+
+# runs of at least this many identical packets are written as a repeat record
+# followed by the packet once
+REPEAT_THRESHOLD = 3
+
+
+def split_line(line):
+    """
+    Split a line of the data file into its words. Quoted strings are kept as
+    one word without the quotes
+
+    Args:
+        line (str): The line to split
+
+    Returns:
+        list: Words in the line
+    """
+    if '"' in line:
+        return quoteSplit(line)
+    return line.split(" ")
+
+
+def make_data_file(stream, arg_index, data_format):
+    """
+    Create a writer for a data file in the given format
+
+    Args:
+        stream (file): A file opened in binary mode to write to
+        arg_index (int): Index of the word in each packet line that holds the
+            number of arguments in the packet
+        data_format (str): Format of the data file (text|bin)
+
+    Raises:
+        SonarInvalidArgError: Raised for unknown formats
+
+    Returns:
+        DataFile: The writer
+    """
+    if data_format == "text":
+        return DataFile(stream, arg_index)
+    if data_format == "bin":
+        return BinaryDataFile(stream, arg_index)
+    raise SonarInvalidArgError(
+        f"Data format must be one of {DATA_FORMATS}, not {data_format}"
+    )
+
+
+class DataFile:
+    """
+    Streams lines to a data file as they are generated rather than holding the
+    whole file in memory. As lines are written, it keeps track of the
+    statistics that the backends need to size the testbench.
+
+    Runs of identical packets are compressed: the testbench evaluates the
+    packet after a "repeat" record as many times as the record's argument.
+    Since a run may continue with the next packet, the last run is buffered
+    until flush() is called.
+    """
+
+    def __init__(self, stream, arg_index, repeat_threshold=REPEAT_THRESHOLD):
+        """
+        Initialize a writer for a data file
+
+        Args:
+            stream (file): A file opened in binary mode to write to
+            arg_index (int): Index of the word in each packet line that holds
+                the number of arguments in the packet
+            repeat_threshold (int, optional): Min length of a run of
+                identical packets to compress. If None, runs aren't
+                compressed. Defaults to REPEAT_THRESHOLD.
+        """
+        self.stream = stream
+        self.arg_index = arg_index
+        self.repeat_threshold = repeat_threshold
+        self.size = 0
+        self.count = 0
+        self.max_args = 0
+        self._run_line = None
+        self._run_length = 0
+
+    def fork(self, stream):
+        """
+        Create a writer in the same format to stage part of the data file in
+        another stream before it's copied into this one
+
+        Args:
+            stream (file): A file opened in binary mode to write to
+
+        Returns:
+            DataFile: The new writer
+        """
+        return DataFile(stream, self.arg_index, self.repeat_threshold)
+
+    def update(self, other):
+        """
+        Add the statistics of the packets written by another writer, such as
+        one created by fork(), to this one
+
+        Args:
+            other (DataFile): The other writer
+        """
+        self.count += other.count
+        self.max_args = max(self.max_args, other.max_args)
+
+    def reserve(self, strings):
+        """
+        Reserve strings in the string table of the data file so their indices
+        are known before the data file is written. The text format has no
+        string table.
+
+        Args:
+            strings (Iterable): Strings to reserve
+        """
+
+    def write_preamble(self):
+        """
+        Write anything that must precede the lines of the data file. The text
+        format has nothing to write.
+        """
+
+    @staticmethod
+    def line_size(line):
+        """
+        Get the number of bytes a line takes in the data file
+
+        Args:
+            line (str): The line
+
+        Returns:
+            int: Size of the line in bytes, including its newline
+        """
+        return len(line.encode()) + 1
+
+    def write(self, line):
+        """
+        Write a line verbatim to the data file
+
+        Args:
+            line (str): The line to write
+        """
+        data = (line + "\n").encode()
+        self.stream.write(data)
+        self.size += len(data)
+
+    def append(self, line):
+        """
+        Write a packet to the data file. If it's the same as the last packet,
+        it extends the current run instead.
+
+        Args:
+            line (str): The packet to write
+
+        Returns:
+            DataFile: This writer
+        """
+        if self.repeat_threshold is None:
+            return self._append(line)
+        if line == self._run_line:
+            self._run_length += 1
+            return self
+        self.flush()
+        self._run_line = line
+        self._run_length = 1
+        return self
+
+    def append_once(self, line):
+        """
+        Write a packet that must not be merged into a run with the packets
+        around it, e.g. because it changes which packet is read next
+
+        Args:
+            line (str): The packet to write
+
+        Returns:
+            DataFile: This writer
+        """
+        self.flush()
+        return self._append(line)
+
+    def flush(self):
+        """
+        Write the buffered run of identical packets. Long runs are written as
+        a repeat record followed by the packet. This must be called before the
+        statistics of the writer are used or the packets of a new section of
+        the data file (e.g. a thread) are written.
+
+        Returns:
+            DataFile: This writer
+        """
+        line = self._run_line
+        length = self._run_length
+        if line is None:
+            return self
+        self._run_line = None
+        self._run_length = 0
+        if length >= self.repeat_threshold:
+            self._append(self.repeat_line(length))
+            self._append(line)
+        else:
+            for _ in range(length):
+                self._append(line)
+        return self
+
+    def repeat_line(self, count):
+        """
+        Get the repeat record for a run of packets
+
+        Args:
+            count (int): Number of times to evaluate the next packet
+
+        Returns:
+            str: The record as a line
+        """
+        words = ["repeat"] + ["NULL"] * (self.arg_index - 1)
+        return " ".join(words + ["1", str(count)])
+
+    def _append(self, line):
+        """
+        Write a packet to the data file immediately
+
+        Args:
+            line (str): The packet to write
+
+        Returns:
+            DataFile: This writer
+        """
+        self.write(line)
+        self.count += 1
+        arg_count = int(split_line(line)[self.arg_index])
+        if arg_count > self.max_args:
+            self.max_args = arg_count
+        return self
+
+    def extend(self, lines):
+        """
+        Write a number of packets to the data file
+
+        Args:
+            lines (Iterable): The packets to write
+
+        Returns:
+            DataFile: This writer
+        """
+        for line in lines:
+            self.append(line)
+        return self
+
+    def copy(self, src, size):
+        """
+        Copy a number of bytes verbatim from another file to the data file
+
+        Args:
+            src (file): A file opened in binary mode to copy from
+            size (int): Number of bytes to copy
+        """
+        while size > 0:
+            data = src.read(min(size, COPY_CHUNK_SIZE))
+            if not data:
+                raise EOFError("Unexpected end of file while copying")
+            self.stream.write(data)
+            self.size += len(data)
+            size -= len(data)
+
+
+class BinaryDataFile(DataFile):
+    """
+    Writes the data file in a binary format so the testbench can read it with
+    fixed-size reads instead of parsing text. Lines are passed in the same
+    text form as DataFile and each is converted to a record:
+
+    - the words before arg_index as u32 indices into a string table
+    - the word at arg_index (the argument count, or the value of a header
+      line) as a u64
+    - the width in bytes of the arguments as a u32
+    - each remaining word as an unsigned little-endian integer of that width
+
+    The preamble at the start of the file holds the magic number, the format
+    version and the string table: a u32 count followed by, for each string,
+    its u32 length and its bytes. All integers are little-endian.
+    """
+
+    def __init__(
+        self,
+        stream,
+        arg_index,
+        strings=None,
+        repeat_threshold=REPEAT_THRESHOLD,
+    ):
+        """
+        Initialize a writer for a binary data file
+
+        Args:
+            stream (file): A file opened in binary mode to write to
+            arg_index (int): Index of the word in each packet line that holds
+                the number of arguments in the packet
+            strings (dict, optional): String table to share with another
+                writer. Defaults to a new table with the reserved strings.
+            repeat_threshold (int, optional): Min length of a run of
+                identical packets to compress. If None, runs aren't
+                compressed. Defaults to REPEAT_THRESHOLD.
+        """
+        super().__init__(stream, arg_index, repeat_threshold)
+        if strings is None:
+            strings = {
+                string: i for i, string in enumerate(BINARY_RESERVED_STRINGS)
+            }
+        self.strings = strings
+        self.max_arg_width = 0
+        self._header = struct.Struct(f"<{arg_index}IQI")
+
+    def fork(self, stream):
+        """
+        Create a writer in the same format to stage part of the data file in
+        another stream before it's copied into this one. The string table is
+        shared between the two writers.
+
+        Args:
+            stream (file): A file opened in binary mode to write to
+
+        Returns:
+            BinaryDataFile: The new writer
+        """
+        return BinaryDataFile(
+            stream, self.arg_index, self.strings, self.repeat_threshold
+        )
+
+    def update(self, other):
+        """
+        Add the statistics of the packets written by another writer, such as
+        one created by fork(), to this one
+
+        Args:
+            other (BinaryDataFile): The other writer
+        """
+        super().update(other)
+        self.max_arg_width = max(self.max_arg_width, other.max_arg_width)
+
+    def reserve(self, strings):
+        """
+        Reserve strings in the string table of the data file so their indices
+        are known before the data file is written
+
+        Args:
+            strings (Iterable): Strings to reserve
+        """
+        for string in strings:
+            self._index(string)
+
+    def write_preamble(self):
+        """
+        Write the magic number, version and string table. All the strings used
+        in packets must have been added to the table (i.e. the packets have
+        been staged with a forked writer) before this is called.
+        """
+        data = bytearray(BINARY_MAGIC)
+        data += struct.pack("<II", BINARY_VERSION, len(self.strings))
+        for string in self.strings:
+            encoded = string.encode()
+            data += struct.pack("<I", len(encoded))
+            data += encoded
+        self.stream.write(data)
+        self.size += len(data)
+
+    def _parse(self, line):
+        """
+        Split a line into the fields of its record
+
+        Args:
+            line (str): The line to parse
+
+        Raises:
+            SonarInvalidArgError: Raised if the value or an argument isn't a
+                non-negative decimal integer
+
+        Returns:
+            tuple(list, int, list, int): The strings, value, arguments and
+                width of the arguments in bytes
+        """
+        words = split_line(line)
+        try:
+            value = int(words[self.arg_index])
+            args = [int(word) for word in words[self.arg_index + 1 :]]
+        except ValueError as ex:
+            raise SonarInvalidArgError(
+                f'Can\'t write "{line}" to a binary data file: arguments must '
+                "be decimal integers"
+            ) from ex
+        if args and min(args) < 0:
+            raise SonarInvalidArgError(
+                f'Can\'t write "{line}" to a binary data file: arguments must '
+                "not be negative"
+            )
+        width = max([(arg.bit_length() + 7) // 8 for arg in args], default=0)
+        return words[: self.arg_index], value, args, width
+
+    def line_size(self, line):
+        """
+        Get the number of bytes a line takes in the data file
+
+        Args:
+            line (str): The line
+
+        Returns:
+            int: Size of the line's record in bytes
+        """
+        _, _, args, width = self._parse(line)
+        return self._header.size + len(args) * width
+
+    def _index(self, string):
+        """
+        Get the index of a string in the string table, adding it if needed
+
+        Args:
+            string (str): The string
+
+        Returns:
+            int: Index of the string
+        """
+        try:
+            return self.strings[string]
+        except KeyError:
+            index = len(self.strings)
+            self.strings[string] = index
+            return index
+
+    def write(self, line):
+        """
+        Write a line to the data file as a record
+
+        Args:
+            line (str): The line to write
+
+        Raises:
+            SonarInvalidArgError: Raised if the value or an argument isn't a
+                non-negative decimal integer
+
+        Returns:
+            int: The value of the record
+        """
+        strings, value, args, width = self._parse(line)
+        data = self._header.pack(
+            *[self._index(string) for string in strings], value, width
+        )
+        data += b"".join(arg.to_bytes(width, "little") for arg in args)
+        self.stream.write(data)
+        self.size += len(data)
+        if width > self.max_arg_width:
+            self.max_arg_width = width
+        return value
+
+    def _append(self, line):
+        """
+        Write a packet to the data file as a record immediately
+
+        Args:
+            line (str): The packet to write
+
+        Returns:
+            BinaryDataFile: This writer
+        """
+        arg_count = self.write(line)
+        self.count += 1
+        if arg_count > self.max_args:
+            self.max_args = arg_count
+        return self
@@ -10,12 +10,16 @@ from typing import TYPE_CHECKING, Any, Type, Union
 
 import sonar.interfaces.axi4_lite_slave
 import sonar.interfaces.axi4_stream
+from sonar.core.backends.template import Template
 
 if TYPE_CHECKING:
     import sonar.interfaces.base_interface as base_interface
 
 TAB_SIZE = "    "
 
+# a $$X variable in a block of code
+VARIABLE = re.compile(r"\$\$[^_|\W]+")
+
 
 def get_indentation(keyword, search_str):
     """
@@ -25,11 +29,13 @@ def get_indentation(keyword, search_str):
 
     Args:
         keyword (string): The keyword to search for
-        search_str (string): String to search
+        search_str (string or Template): String to search
 
     Returns:
         string: The indent
     """
+    if isinstance(search_str, Template):
+        return search_str.get_indentation(keyword)
     regex_variable = re.compile(r"\n( *)" + keyword)
     match = re.search(regex_variable, search_str)
     if match:
@@ -44,9 +50,9 @@ def replace_in_testbenches(
     In a testbench, replace a string with another string.
 
     Args:
-        testbenches (str or dict): The testbench to replace text in. This may be
-            a string representing a single testbench or a dictionary where
-            different testbenches are indexed by language
+        testbenches (str, Template or dict): The testbench to replace text in.
+            This may be a single testbench or a dictionary where different
+            testbenches are indexed by language
         search_str (str): String to search for
         replace (str-like): Converted to string and used to replace search_str
         include_langs (iterable, optional): Iterable of a subset of languages to
@@ -57,7 +63,7 @@ def replace_in_testbenches(
     Returns:
         str or dict: The modified testbench. Same type as testbenches
     """
-    if isinstance(testbenches, str):
+    if isinstance(testbenches, (str, Template)):
         testbenches = testbenches.replace(search_str, str(replace))
     else:
         for lang in [*testbenches]:
@@ -113,20 +119,18 @@ def replace_variables(
         str: Updated string
     """
 
-    regex_variable = re.compile(r"\$\$[^_|\W]+")
-    for variable in re.findall(regex_variable, input_string):
+    def replace(match):
         try:
-            new_variable = getattr(interface, variable[2:])
+            new_variable = getattr(interface, match.group(0)[2:])
         except AttributeError:
-            continue
-        else:
-            if isinstance(new_variable, (list, tuple)):
-                if key is None:
-                    raise ValueError
-                new_variable = new_variable[key]
-            input_string = input_string.replace(variable, str(new_variable))
+            return match.group(0)
+        if isinstance(new_variable, (list, tuple)):
+            if key is None:
+                raise ValueError
+            new_variable = new_variable[key]
+        return str(new_variable)
 
-    return input_string
+    return VARIABLE.sub(replace, input_string)
 
 
 def replace_block(target_string, command, interface, indent, key=None):
@@ -209,10 +213,7 @@ def command_var_replace(
         if isinstance(action, dict):
             if "signals" in action:
                 for command in action["commands"]:
-                    regex_signal = re.compile(r"\$\$signal")
-                    if re.findall(
-                        regex_signal, command
-                    ):  # if $$signal in command
+                    if "$$signal" in command:
                         target_string = replace_signals(
                             interface,
                             action,
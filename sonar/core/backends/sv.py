@@ -7,10 +7,13 @@ import itertools
 import logging
 import os
 import re
-from shlex import split as quoteSplit
+import tempfile
 
 import sonar.core.backends.include as include
 import sonar.core.backends.sv_interfaces as sv_interfaces
+from sonar.commands import command_type
+from sonar.core import profiler
+from sonar.core.backends.data_file import DataFile, make_data_file
 from sonar.exceptions import SonarInvalidArgError
 
 logger = logging.getLogger(__name__)
@@ -66,7 +69,9 @@ def add_exerciser_ports(testbench_config, testbench, used_interfaces):
         used_interfaces (dict): Each used interface appears once
 
     Returns:
-        str: Updated testbench
+        tuple(str, list): Updated testbench and the commands that initialize
+            the outputs of the Exerciser, which the INIT_SIGNALS macro expands
+            to
     """
 
     def add_interfaces(exerciser_ports):
@@ -102,22 +107,6 @@ def add_exerciser_ports(testbench_config, testbench, used_interfaces):
                     )
         return exerciser_ports
 
-    def resolve_init_signals():
-        init_commands = []
-        for init_signal in init_signals:
-            init_commands.append({"signal": {"name": init_signal, "value": 0}})
-
-        for i, vector in enumerate(testbench_config.vectors):
-            for j, thread in enumerate(vector.threads):
-                for k, command in enumerate(thread.commands):
-                    if (
-                        "macro" in command
-                        and command["macro"] == "INIT_SIGNALS"
-                    ):
-                        testbench_config.vectors[i].threads[j].commands[k][
-                            "commands"
-                        ] = init_commands
-
     dut = testbench_config.modules["DUT"]
     clocks_in = dut.ports.get_clocks("input")
     signals_in = dut.ports.get_signals("input")
@@ -152,9 +141,12 @@ def add_exerciser_ports(testbench_config, testbench, used_interfaces):
         testbench, "SONAR_EXERCISER_PORTS", exerciser_ports[:-2]
     )
 
-    resolve_init_signals()
+    init_commands = [
+        {"signal": {"name": init_signal, "value": 0}}
+        for init_signal in init_signals
+    ]
 
-    return testbench, testbench_config
+    return testbench, init_commands
 
 
 def instantiate_exerciser(testbench_config, testbench):
@@ -545,19 +537,14 @@ def set_waits(testbench_config, testbench):
 
     replace_str = ""
     leading_spaces = include.get_indentation("SONAR_IF_ELSE_WAIT", testbench)
+    regex_variable = re.compile(r"\$(\d+)")
     for condition in wait_conditions:
         if replace_str != "":
             replace_str += leading_spaces + "else "
         replace_str += (
             'if(interfaceType_par == "' + condition["key"] + '") begin\n'
         )
-        regex_variable = re.compile(r"\$\d+")
-        condition_str = condition["condition"]
-        variables = re.findall(regex_variable, condition["condition"])
-        for variable in variables:
-            condition_str = condition_str.replace(
-                variable, f"args[{variable[1:]}]"
-            )
+        condition_str = regex_variable.sub(r"args[\1]", condition["condition"])
         if not condition_str.endswith(";"):
             condition_str += ";"
         replace_str += leading_spaces + include.TAB_SIZE + condition_str + "\n"
@@ -569,299 +556,420 @@ def set_waits(testbench_config, testbench):
     return testbench
 
 
-def count_commands(commands):
+def write_interface(data_file, transaction, _vector_id, _init_commands):
     """
-    Count the number of actual commands from a list of commands that may contain
-    "macro" commands
+    Write an interface transaction to the data file
 
     Args:
-        commands (list): List of commands
+        data_file (DataFile): The data file to write to
+        transaction (dict): The transaction
+        _vector_id (int): Index of the test vector this command belongs to
+        _init_commands (list): Commands that the INIT_SIGNALS macro expands to
 
     Returns:
-        int: The true number of commands
-    """
-    sv_commands = [
-        "delay",
-        "wait",
-        "signal",
-        "end",
-        "timestamp",
-        "display",
-        "flag",
-    ]
+        DataFile: Updated data_file
+    """
+    curr_interface = include.get_interface(transaction["type"])
+    if "pattern" in transaction:
+        # the pattern record applies to the packet after it so neither can be
+        # part of a run
+        for line in curr_interface.sv_lines(transaction):
+            data_file.append_once(line)
+    else:
+        data_file.extend(curr_interface.sv_lines(transaction))
+    return data_file
+
 
-    count = 0
-    for command in commands:
-        for sv_command in sv_commands:
-            if sv_command in command:
-                count += 1
-                break
-            if "interface" in command:
-                count += len(command["interface"]["payload"])
-                break
-            if "macro" in command and command["macro"] == "INIT_SIGNALS":
-                count += len(command["commands"])
-                break
-            if "macro" in command and command["macro"] == "END":
-                count += 1
-                break
-    return count
-
-
-def write_line(data_file, command, vector_id):
+def write_wait(data_file, wait, _vector_id, _init_commands):
     """
-    Write one command to the data file
+    Write a wait to the data file
 
     Args:
-        data_file (list): List of commands to write
-        command (dict): Current command being written
-        vector_id (int): Index of the test vector this command belongs to
+        data_file (DataFile): The data file to write to
+        wait (dict): The key and args of the wait
+        _vector_id (int): Index of the test vector this command belongs to
+        _init_commands (list): Commands that the INIT_SIGNALS macro expands to
 
     Returns:
-        list: Updated data_file
-    """
-    # pylint: disable=too-many-branches
-    if "interface" in command:
-        curr_interface = include.get_interface(command["interface"]["type"])
-        line = curr_interface.write_sv(command["interface"])
-        if line != "":
-            data_file.append(line)
-    elif "wait" in command:
-        if "value" in command["wait"]:
-            arg = command["wait"]["value"]
-        else:
-            arg = 0
-        txt = "wait " + command["wait"]["key"] + " "
-        if "args" in command["wait"] and command["wait"]["args"]:
-            txt += str(len(command["wait"]["args"]))
-            for arg in command["wait"]["args"]:
-                txt += " " + str(arg)
-        else:
-            txt += "0"
-        data_file.append(txt)
-    elif "signal" in command:
-        # TODO temporary hack for endpoint assignment
-        if "value2" in command["signal"]:
-            data_file.append(
-                "signal "
-                + str(command["signal"]["name"])
-                + " "
-                + str(2)
-                + " "
-                + str(command["signal"]["value"])
-                + " "
-                + str(command["signal"]["value2"])
-            )
-        else:
-            data_file.append(
-                "signal "
-                + str(command["signal"]["name"])
-                + " "
-                + str(1)
-                + " "
-                + str(command["signal"]["value"])
-            )
-    elif "delay" in command:
+        DataFile: Updated data_file
+    """
+    txt = "wait " + wait["key"] + " "
+    if "args" in wait and wait["args"]:
+        txt += str(len(wait["args"]))
+        for arg in wait["args"]:
+            txt += " " + str(arg)
+    else:
+        txt += "0"
+    data_file.append(txt)
+    return data_file
+
+
+def write_signal(data_file, signal, _vector_id, _init_commands):
+    """
+    Write a signal assignment to the data file
+
+    Args:
+        data_file (DataFile): The data file to write to
+        signal (dict): The name and value(s) of the signal
+        _vector_id (int): Index of the test vector this command belongs to
+        _init_commands (list): Commands that the INIT_SIGNALS macro expands to
+
+    Returns:
+        DataFile: Updated data_file
+    """
+    # TODO temporary hack for endpoint assignment
+    if "value2" in signal:
         data_file.append(
-            "delay "
-            + "ns"
+            "signal "
+            + str(signal["name"])
+            + " "
+            + str(2)
+            + " "
+            + str(signal["value"])
+            + " "
+            + str(signal["value2"])
+        )
+    else:
+        data_file.append(
+            "signal "
+            + str(signal["name"])
             + " "
             + str(1)
             + " "
-            + str(command["delay"][:-2])  # TODO fix. Assumes ns
+            + str(signal["value"])
+        )
+    return data_file
+
+
+def write_delay(data_file, delay, _vector_id, _init_commands):
+    """
+    Write a delay to the data file
+
+    Args:
+        data_file (DataFile): The data file to write to
+        delay (str): The delay
+        _vector_id (int): Index of the test vector this command belongs to
+        _init_commands (list): Commands that the INIT_SIGNALS macro expands to
+
+    Returns:
+        DataFile: Updated data_file
+    """
+    data_file.append(
+        "delay "
+        + "ns"
+        + " "
+        + str(1)
+        + " "
+        + str(delay[:-2])  # TODO fix. Assumes ns
+    )
+    return data_file
+
+
+def write_display(data_file, string, _vector_id, _init_commands):
+    """
+    Write a display to the data file
+
+    Args:
+        data_file (DataFile): The data file to write to
+        string (str): The string to display
+        _vector_id (int): Index of the test vector this command belongs to
+        _init_commands (list): Commands that the INIT_SIGNALS macro expands to
+
+    Returns:
+        DataFile: Updated data_file
+    """
+    data_file.append('display "' + str(string) + '" ' + str(1) + " " + "0")
+    return data_file
+
+
+def write_nothing(data_file, _args, _vector_id, _init_commands):
+    """
+    Skip a command that this backend has no use for
+
+    Args:
+        data_file (DataFile): The data file to write to
+        _args (object): The arguments of the command
+        _vector_id (int): Index of the test vector this command belongs to
+        _init_commands (list): Commands that the INIT_SIGNALS macro expands to
+
+    Returns:
+        DataFile: The unchanged data_file
+    """
+    return data_file
+
+
+def write_loop(data_file, loop, _vector_id, _init_commands):
+    """
+    Write the beginning or end of a loop to the data file
+
+    Args:
+        data_file (DataFile): The data file to write to
+        loop (dict): The beginning or end of the loop
+        _vector_id (int): Index of the test vector this command belongs to
+        _init_commands (list): Commands that the INIT_SIGNALS macro expands to
+
+    Returns:
+        DataFile: Updated data_file
+    """
+    # these change which packet is read next so they're never repeated
+    if "begin" in loop:
+        data_file.append_once(
+            "loop " + "begin" + " " + str(1) + " " + str(loop["begin"])
         )
-    elif "display" in command:
+    else:
+        data_file.append_once("loop " + "end" + " " + str(0))
+    return data_file
+
+
+def write_flag(data_file, flag, _vector_id, _init_commands):
+    """
+    Write setting or clearing a flag to the data file
+
+    Args:
+        data_file (DataFile): The data file to write to
+        flag (dict): The flag to set or clear
+        _vector_id (int): Index of the test vector this command belongs to
+        _init_commands (list): Commands that the INIT_SIGNALS macro expands to
+
+    Returns:
+        DataFile: Updated data_file
+    """
+    if "set_flag" in flag:
         data_file.append(
-            'display "' + str(command["display"]) + '" ' + str(1) + " " + "0"
+            "flag " + "set" + " " + str(1) + " " + str(flag["set_flag"])
         )
-    elif "call_dut" in command:
-        pass
-    elif "flag" in command:
-        if "set_flag" in command["flag"]:
-            data_file.append(
-                "flag "
-                + "set"
-                + " "
-                + str(1)
-                + " "
-                + str(command["flag"]["set_flag"])
-            )
-        else:
-            data_file.append(
-                "flag "
-                + "clear"
-                + " "
-                + str(1)
-                + " "
-                + str(command["flag"]["clear_flag"])
-            )
-    elif "timestamp" in command:
+    else:
         data_file.append(
-            "timestamp "
-            + str(command["timestamp"])
+            "flag " + "clear" + " " + str(1) + " " + str(flag["clear_flag"])
+        )
+    return data_file
+
+
+def write_timestamp(data_file, timestamp, _vector_id, _init_commands):
+    """
+    Write a timestamp to the data file
+
+    Args:
+        data_file (DataFile): The data file to write to
+        timestamp (str): The timestamp
+        _vector_id (int): Index of the test vector this command belongs to
+        _init_commands (list): Commands that the INIT_SIGNALS macro expands to
+
+    Returns:
+        DataFile: Updated data_file
+    """
+    data_file.append(
+        "timestamp " + str(timestamp) + " " + str(1) + " " + str(0)
+    )
+    return data_file
+
+
+def write_macro(data_file, macro, vector_id, init_commands):
+    """
+    Write a macro to the data file
+
+    Args:
+        data_file (DataFile): The data file to write to
+        macro (str): The macro
+        vector_id (int): Index of the test vector this command belongs to
+        init_commands (list): Commands that the INIT_SIGNALS macro expands to
+
+    Returns:
+        DataFile: Updated data_file
+    """
+    if macro == "END":
+        data_file.append(
+            "end "
+            + "Vector_"
+            + str(vector_id)
             + " "
             + str(1)
             + " "
-            + str(0)
+            + str(vector_id)
         )
-    elif "macro" in command:
-        if command["macro"] == "END":
-            data_file.append(
-                "end "
-                + "Vector_"
-                + str(vector_id)
-                + " "
-                + str(1)
-                + " "
-                + str(0)
-            )
-        else:
-            for init_command in command["commands"]:
-                data_file = write_line(data_file, init_command, vector_id)
     else:
+        for init_command in init_commands:
+            data_file = write_line(data_file, init_command, vector_id)
+    return data_file
+
+
+# writes each type of command to the data file
+WRITERS = {
+    "interface": write_interface,
+    "wait": write_wait,
+    "signal": write_signal,
+    "delay": write_delay,
+    "display": write_display,
+    "call_dut": write_nothing,
+    "loop": write_loop,
+    "flag": write_flag,
+    "timestamp": write_timestamp,
+    "macro": write_macro,
+}
+
+
+def write_line(data_file, command, vector_id, init_commands=()):
+    """
+    Write one command to the data file
+
+    Args:
+        data_file (DataFile): The data file to write to
+        command (dict): Current command being written
+        vector_id (int): Index of the test vector this command belongs to
+        init_commands (list, optional): Commands that the INIT_SIGNALS macro
+            expands to. Defaults to ().
+
+    Returns:
+        DataFile: Updated data_file
+    """
+    key = command_type(command)
+    writer = WRITERS.get(key)
+    if writer is None:
         logger.error("Unhandled packet type: %s", str(command))
+        return data_file
+    return writer(data_file, command[key], vector_id, init_commands)
 
-    return data_file
 
+def calculate_seeks(thread_sizes, line_size=DataFile.line_size, start=0):
+    """
+    Calculate the byte offsets of every test vector and thread in the
+    data file so the fseek function can work properly during readback. Each
+    thread's packets have a known size so only the seek table lines themselves
+    change size as the offsets are updated. The offsets are recomputed from the
+    sizes alone until the widths of the seek values stop changing, which takes
+    a handful of iterations over the seek table, independent of the number of
+    lines in the data file.
 
-# TODO this is a fairly magic function, should probably make more understandable
-def calculate_seeks(
-    data_file, max_repeat, update_str, seek_str, count_str, converged
-):
+    Args:
+        thread_sizes (list): For each test vector, a list of the sizes of the
+            thread sections (the packet count line and its packets, including
+            newlines) in the vector
+        line_size (Callable, optional): Gets the size of a line in the data
+            file. Defaults to the size of a line in the text format.
+        start (int, optional): Offset of the first line in the data file.
+            Defaults to 0.
+
+    Returns:
+        tuple(list, list): The seek value of each test vector and, for each
+            test vector, a list of the seek values of its threads
+    """
+    vector_seeks = [0] * len(thread_sizes)
+    thread_seeks = [[0] * len(sizes) for sizes in thread_sizes]
+    converged = False
+    while not converged:
+        converged = True
+        offset = start + line_size(f"TestVector count {len(thread_sizes)}")
+        for seek in vector_seeks:
+            offset += line_size(f"TestVector seek {seek}")
+        for i, sizes in enumerate(thread_sizes):
+            if vector_seeks[i] != offset:
+                vector_seeks[i] = offset
+                converged = False
+            offset += line_size(f"ParallelSection count {len(sizes)}")
+            for seek in thread_seeks[i]:
+                offset += line_size(f"ParallelSection seek {seek}")
+            for j, size in enumerate(sizes):
+                if thread_seeks[i][j] != offset:
+                    thread_seeks[i][j] = offset
+                    converged = False
+                offset += size
+    return vector_seeks, thread_seeks
+
+
+def get_shards(vector_num, shards):
     """
-    This function repeats over the generated data file for systemverilog and
-    calculates the character counts for the different packets/parallel sections
-    so the fseek function can work properly during readback. It's repeated
-    until all the values converge to a static value.
+    Split the test vectors into contiguous shards of nearly equal size
 
     Args:
-        data_file (list): List of commands
-        max_repeat (int): Maximum number of times to repeat without convergence
-        update_str (str): ???
-        seek_str (str): ???
-        count_str (str): ???
-        converged (bool): True if the sizes converge
+        vector_num (int): Number of test vectors
+        shards (int): Number of shards
 
     Returns:
-        tuple(list, bool): The data file and converged state
+        list: The range of the indices of the test vectors in each shard
     """
-    # pylint: disable=too-many-locals
-    i = 0
-    while i < max_repeat:
-        char_count = 0
-        continue_count = 0
-        section_found = False
-        continue_count_2 = 0
-        index_to_edit = 0
-        old_size = 0
-        updated = False
-        curr_section_count = 0
-        cumulative_section_count = 0
-        for index, line in enumerate(data_file, 0):
-            char_count += len(line)
-            if update_str is not None and line.startswith(update_str):
-                curr_section_count = int(
-                    line.split()[2]
-                )  # store the # of sections
-                cumulative_section_count += curr_section_count
-            elif line.startswith(seek_str) and not section_found:
-                if continue_count_2 < i:
-                    continue_count_2 += 1
-                else:
-                    old_size = int(line.split()[2])
-                    section_found = True
-                    updated = True
-                    index_to_edit = index
-            elif line.startswith(count_str) and section_found and updated:
-                # This is needed to handle that there will be multiple parallel
-                # sections for each test vector and to ignore the first set(s)
-                # when looking at the next set
-                # if cumulative_section_count - curr_section_count > 0:
-                #     modulo = cumulative_section_count - curr_section_count
-                # else:
-                #     modulo = max_repeat
-
-                # if continue_count < i % (modulo):
-                #     continue_count += 1
-                if cumulative_section_count - curr_section_count > 0:
-                    modulo = i - cumulative_section_count + curr_section_count
-                else:
-                    modulo = i
-
-                if continue_count < modulo:
-                    continue_count += 1
-                else:
-                    # account for new line characters and remove current line
-                    size_diff = index - len(line) + char_count
-                    if old_size != size_diff:
-                        converged = False
-                    data_file[index_to_edit] = seek_str + " " + str(size_diff)
-                    i += 1
-                    continue_count = 0
-                    updated = False
-                    # break
-    return data_file, converged
-
-
-def write_data_file(testbench_config):
-    """
-    Write the data file
+    return [
+        range(vector_num * i // shards, vector_num * (i + 1) // shards)
+        for i in range(shards)
+    ]
+
+
+def write_data_file(
+    testbench_config, data_file, vector_ids=None, init_commands=()
+):
+    """
+    Write the data file. The packets of each thread are first streamed to a
+    temporary file since the seek table at the start of the data file depends
+    on their sizes. Then, the preamble (if any) and seek table are written and
+    the packets are copied after it.
 
     Args:
         testbench_config (Testbench): The testbench configuration
+        data_file (DataFile): The data file to write to
+        vector_ids (Iterable, optional): Indices of the test vectors to write
+            to the data file. Defaults to all of them.
+        init_commands (list, optional): Commands that the INIT_SIGNALS macro
+            expands to. Defaults to ().
 
     Returns:
-        tuple(list, int): The data file commands as a list and max number of
-            threads in any one test vector
+        tuple(int, int): The max number of arguments in any packet and max
+            number of threads in any one test vector
     """
-    data_file = []
-    vector_num = len(testbench_config.vectors)
-    data_file.append("TestVector count " + str(vector_num))
-    for _ in range(vector_num):
-        data_file.append("TestVector seek 0")
-
-    abs_thread_num = 0
+    if vector_ids is None:
+        vector_ids = range(len(testbench_config.vectors))
+    thread_counts = []
+    thread_sizes = []
     max_threads = 0
-    for i, vector in enumerate(testbench_config.vectors):
-        thread_num = len(vector.threads)
-        abs_thread_num += thread_num
-        data_file.append("ParallelSection count " + str(thread_num))
-        if thread_num > max_threads:
-            max_threads = thread_num
-        for _ in range(thread_num):
-            data_file.append("ParallelSection seek 0")
-        for thread in vector.threads:
-            count = count_commands(thread.commands)
-            data_file.append("Packet count " + str(count))
-            for packet in thread.commands:
-                data_file = write_line(data_file, packet, i)
-
-    converged1 = False
-    converged2 = False
-    while not (converged1 and converged2):
-        converged1 = True
-        converged2 = True
-        data_file, converged1 = calculate_seeks(
-            data_file,
-            vector_num,
-            None,
-            "TestVector seek",
-            "ParallelSection count",
-            converged1,
-        )
-        data_file, converged2 = calculate_seeks(
-            data_file,
-            abs_thread_num,
-            "ParallelSection count",
-            "ParallelSection seek",
-            "Packet count",
-            converged2,
-        )
+    with tempfile.TemporaryFile() as packets_file:
+        packets = data_file.fork(packets_file)
+        for i in vector_ids:
+            vector = testbench_config.vectors[i]
+            thread_num = len(vector.threads)
+            if thread_num > max_threads:
+                max_threads = thread_num
+            counts = []
+            sizes = []
+            for thread in vector.threads:
+                count = packets.count
+                size = packets.size
+                for packet in thread.commands:
+                    packets = write_line(packets, packet, i, init_commands)
+                packets.flush()
+                counts.append(packets.count - count)
+                header = "Packet count " + str(counts[-1])
+                sizes.append(data_file.line_size(header) + packets.size - size)
+            thread_counts.append(counts)
+            thread_sizes.append(sizes)
+
+        data_file.update(packets)
+        data_file.write_preamble()
+        with profiler.stage("calculate_seeks"):
+            vector_seeks, thread_seeks = calculate_seeks(
+                thread_sizes, data_file.line_size, data_file.size
+            )
+
+        data_file.write("TestVector count " + str(len(thread_sizes)))
+        for seek in vector_seeks:
+            data_file.write("TestVector seek " + str(seek))
+        packets_file.seek(0)
+        for counts, sizes, seeks in zip(
+            thread_counts, thread_sizes, thread_seeks
+        ):
+            data_file.write("ParallelSection count " + str(len(counts)))
+            for seek in seeks:
+                data_file.write("ParallelSection seek " + str(seek))
+            for count, size in zip(counts, sizes):
+                header = "Packet count " + str(count)
+                data_file.write(header)
+                data_file.copy(
+                    packets_file, size - data_file.line_size(header)
+                )
 
-    return data_file, max_threads
+    return data_file.max_args, max_threads
 
 
-def create_testbench(testbench_config, testbench, directory):
+def create_testbench(
+    testbench_config, testbench, directory, data_file, data_format="text"
+):
     """
     Create the testbench for this language backend
 
@@ -869,62 +977,88 @@ def create_testbench(testbench_config, testbench, directory):
         testbench_config (Testbench): The testbench configuration
         testbench (str): The testbench being generated
         directory (str): Path to the directory to place generated files
+        data_file (file or list): File opened in binary mode to write the data
+            file to. If it's a list of files, the test vectors are split into
+            one shard per file and the testbench selects the shard to run with
+            the +SONAR_SHARD=<index> plusarg
+        data_format (str, optional): Format of the data file (text|bin).
+            Defaults to "text".
 
     Returns:
-        Tuple(str, str): The testbench and the data file
+        str: The testbench
     """
-    testbench = include.set_metadata(testbench_config, testbench)
-    testbench = add_timeformat(testbench_config, testbench)
+    module_name = testbench_config.metadata["Module_Name"]
+    if isinstance(data_file, (list, tuple)):
+        streams = data_file
+        data_filename = f"{module_name}_sv_%0d.dat"
+    else:
+        streams = [data_file]
+        data_filename = f"{module_name}_sv.dat"
+    shards = get_shards(len(testbench_config.vectors), len(streams))
 
-    testbench = include.replace_in_testbenches(
-        testbench, "SONAR_CURR_DATE", datetime.datetime.now()
-    )
-    testbench = include.replace_in_testbenches(
-        testbench,
-        "SONAR_DATA_FILE",
-        '"'
-        + os.path.join(
-            directory, f'{testbench_config.metadata["Module_Name"]}_sv.dat"'
-        ),
-    )
-    testbench = include.replace_in_testbenches(
-        testbench, "SONAR_MAX_VECTORS", len(testbench_config.vectors)
-    )
+    with profiler.stage("substitute_template"):
+        testbench = include.set_metadata(testbench_config, testbench)
+        testbench = add_timeformat(testbench_config, testbench)
 
-    used_interfaces = {}
-    interfaces = testbench_config.get_from_dut("interfaces")
-    for interface in interfaces:
-        used_interfaces[interface.interface_type] = include.get_interface(
-            interface.interface_type
+        testbench = include.replace_in_testbenches(
+            testbench, "SONAR_CURR_DATE", datetime.datetime.now()
+        )
+        testbench = include.replace_in_testbenches(
+            testbench,
+            "SONAR_DATA_FILE",
+            '"' + os.path.join(directory, data_filename) + '"',
+        )
+        testbench = include.replace_in_testbenches(
+            testbench, "SONAR_SHARDS", len(streams)
+        )
+        testbench = include.replace_in_testbenches(
+            testbench,
+            "SONAR_MAX_VECTORS",
+            max(len(vector_ids) for vector_ids in shards),
         )
 
-    testbench, testbench_config = add_exerciser_ports(
-        testbench_config, testbench, used_interfaces
-    )
-    testbench = instantiate_dut(testbench_config, testbench)
-    testbench = instantiate_exerciser(testbench_config, testbench)
+        used_interfaces = {}
+        interfaces = testbench_config.get_from_dut("interfaces")
+        for interface in interfaces:
+            used_interfaces[interface.interface_type] = include.get_interface(
+                interface.interface_type
+            )
 
-    testbench = declare_signals(testbench_config, testbench)
-    testbench = set_signals(testbench_config, testbench, used_interfaces)
-    testbench = set_interfaces(testbench_config, testbench)
-    testbench = create_clocks(testbench_config, testbench)
+        testbench, init_commands = add_exerciser_ports(
+            testbench_config, testbench, used_interfaces
+        )
+        testbench = instantiate_dut(testbench_config, testbench)
+        testbench = instantiate_exerciser(testbench_config, testbench)
 
-    testbench = set_waits(testbench_config, testbench)
+        testbench = declare_signals(testbench_config, testbench)
+        testbench = set_signals(testbench_config, testbench, used_interfaces)
+        testbench = set_interfaces(testbench_config, testbench)
+        testbench = create_clocks(testbench_config, testbench)
 
-    testbench = sv_interfaces.add_signal_endpoints(testbench_config, testbench)
-    testbench = sv_interfaces.add_interfaces(
-        testbench_config, testbench, directory
-    )
+        testbench = set_waits(testbench_config, testbench)
 
-    data_file, max_threads = write_data_file(testbench_config)
+        testbench = sv_interfaces.add_signal_endpoints(
+            testbench_config, testbench
+        )
+        testbench = sv_interfaces.add_interfaces(
+            testbench_config, testbench, directory
+        )
 
+    # the testbench is compiled once for all the shards so it's sized for the
+    # largest of them
     max_args = 0
-    for line in data_file:
-        first_word = line.split(" ")[0]
-        if first_word not in ["TestVector", "ParallelSection", "Packet"]:
-            arg_count = int(quoteSplit(line)[2])
-            if arg_count > max_args:
-                max_args = arg_count
+    max_threads = 0
+    max_arg_bytes = 1
+    with profiler.stage("write_data_file"):
+        for stream, vector_ids in zip(streams, shards):
+            data_file = make_data_file(stream, 2, data_format)
+            shard_args, shard_threads = write_data_file(
+                testbench_config, data_file, vector_ids, init_commands
+            )
+            max_args = max(max_args, shard_args)
+            max_threads = max(max_threads, shard_threads)
+            if data_format == "bin":
+                max_arg_bytes = max(max_arg_bytes, data_file.max_arg_width)
 
     testbench = include.replace_in_testbenches(
         testbench, "SONAR_MAX_ARG_NUM", max_args
@@ -932,5 +1066,16 @@ def create_testbench(testbench_config, testbench, directory):
     testbench = include.replace_in_testbenches(
         testbench, "SONAR_MAX_PARALLEL", max_threads
     )
+    if data_format == "bin":
+        testbench = include.replace_in_testbenches(
+            testbench, "SONAR_DATA_FORMAT", "`define SONAR_BINARY_DATA"
+        )
+    else:
+        testbench = include.replace_in_testbenches(
+            testbench, "SONAR_DATA_FORMAT", ""
+        )
+    testbench = include.replace_in_testbenches(
+        testbench, "SONAR_MAX_ARG_BYTES", max_arg_bytes
+    )
 
-    return testbench, "\n".join(data_file)
+    return testbench
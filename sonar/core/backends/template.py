@@ -0,0 +1,183 @@
+"""
+Render the testbench templates. A template is parsed once into its literal
+text and the SONAR_* placeholders between them. The backends record the
+substitutions for the placeholders and the testbench is rendered in one pass
+at the end instead of searching the whole testbench for every substitution.
+"""
+
+import functools
+import re
+
+# a placeholder in a template. Lowercase letters end it so that e.g.
+# SONAR_MODULE_NAME_tb is SONAR_MODULE_NAME followed by "_tb"
+PLACEHOLDER = re.compile(r"SONAR_[A-Z0-9]+(?:_[A-Z0-9]+)*")
+
+
+def parse(text):
+    """
+    Split text into its literals and placeholders and find the indentation
+    of the placeholders that start a line
+
+    Args:
+        text (str): The text to parse
+
+    Returns:
+        tuple(tuple, tuple, dict): The literals, the placeholders between
+            them and the indentation of each placeholder where it first starts
+            a line
+    """
+    literals = []
+    placeholders = []
+    indents = {}
+    start = 0
+    newline = False
+    for match in PLACEHOLDER.finditer(text):
+        literal = text[start : match.start()]
+        literals.append(literal)
+        placeholders.append(match.group(0))
+        newline = newline or "\n" in literal
+        line = literal[literal.rfind("\n") + 1 :]
+        if newline and not line.strip(" ") and match.group(0) not in indents:
+            indents[match.group(0)] = line
+        start = match.end()
+    literals.append(text[start:])
+    return tuple(literals), tuple(placeholders), indents
+
+
+@functools.lru_cache(maxsize=None)
+def parse_file(filepath):
+    """
+    Read and parse a template file. Each file is only parsed once.
+
+    Args:
+        filepath (str): Path to the template
+
+    Returns:
+        tuple(tuple, tuple, dict): The parsed template
+    """
+    with open(filepath, "r") as f:
+        return parse(f.read())
+
+
+class Template:
+    """
+    A testbench being rendered from a template. Substitutions are applied in
+    the order they're made, the same way as replacing them in a string one
+    after another: if a substituted value contains placeholders, they're
+    replaced by the substitutions made after it.
+    """
+
+    def __init__(self, text="", parsed=None):
+        """
+        Initialize the testbench from its template
+
+        Args:
+            text (str, optional): The template. Defaults to "".
+            parsed (tuple, optional): The template already parsed. Defaults to
+                None.
+        """
+        if parsed is None:
+            parsed = parse(text)
+        self.literals, self.placeholders, self.indents = parsed
+        # for each placeholder, the substitutions made as tuples of the order
+        # they were made in and their value
+        self.substitutions = {}
+        self.count = 0
+        self._rendered = {}
+
+    @classmethod
+    def from_file(cls, filepath):
+        """
+        Create a testbench from a template file
+
+        Args:
+            filepath (str): Path to the template
+
+        Returns:
+            Template: The testbench
+        """
+        return cls(parsed=parse_file(filepath))
+
+    def replace(self, search_str, replace_str):
+        """
+        Replace a string in the testbench. Placeholders are substituted when
+        rendered, any other string is replaced immediately.
+
+        Args:
+            search_str (str): String to search for
+            replace_str (str): String to replace it with
+
+        Returns:
+            Template: The testbench
+        """
+        if PLACEHOLDER.fullmatch(search_str) is None:
+            text = str(self).replace(search_str, replace_str)
+            self.__init__(text)
+            return self
+        self.substitutions.setdefault(search_str, []).append(
+            (self.count, replace_str)
+        )
+        self.count += 1
+        return self
+
+    def get_indentation(self, keyword):
+        """
+        Find the indentation of a placeholder that starts a line
+
+        Args:
+            keyword (str): The placeholder
+
+        Returns:
+            str: The indent
+        """
+        if keyword in self.indents and keyword not in self.substitutions:
+            return self.indents[keyword]
+        match = re.search(r"\n( *)" + keyword, str(self))
+        if match:
+            return match.group(1)
+        return ""
+
+    def _substitute(self, placeholder, count):
+        """
+        Get what a placeholder is replaced with in text added after some
+        number of substitutions have been made
+
+        Args:
+            placeholder (str): The placeholder
+            count (int): Number of substitutions made before the text was added
+
+        Returns:
+            str: The rendered replacement
+        """
+        for index, value in self.substitutions.get(placeholder, ()):
+            if index >= count:
+                if index not in self._rendered:
+                    self._rendered[index] = (
+                        self._render(*parse(value)[:2], index + 1)
+                        if "SONAR_" in value
+                        else value
+                    )
+                return self._rendered[index]
+        return placeholder
+
+    def _render(self, literals, placeholders, count):
+        """
+        Render text with the substitutions made after some point
+
+        Args:
+            literals (tuple): The literals of the text
+            placeholders (tuple): The placeholders between the literals
+            count (int): Number of substitutions made before the text was added
+
+        Returns:
+            str: The rendered text
+        """
+        parts = [literals[0]]
+        for placeholder, literal in zip(placeholders, literals[1:]):
+            parts.append(self._substitute(placeholder, count))
+            parts.append(literal)
+        return "".join(parts)
+
+    def __str__(self):
+        self._rendered = {}
+        return self._render(self.literals, self.placeholders, 0)
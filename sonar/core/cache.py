@@ -0,0 +1,214 @@
+"""
+A cache of the generated testbenches. Each language is keyed by a hash of
+everything that goes into its testbench: the legalized configuration, sonar's
+templates and backends, and the options used to generate it. The keys of the
+last generation are stored in the build directory so unchanged testbenches
+aren't generated again.
+"""
+
+import functools
+import hashlib
+import json
+import os
+
+import sonar
+from sonar.commands import Commands, SpilledCommands
+from sonar.core.combinations import PrefixedCommands
+from sonar.core.compiled import CompiledCommands
+
+CACHE_FILENAME = ".sonar_cache.json"
+
+
+def _encode_default(obj):
+    """
+    Encode objects that JSON doesn't support in a way that is stable between
+    runs. Classes (e.g. endpoints) are encoded by name along with the
+    arguments set on them, objects that define cache_key() (e.g. payloads
+    read lazily from a file) by its result and other objects by their
+    attributes.
+
+    Args:
+        obj (object): The object to encode
+
+    Returns:
+        object: A JSON-serializable representation of the object
+    """
+    if isinstance(obj, type):
+        return {
+            "class": f"{obj.__module__}.{obj.__qualname__}",
+            "arguments": getattr(obj, "arguments", None),
+        }
+    if hasattr(obj, "cache_key"):
+        return obj.cache_key()
+    if hasattr(obj, "__dict__"):
+        return {
+            "class": f"{type(obj).__module__}.{type(obj).__qualname__}",
+            "attributes": vars(obj),
+        }
+    return repr(obj)
+
+
+_encoder = json.JSONEncoder(
+    sort_keys=True, separators=(",", ":"), default=_encode_default
+)
+
+
+@functools.lru_cache(maxsize=None)
+def hash_sources():
+    """
+    Hash the templates and code in sonar that generate the testbenches. All
+    the files in the package are hashed since the testbenches depend on more
+    than the backends (e.g. the endpoints and how commands are stored).
+
+    Returns:
+        str: The hash
+    """
+    hasher = hashlib.sha256(sonar.__version__.encode())
+    root = os.path.dirname(sonar.__file__)
+    filepaths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if name != "__pycache__"]
+        filepaths.extend(
+            os.path.join(dirpath, filename) for filename in filenames
+        )
+    for filepath in sorted(filepaths):
+        hasher.update(os.path.relpath(filepath, root).encode() + b"\0")
+        with open(filepath, "rb") as f:
+            hasher.update(f.read())
+        hasher.update(b"\0")
+    return hasher.hexdigest()
+
+
+def hash_commands(hasher, commands):
+    """
+    Add the commands of a thread to a hash. Compactly stored and spilled
+    commands are hashed from their arrays or log rather than converted back to
+    dictionaries.
+
+    Args:
+        hasher (hashlib.HASH): The hash
+        commands (Sequence): The commands
+    """
+    if isinstance(commands, PrefixedCommands):
+        hash_commands(hasher, commands.prefix)
+        hash_commands(hasher, commands.commands)
+    elif isinstance(commands, CompiledCommands):
+        hash_commands(hasher, commands.prefix)
+        hash_commands(hasher, commands.commands)
+        hash_commands(hasher, commands.suffix)
+        if commands.waits is not None:
+            hasher.update(
+                _encoder.encode(sorted(commands.waits.items())).encode()
+            )
+    elif isinstance(commands, Commands):
+        for column in (commands.opcodes, commands.operands, commands.values):
+            hasher.update(len(column).to_bytes(8, "little"))
+            hasher.update(column.tobytes())
+        hasher.update(
+            _encoder.encode([commands.strings, commands.objects]).encode()
+        )
+    elif isinstance(commands, SpilledCommands):
+        hasher.update(commands.offsets.tobytes())
+        for block in commands.blocks():
+            hasher.update(block)
+    else:
+        hasher.update(_encoder.encode(list(commands)).encode())
+
+
+def hash_testbench(testbench_config):
+    """
+    Hash the testbench configuration. The test vectors are hashed one thread
+    at a time so the whole configuration is never held as a dictionary. The
+    interfaces are hashed with all their attributes since their dictionaries
+    don't include everything the backends use (e.g. the endpoints).
+
+    Args:
+        testbench_config (CompiledTestbench): The legalized testbench
+
+    Returns:
+        str: The hash
+    """
+    hasher = hashlib.sha256()
+    interfaces = []
+    if "DUT" in testbench_config.modules:
+        interfaces = testbench_config.get_from_dut("interfaces")
+    sonar_dict = {
+        "metadata": testbench_config.metadata,
+        "modules": {
+            module.name: module.asdict()
+            for module in testbench_config.modules.values()
+        },
+        "wait_conditions": testbench_config.wait_conditions,
+        "interfaces": interfaces,
+    }
+    hasher.update(_encoder.encode(sonar_dict).encode())
+    for vector in testbench_config.vectors:
+        hasher.update(b"\nvector")
+        for thread in vector.threads:
+            hasher.update(b"\nthread")
+            hash_commands(hasher, thread.commands)
+    return hasher.hexdigest()
+
+
+def get_keys(testbench_config, langs, directory, data_format, shards=1):
+    """
+    Get the cache key of the testbench in each language
+
+    Args:
+        testbench_config (CompiledTestbench): The legalized testbench
+        langs (tuple): Languages of the testbenches
+        directory (str): Directory the testbenches are generated in
+        data_format (str): Format of the data files
+        shards (int, optional): Number of data files the test vectors are
+            split into. Defaults to 1.
+
+    Returns:
+        dict: The key for each language
+    """
+    common = hashlib.sha256()
+    common.update(hash_sources().encode())
+    common.update(hash_testbench(testbench_config).encode())
+    common.update(os.path.abspath(directory).encode())
+    common.update(data_format.encode())
+    common.update(str(shards).encode())
+    keys = {}
+    for lang in langs:
+        hasher = common.copy()
+        hasher.update(lang.encode())
+        keys[lang] = hasher.hexdigest()
+    return keys
+
+
+def read_cache(directory):
+    """
+    Read the keys of the testbenches last generated in a directory
+
+    Args:
+        directory (str): Directory the testbenches are generated in
+
+    Returns:
+        dict: The key for each language. Empty if there's no valid cache
+    """
+    try:
+        with open(os.path.join(directory, CACHE_FILENAME), "r") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict):
+        return {}
+    return cache
+
+
+def write_cache(directory, cache):
+    """
+    Write the keys of the generated testbenches to a directory. The file is
+    replaced atomically so an interrupted write can't leave a partial cache.
+
+    Args:
+        directory (str): Directory the testbenches are generated in
+        cache (dict): The key for each language
+    """
+    filepath = os.path.join(directory, CACHE_FILENAME)
+    with open(filepath + ".tmp", "w") as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+    os.replace(filepath + ".tmp", filepath)
@@ -0,0 +1,188 @@
+"""
+Lazy views of the test vectors in a testbench with every combination of the
+endpoints of its interfaces. Each combination is a test vector whose first
+thread starts by selecting the endpoints. The commands of the test vectors are
+shared between all the combinations rather than copied.
+"""
+
+from collections.abc import Sequence
+
+from sonar.base_types import SonarObject
+
+
+def select_endpoint(interface_index, endpoint_index):
+    """
+    Create the command that selects the endpoint of an interface
+
+    Args:
+        interface_index (int): Index of the interface in the DUT
+        endpoint_index (int): Index of the endpoint in the interface
+
+    Returns:
+        dict: The command
+    """
+    return {
+        "signal": {
+            "name": "endpoint_select",
+            "value": interface_index,
+            "value2": endpoint_index,
+        }
+    }
+
+
+class PrefixedCommands(Sequence):
+    """
+    The commands of a thread with some commands added before them, without
+    copying either
+    """
+
+    def __init__(self, prefix, commands):
+        """
+        Initialize the commands
+
+        Args:
+            prefix (Sequence): Commands to add at the start
+            commands (Sequence): The commands of the thread
+        """
+        self.prefix = prefix
+        self.commands = commands
+
+    def __len__(self):
+        return len(self.prefix) + len(self.commands)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Command index out of range")
+        if index < len(self.prefix):
+            return self.prefix[index]
+        return self.commands[index - len(self.prefix)]
+
+    def __iter__(self):
+        yield from self.prefix
+        yield from self.commands
+
+
+class EndpointThread(SonarObject):
+    """
+    A view of a thread that starts by selecting endpoints
+    """
+
+    def __init__(self, thread, prefix):
+        """
+        Initialize the view
+
+        Args:
+            thread (Thread): The thread
+            prefix (Sequence): Commands that select the endpoints
+        """
+        self.thread = thread
+        self.commands = PrefixedCommands(prefix, thread.commands)
+
+    def asdict(self):
+        """
+        Converts the object to a dictionary
+
+        Returns:
+            list: The commands of the thread
+        """
+        return list(self.commands)
+
+
+class EndpointVector(SonarObject):
+    """
+    A view of a test vector whose first thread starts by selecting endpoints
+    """
+
+    def __init__(self, vector, prefix):
+        """
+        Initialize the view
+
+        Args:
+            vector (TestVector): The test vector
+            prefix (Sequence): Commands that select the endpoints
+        """
+        self.vector = vector
+        self.threads = [EndpointThread(vector.threads[0], prefix)]
+        self.threads.extend(vector.threads[1:])
+
+    def asdict(self):
+        """
+        Converts the object to a dictionary
+
+        Returns:
+            list: The threads of the test vector
+        """
+        return [thread.asdict() for thread in self.threads]
+
+
+class EndpointCombinations(Sequence):
+    """
+    The test vectors of a testbench repeated for every combination of the
+    endpoints of its interfaces. Combinations are ordered the same way as
+    repeating the whole list of test vectors once per endpoint for each
+    interface in turn, i.e. the last interface varies the slowest.
+    """
+
+    def __init__(self, vectors, endpoint_nums):
+        """
+        Initialize the combinations
+
+        Args:
+            vectors (list): The test vectors of the testbench
+            endpoint_nums (list): The number of endpoints of each interface
+        """
+        self.vectors = vectors
+        self.endpoint_nums = endpoint_nums
+        self.selects = [
+            [select_endpoint(i, j) for j in range(endpoint_num)]
+            for i, endpoint_num in enumerate(endpoint_nums)
+        ]
+        self.size = len(vectors)
+        for endpoint_num in endpoint_nums:
+            self.size *= max(endpoint_num, 1)
+
+    def __len__(self):
+        return self.size
+
+    def get_selection(self, index):
+        """
+        Get the test vector and endpoints used in a combination
+
+        Args:
+            index (int): Index of the combination
+
+        Returns:
+            tuple(TestVector, tuple): The test vector and the index of the
+                endpoint selected for each interface (None if the interface
+                has no endpoints)
+        """
+        index, vector_index = divmod(index, len(self.vectors))
+        selection = []
+        for endpoint_num in self.endpoint_nums:
+            if endpoint_num == 0:
+                selection.append(None)
+            else:
+                index, endpoint_index = divmod(index, endpoint_num)
+                selection.append(endpoint_index)
+        return self.vectors[vector_index], tuple(selection)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Test vector index out of range")
+        vector, selection = self.get_selection(index)
+        # each interface's selection was inserted at the start in turn so the
+        # last interface's is first
+        prefix = [
+            self.selects[i][endpoint_index]
+            for i, endpoint_index in reversed(list(enumerate(selection)))
+            if endpoint_index is not None
+        ]
+        return EndpointVector(vector, prefix)
@@ -0,0 +1,290 @@
+"""
+The compiled form of a testbench that the backends generate testbenches from.
+Legalizing a testbench compiles it into new objects that view the user's
+threads rather than changing them, so one testbench can be compiled any number
+of times and one compiled testbench can be generated any number of times (e.g.
+for each language or number of shards) with the same result.
+"""
+
+from collections.abc import Sequence
+
+from sonar.base_types import SonarObject
+
+
+class CompiledCommands(Sequence):
+    """
+    The commands of a compiled thread: the commands of a thread with commands
+    added before and after them and the keys of their wait conditions
+    resolved. The original commands are neither copied nor modified.
+    """
+
+    def __init__(self, commands, prefix=(), suffix=(), waits=None):
+        """
+        Initialize the commands
+
+        Args:
+            commands (Sequence): The commands of the thread
+            prefix (Iterable, optional): Commands to add at the start.
+                Defaults to ().
+            suffix (Iterable, optional): Commands to add at the end. Defaults
+                to ().
+            waits (dict, optional): Maps the condition and number of args of
+                each wait to its key and any args to append to its args.
+                Defaults to None.
+        """
+        self.commands = commands
+        self.prefix = tuple(prefix)
+        self.suffix = tuple(suffix)
+        self.waits = waits
+
+    def replace(self, prefix=(), suffix=(), waits=None):
+        """
+        Get new commands with more commands added around these ones or with
+        the wait conditions resolved
+
+        Args:
+            prefix (Iterable, optional): Commands to add at the start.
+                Defaults to ().
+            suffix (Iterable, optional): Commands to add at the end. Defaults
+                to ().
+            waits (dict, optional): Replaces the resolved wait conditions if
+                given. Defaults to None.
+
+        Returns:
+            CompiledCommands: The new commands
+        """
+        return CompiledCommands(
+            self.commands,
+            tuple(prefix) + self.prefix,
+            self.suffix + tuple(suffix),
+            self.waits if waits is None else waits,
+        )
+
+    def _resolve(self, command):
+        """
+        Resolve the key of a wait command
+
+        Args:
+            command (dict): The command
+
+        Returns:
+            dict: The command with its wait resolved if it's a wait
+        """
+        if self.waits is None or "wait" not in command:
+            return command
+        wait = command["wait"]
+        args = wait.get("args", ())
+        resolved = self.waits.get((wait["key"], len(args)))
+        if resolved is None:
+            return command
+        key, extra_args = resolved
+        wait = dict(wait, key=key)
+        if extra_args:
+            wait["args"] = tuple(args) + extra_args
+        return {"wait": wait}
+
+    def __len__(self):
+        return len(self.prefix) + len(self.commands) + len(self.suffix)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Command index out of range")
+        if index < len(self.prefix):
+            return self._resolve(self.prefix[index])
+        index -= len(self.prefix)
+        if index < len(self.commands):
+            return self._resolve(self.commands[index])
+        return self._resolve(self.suffix[index - len(self.commands)])
+
+    def __iter__(self):
+        if self.waits is None:
+            yield from self.prefix
+            yield from self.commands
+            yield from self.suffix
+            return
+        for commands in (self.prefix, self.commands, self.suffix):
+            for command in commands:
+                yield self._resolve(command)
+
+
+class CompiledThread(SonarObject):
+    """
+    A thread of a compiled testbench
+    """
+
+    def __init__(self, thread, commands):
+        """
+        Initialize the thread
+
+        Args:
+            thread (Thread): The user's thread
+            commands (CompiledCommands): The commands of the compiled thread
+        """
+        self.thread = thread
+        self.commands = commands
+
+    def replace(self, **kwargs):
+        """
+        Get a new thread with its commands changed. See
+        CompiledCommands.replace()
+
+        Args:
+            kwargs: Arguments of CompiledCommands.replace()
+
+        Returns:
+            CompiledThread: The new thread
+        """
+        return CompiledThread(self.thread, self.commands.replace(**kwargs))
+
+    def asdict(self):
+        """
+        Converts the object to a dictionary
+
+        Returns:
+            list: The commands of the thread
+        """
+        return list(self.commands)
+
+
+class CompiledVector(SonarObject):
+    """
+    A test vector of a compiled testbench
+    """
+
+    def __init__(self, vector, threads):
+        """
+        Initialize the test vector
+
+        Args:
+            vector (TestVector): The user's test vector
+            threads (Iterable): The compiled threads
+        """
+        self.vector = vector
+        self.threads = tuple(threads)
+
+    def asdict(self):
+        """
+        Converts the object to a dictionary
+
+        Returns:
+            list: The threads of the test vector
+        """
+        return [thread.asdict() for thread in self.threads]
+
+
+class CompiledTestbench(SonarObject):
+    """
+    A testbench after legalization. It shares the metadata and modules of the
+    user's testbench and views its test vectors.
+    """
+
+    def __init__(
+        self,
+        testbench,
+        vectors,
+        wait_conditions=(),
+        prologue_thread=None,
+    ):
+        """
+        Initialize the compiled testbench
+
+        Args:
+            testbench (Testbench): The user's testbench
+            vectors (Sequence): The compiled test vectors
+            wait_conditions (Iterable, optional): The wait conditions and
+                their keys. Defaults to ().
+            prologue_thread (Thread, optional): The prologue thread if it
+                hasn't been added to the test vectors yet. Defaults to None.
+        """
+        self.testbench = testbench
+        self.metadata = testbench.metadata
+        self.modules = testbench.modules
+        self.vectors = vectors
+        self.wait_conditions = tuple(wait_conditions)
+        self.prologue_thread = prologue_thread
+
+    @classmethod
+    def from_testbench(cls, testbench):
+        """
+        Start compiling a testbench. Its threads are viewed as they are.
+
+        Args:
+            testbench (Testbench): The user's testbench. If it's already
+                compiled, it's returned as it is
+
+        Returns:
+            CompiledTestbench: The compiled testbench
+        """
+        if isinstance(testbench, cls):
+            return testbench
+        vectors = tuple(
+            CompiledVector(
+                vector,
+                [
+                    CompiledThread(thread, CompiledCommands(thread.commands))
+                    for thread in vector.threads
+                ],
+            )
+            for vector in testbench.vectors
+        )
+        return cls(
+            testbench,
+            vectors,
+            testbench.wait_conditions,
+            testbench.prologue_thread,
+        )
+
+    def replace(self, **kwargs):
+        """
+        Get a new compiled testbench with some of its attributes changed
+
+        Args:
+            kwargs: The attributes to change: vectors, wait_conditions or
+                prologue_thread
+
+        Returns:
+            CompiledTestbench: The new compiled testbench
+        """
+        attributes = {
+            "vectors": self.vectors,
+            "wait_conditions": self.wait_conditions,
+            "prologue_thread": self.prologue_thread,
+        }
+        attributes.update(kwargs)
+        return CompiledTestbench(self.testbench, **attributes)
+
+    def get_from_dut(self, key):
+        """
+        Get certain parts of the DUT from the testbench. See
+        Testbench.get_from_dut()
+
+        Args:
+            key (str): Key used to access different parts
+
+        Returns:
+            various: Return type depends on the key
+        """
+        if key == "wait_conditions":
+            return self.wait_conditions
+        return self.testbench.get_from_dut(key)
+
+    def asdict(self):
+        """
+        Converts the object to a dictionary
+
+        Returns:
+            dict: Dictionary representing the object
+        """
+        return {
+            "metadata": self.metadata,
+            "modules": {
+                module.name: module.asdict()
+                for module in self.modules.values()
+            },
+            "wait_conditions": list(self.wait_conditions),
+            "vectors": [vector.asdict() for vector in self.vectors],
+        }
@@ -2,51 +2,77 @@
 Generate the testbenches based on the configuration defined by the user.
 """
 
+import contextlib
+import json
 import logging
+import multiprocessing
 import os
-from copy import deepcopy
+import re
+from concurrent.futures import ProcessPoolExecutor
 
+from sonar.core import cache as tb_cache
+from sonar.core import profiler
 from sonar.core.backends.common import prologue
 from sonar.core.backends.cpp import create_testbench as create_cpp_testbench
+from sonar.core.backends.data_file import DATA_FORMATS
 from sonar.core.backends.sv import create_testbench as create_sv_testbench
+from sonar.core.backends.template import Template
+from sonar.core.combinations import EndpointCombinations
+from sonar.core.compiled import (
+    CompiledCommands,
+    CompiledTestbench,
+    CompiledThread,
+    CompiledVector,
+)
 from sonar.exceptions import SonarInvalidArgError
 
 logger = logging.getLogger(__file__)
 
+BACKENDS = {"sv": create_sv_testbench, "cpp": create_cpp_testbench}
 
-def filter_langs(active_langs, sonar_tb_filepath):
+PROFILE_FILENAME = "sonar_profile.json"
+
+# the legalized testbench configuration shared with forked worker processes
+_snapshot = None
+
+# an integer literal compared against in a wait condition. Literals with a size
+# or base (e.g. 1'b1) are not matched
+COMPARISON_LITERAL = re.compile(r"((?:[=!]==?|[<>]=?)\s*)(\d+)(?![\w'.])")
+
+
+def filter_langs(active_langs, sonar_tb_filepath, keys, cache, shards=1):
     """
-    If any of the generated testbenches are newer than the sonar testbench
-    script, skip generating it. This probably implies the user has manually
-    edited the generated testbench.
+    Skip generating the testbenches whose cache key is unchanged since they
+    were last generated, provided their files still exist.
 
     Args:
         active_langs (tuple): Original list of languages to use
+        sonar_tb_filepath (str): Path to the Python file used to generate
+            testbench_config
+        keys (dict): The cache key of the testbench in each language
+        cache (dict): The cache keys of the last generated testbenches
+        shards (int, optional): Number of data files the test vectors are
+            split into. Defaults to 1.
 
     Returns:
         tuple: Filtered list of languages to generate testbenches for
     """
-    try:
-        sonar_tb_file_time = os.path.getmtime(sonar_tb_filepath)
-    except FileNotFoundError:
-        # in this case, the testbench is being generated not relative to the
-        # source sonar testbench file or there's a typo. Log it and move on
-        logger.warning(
-            "File %s not found, so not filtering languages by creation time",
-            sonar_tb_filepath,
-        )
-        return active_langs
     active_langs_tmp = []
     for lang in active_langs:
-        if os.path.exists(get_tb_filepath(sonar_tb_filepath, lang)):
-            tb_time = os.path.getmtime(
-                get_tb_filepath(sonar_tb_filepath, lang)
+        if (
+            cache.get(lang) != keys[lang]
+            or not os.path.exists(get_tb_filepath(sonar_tb_filepath, lang))
+            or not all(
+                os.path.exists(filepath)
+                for filepath in get_data_filepaths(
+                    sonar_tb_filepath, lang, shards
+                )
             )
-            if tb_time <= sonar_tb_file_time:
-                active_langs_tmp.append(lang)
-        else:
+        ):
             active_langs_tmp.append(lang)
-    return active_langs_tmp
+        else:
+            logger.info("Testbench for %s is unchanged, skipping", lang)
+    return tuple(active_langs_tmp)
 
 
 def parse_sonar_tb(sonar_tb_filepath):
@@ -84,7 +110,7 @@ def get_tb_filepath(sonar_tb_filepath, lang):
     return os.path.join(directory, dut_name + f"_tb.{lang}")
 
 
-def get_data_filepath(sonar_tb_filepath, lang):
+def get_data_filepath(sonar_tb_filepath, lang, shard=None):
     """
     Get the path of the generated data file for a particular language
 
@@ -92,48 +118,90 @@ def get_data_filepath(sonar_tb_filepath, lang):
         sonar_tb_filepath (str): Path to the file used to create the
             testbench_config
         lang (str): Language of the testbench
+        shard (int, optional): Index of the shard if the test vectors are
+            split into multiple data files. Defaults to None.
 
     Returns:
         str: Path to the data file
     """
     dut_name, directory = parse_sonar_tb(sonar_tb_filepath)
-    return os.path.join(directory, dut_name + f"_{lang}.dat")
+    if shard is None:
+        return os.path.join(directory, dut_name + f"_{lang}.dat")
+    return os.path.join(directory, dut_name + f"_{lang}_{shard}.dat")
+
+
+def get_data_filepaths(sonar_tb_filepath, lang, shards=1):
+    """
+    Get the paths of all the generated data files for a particular language.
+    Only the SV testbench can split its test vectors into shards.
+
+    Args:
+        sonar_tb_filepath (str): Path to the file used to create the
+            testbench_config
+        lang (str): Language of the testbench
+        shards (int, optional): Number of data files the test vectors are
+            split into. Defaults to 1.
 
+    Returns:
+        list: Paths to the data files
+    """
+    if shards == 1 or lang != "sv":
+        return [get_data_filepath(sonar_tb_filepath, lang)]
+    return [
+        get_data_filepath(sonar_tb_filepath, lang, shard)
+        for shard in range(shards)
+    ]
 
-def finalize_waits(testbench_config):
+
+def parametrize_condition(condition, args):
+    """
+    Replace the integer literals compared against in a wait condition with
+    variables so that conditions that differ only in these values can share
+    one key. The values are appended to the condition's args. Literals in bit
+    ranges or with a size or base (e.g. 1'b1) are left as they are.
+
+    Args:
+        condition (str): The wait condition
+        args (Iterable): The existing args of the condition
+
+    Returns:
+        tuple(str, tuple): The parametrized condition and its args
+    """
+    args = list(args)
+
+    def parametrize(match):
+        args.append(int(match.group(2)))
+        return f"{match.group(1)}${len(args) - 1}"
+
+    condition = COMPARISON_LITERAL.sub(parametrize, condition)
+    return condition, tuple(args)
+
+
+def finalize_waits(testbench_config, parametrize=False):
     """
     Using the test vectors in the testbench, this method aggregates all the
-    wait conditions as required for the Sonar backend
+    wait conditions as required for the Sonar backend and resolves the key of
+    each wait
 
     Args:
-        testbench_config (Testbench): The user-defined testbench configuration
+        testbench_config (Testbench): The user-defined or compiled testbench
+        parametrize (bool, optional): Parametrize the integer literals that
+            conditions compare against so conditions that differ only in these
+            values share one key. Defaults to False.
 
     Returns:
-        Testbench: Updated testbench configuration
-    """
-
-    def update_waits(index, temp_key):
-        if temp_key.isdigit():
-            if int(temp_key) >= index:
-                raise Exception
-            return None, index
-        if temp_key not in conditions:
-            new_key = str(index)
-            waits.append({"condition": temp_key, "key": new_key})
-            conditions.append(temp_key)
-            index += 1
-            return new_key, index
-        for wait in waits:
-            if wait["condition"] == temp_key:
-                key = wait["key"]
-                break
-        return key, index
+        CompiledTestbench: The compiled testbench with the waits resolved
+    """
 
+    compiled = CompiledTestbench.from_testbench(testbench_config)
     waits = []
-    conditions = []
+    # maps each condition to its key
+    conditions = {}
+    # maps each condition and number of args as written by the user to its
+    # key and the args to append
+    resolved = {}
     flag_present = False
-    index = 0
-    for vector in testbench_config.vectors:
+    for vector in compiled.vectors:
         for thread in vector.threads:
             for command in thread.commands:
                 if "wait" in command:
@@ -141,13 +209,37 @@ def finalize_waits(testbench_config):
                     if temp_key == "flag":
                         flag_present = True
                         continue
-                    updated_key, index = update_waits(index, temp_key)
-                    if updated_key:
-                        command["wait"]["key"] = updated_key
+                    if temp_key.isdigit():
+                        if int(temp_key) >= len(waits):
+                            raise Exception
+                        continue
+                    args = tuple(command["wait"].get("args", ()))
+                    if (temp_key, len(args)) in resolved:
+                        continue
+                    condition = temp_key
+                    if parametrize:
+                        condition, all_args = parametrize_condition(
+                            temp_key, args
+                        )
+                        extra_args = all_args[len(args) :]
+                    else:
+                        extra_args = ()
+                    key = conditions.get(condition)
+                    if key is None:
+                        key = str(len(waits))
+                        waits.append({"condition": condition, "key": key})
+                        conditions[condition] = key
+                    resolved[(temp_key, len(args))] = (key, extra_args)
     if flag_present:
         waits.append({"condition": "wait(flags[args[0]]);", "key": "flag"})
-    testbench_config.wait_conditions = waits
-    return testbench_config
+    vectors = tuple(
+        CompiledVector(
+            vector.vector,
+            [thread.replace(waits=resolved) for thread in vector.threads],
+        )
+        for vector in compiled.vectors
+    )
+    return compiled.replace(vectors=vectors, wait_conditions=waits)
 
 
 def configure_prologue(testbench_config):
@@ -156,83 +248,262 @@ def configure_prologue(testbench_config):
     threads to wait for it to finish
 
     Args:
-        testbench_config (Testbench): The user-defined testbench configuration
+        testbench_config (Testbench): The user-defined or compiled testbench
 
     Returns:
-        Testbench: Updated testbench configuration
+        CompiledTestbench: The compiled testbench with the prologue added
     """
-    if testbench_config.prologue_thread is None:
-        return testbench_config
-    prologue_thread = testbench_config.prologue_thread
-    prologue_thread.commands.insert(
-        0, {"signal": {"name": "test_prologue", "value": 1}}
+    compiled = CompiledTestbench.from_testbench(testbench_config)
+    if compiled.prologue_thread is None:
+        return compiled
+    prologue_thread = CompiledThread(
+        compiled.prologue_thread,
+        CompiledCommands(
+            compiled.prologue_thread.commands,
+            [{"signal": {"name": "test_prologue", "value": 1}}],
+            [{"signal": {"name": "test_prologue", "value": 0}}],
+        ),
     )
-    prologue_thread.set_signal("test_prologue", 0)
-    for vector in testbench_config.vectors:
-        for thread in vector.threads:
-            thread.commands.insert(
-                0, {"wait": {"key": "@(negedge test_prologue);"}}
-            )
-        vector.add_thread(prologue_thread)
-    return testbench_config
+    prefix = [{"wait": {"key": "@(negedge test_prologue);"}}]
+    vectors = tuple(
+        CompiledVector(
+            vector.vector,
+            [thread.replace(prefix=prefix) for thread in vector.threads]
+            + [prologue_thread],
+        )
+        for vector in compiled.vectors
+    )
+    return compiled.replace(vectors=vectors, prologue_thread=None)
 
 
 def add_endpoint_combinations(testbench_config):
     """
-    If there are multiple endpoints added, duplicate test vectors to capture
-    all the combinations
+    If there are multiple endpoints added, repeat the test vectors to capture
+    all the combinations. The combinations are created lazily as the test
+    vectors are accessed and share their commands with the original vectors.
 
     Args:
-        testbench_config (Testbench): The testbench
+        testbench_config (Testbench): The user-defined or compiled testbench
 
     Returns:
-        Testbench: Updated testbench
-    """
-    interfaces = testbench_config.get_from_dut("interfaces")
-    for interface_index, interface in enumerate(interfaces):
-        vector_num = len(testbench_config.vectors)
-        if len(interface.endpoints) > 1:
-            vectors_copy = deepcopy(testbench_config.vectors)
-            for _ in range(len(interface.endpoints) - 1):
-                vectors_copy_2 = deepcopy(vectors_copy)
-                testbench_config.vectors.extend(vectors_copy_2)
-        # testbench_config.vectors = testbench_config.vectors * len(interface.endpoints)
-        for endpoint_index, _endpoint in enumerate(interface.endpoints):
-            row_index = endpoint_index * vector_num
-            for vector in testbench_config.vectors[
-                row_index : row_index + vector_num
-            ]:
-                vector.threads[0].commands.insert(
-                    0,
-                    {
-                        "signal": {
-                            "name": "endpoint_select",
-                            "value": interface_index,
-                            "value2": endpoint_index,
-                        }
-                    },
-                )
-
-    return testbench_config
+        CompiledTestbench: The compiled testbench with the combinations
+    """
+    compiled = CompiledTestbench.from_testbench(testbench_config)
+    interfaces = compiled.get_from_dut("interfaces")
+    if not interfaces:
+        return compiled
+    return compiled.replace(
+        vectors=EndpointCombinations(
+            compiled.vectors,
+            [len(interface.endpoints) for interface in interfaces],
+        )
+    )
 
 
-def legalize_config(testbench_config):
+def legalize_config(testbench_config, parametrize_waits=False):
     """
     There are some additional automatic steps that must be performed on the
-    testbench configuration once the user has finished it
+    testbench configuration once the user has finished it. They compile it
+    into a new testbench that the backends generate from, leaving the user's
+    testbench unchanged so it can be legalized again.
 
     Args:
-        testbench_config (Testbench): The user-defined testbench configuration
+        testbench_config (Testbench): The user-defined testbench configuration.
+            If it's already compiled, it's returned as it is
+        parametrize_waits (bool, optional): Share keys between wait conditions
+            that differ only in the integers they compare against. Defaults to
+            False.
 
     Returns:
-        Testbench: Updated testbench configuration
+        CompiledTestbench: The compiled testbench
     """
-    testbench_config = configure_prologue(testbench_config)
-    testbench_config = finalize_waits(testbench_config)
-    testbench_config = add_endpoint_combinations(testbench_config)
+    if isinstance(testbench_config, CompiledTestbench):
+        return testbench_config
+    with profiler.stage("configure_prologue"):
+        testbench_config = configure_prologue(testbench_config)
+    with profiler.stage("finalize_waits"):
+        testbench_config = finalize_waits(testbench_config, parametrize_waits)
+    with profiler.stage("add_endpoint_combinations"):
+        testbench_config = add_endpoint_combinations(testbench_config)
     return testbench_config
 
 
+def generate_testbench(
+    testbench_config, lang, sonar_tb_filepath, data_format, shards=1
+):
+    """
+    Generate the testbench and data file for one language
+
+    Args:
+        testbench_config (CompiledTestbench): The legalized testbench
+        lang (str): Language of the testbench
+        sonar_tb_filepath (str): Path to the Python file used to generate
+            testbench_config
+        data_format (str): Format of the data file
+        shards (int, optional): Number of data files to split the test
+            vectors into. Defaults to 1.
+    """
+    _, directory = parse_sonar_tb(sonar_tb_filepath)
+    template = os.path.join(
+        os.path.dirname(__file__), "templates", f"template_tb.{lang}"
+    )
+    with profiler.stage(lang):
+        testbench = Template.from_file(template)
+        testbench = prologue(testbench_config, testbench, lang)
+
+        filepaths = get_data_filepaths(sonar_tb_filepath, lang, shards)
+        with contextlib.ExitStack() as stack:
+            files = [
+                stack.enter_context(open(filepath, "wb"))
+                for filepath in filepaths
+            ]
+            testbench = BACKENDS[lang](
+                testbench_config,
+                testbench,
+                directory,
+                files if len(files) > 1 else files[0],
+                data_format,
+            )
+        with profiler.stage("render_template"):
+            with open(get_tb_filepath(sonar_tb_filepath, lang), "w+") as f:
+                f.write(str(testbench))
+
+
+def available_cpus():
+    """
+    Get the number of CPUs this process can run on
+
+    Returns:
+        int: Number of CPUs
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _generate_snapshot(lang, sonar_tb_filepath, data_format, shards):
+    """
+    Generate the testbench for one language from the configuration inherited
+    from the parent process
+
+    Args:
+        lang (str): Language of the testbench
+        sonar_tb_filepath (str): Path to the Python file used to generate
+            testbench_config
+        data_format (str): Format of the data file
+        shards (int): Number of data files to split the test vectors into
+    """
+    generate_testbench(_snapshot, lang, sonar_tb_filepath, data_format, shards)
+
+
+def generate_parallel(
+    testbench_config, langs, sonar_tb_filepath, data_format, shards=1
+):
+    """
+    Generate the testbenches for multiple languages concurrently, one process
+    per language. The worker processes are forked so they inherit the
+    configuration as it is now rather than having it pickled and sent to
+    them. This also preserves any state set on classes (e.g. the arguments of
+    endpoints). The backends don't modify the configuration so the output
+    is the same as generating serially.
+
+    Args:
+        testbench_config (CompiledTestbench): The legalized testbench
+        langs (tuple): Languages to generate testbenches for
+        sonar_tb_filepath (str): Path to the Python file used to generate
+            testbench_config
+        data_format (str): Format of the data files
+        shards (int, optional): Number of data files to split the test
+            vectors into. Defaults to 1.
+    """
+    global _snapshot  # pylint: disable=global-statement
+    _snapshot = testbench_config
+    try:
+        context = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(len(langs), mp_context=context) as executor:
+            futures = [
+                executor.submit(
+                    _generate_snapshot,
+                    lang,
+                    sonar_tb_filepath,
+                    data_format,
+                    shards,
+                )
+                for lang in langs
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        _snapshot = None
+
+
+def generate_testbenches(
+    testbench_config,
+    active_langs,
+    sonar_tb_filepath,
+    force,
+    data_format,
+    parallel,
+    shards=1,
+):
+    """
+    Generate the testbenches that have changed since they were last generated
+
+    Args:
+        testbench_config (CompiledTestbench): The legalized testbench
+        active_langs (tuple): Languages to generate testbenches for
+        sonar_tb_filepath (str): Path to the Python file used to generate
+            testbench_config
+        force (bool): Generate the testbenches even if they're unchanged
+        data_format (str): Format of the data files
+        parallel (bool): Generate the testbenches concurrently if possible
+        shards (int, optional): Number of data files to split the test
+            vectors into. Defaults to 1.
+    """
+    _, directory = parse_sonar_tb(sonar_tb_filepath)
+    with profiler.stage("hash_testbench"):
+        keys = tb_cache.get_keys(
+            testbench_config, active_langs, directory, data_format, shards
+        )
+    cache = tb_cache.read_cache(directory)
+    if not force:
+        active_langs = filter_langs(
+            active_langs, sonar_tb_filepath, keys, cache, shards
+        )
+    if not active_langs:
+        return
+
+    # invalidate the languages being generated until they're done so an
+    # interrupted generation is redone
+    for lang in active_langs:
+        cache.pop(lang, None)
+    tb_cache.write_cache(directory, cache)
+
+    if (
+        parallel
+        and len(active_langs) > 1
+        and "fork" in multiprocessing.get_all_start_methods()
+        and available_cpus() > 1
+    ):
+        generate_parallel(
+            testbench_config,
+            active_langs,
+            sonar_tb_filepath,
+            data_format,
+            shards,
+        )
+    else:
+        for lang in active_langs:
+            generate_testbench(
+                testbench_config, lang, sonar_tb_filepath, data_format, shards
+            )
+
+    for lang in active_langs:
+        cache[lang] = keys[lang]
+    tb_cache.write_cache(directory, cache)
+
+
 # TODO error handling
 # TODO make seek size programmatic
 # TODO allow delays by clock cycles
@@ -242,6 +513,11 @@ def sonar(
     languages="sv",
     force=False,
     legalize=True,
+    data_format="text",
+    parametrize_waits=False,
+    parallel=True,
+    profile=False,
+    shards=1,
 ):
     """
     Call the appropriate backends to generate testbenches in the chosen
@@ -253,15 +529,43 @@ def sonar(
             testbench_config
         languages (str or tuple, optional): Language(s) to generate testbenches
             for. Defaults to "sv".
-        force (bool, optional): Force testbench generation. Defaults to False
+        force (bool, optional): Generate the testbenches even if they're
+            unchanged since they were last generated. Defaults to False
         legalize (bool, optional): Perform testbench legalization on the config
+        data_format (str, optional): Format of the generated data files. The
+            default "text" format is human-readable while "bin" is faster for
+            the testbench to read. Defaults to "text".
+        parametrize_waits (bool, optional): Share keys between wait conditions
+            that differ only in the integers they compare against, passing the
+            integers as args instead. Defaults to False.
+        parallel (bool, optional): Generate the testbenches for multiple
+            languages concurrently in separate processes, where supported and
+            more than one CPU is available. Defaults to True.
+        profile (bool, optional): Record the wall time, peak RSS and object
+            counts of each stage of the generation. The report is also written
+            to the build directory. The testbenches are generated serially so
+            that every stage is recorded. Defaults to False.
+        shards (int, optional): Split the test vectors of the SV testbench
+            between this many data files so they can be simulated in parallel
+            from one compiled testbench. The shard to run is chosen with the
+            +SONAR_SHARD=<index> plusarg. Defaults to 1.
 
     Raises:
-        SonarInvalidArgError: Raised for invalid languages
+        SonarInvalidArgError: Raised for invalid languages, data formats or
+            numbers of shards
+
+    Returns:
+        dict: The profiling report if profile is set, otherwise None
     """
-    if legalize:
-        testbench_config = legalize_config(testbench_config)
-        # print(testbench_config)
+    if data_format not in DATA_FORMATS:
+        raise SonarInvalidArgError(
+            f"Data format must be one of {DATA_FORMATS}, not {data_format}"
+        )
+
+    if not isinstance(shards, int) or shards < 1:
+        raise SonarInvalidArgError(
+            f"The number of shards must be a positive integer, not {shards}"
+        )
 
     if isinstance(languages, str):
         if languages == "all":
@@ -279,30 +583,26 @@ def sonar(
     if not os.path.exists(directory):
         os.makedirs(directory)
 
-    if not force:
-        active_langs = filter_langs(active_langs, sonar_tb_filepath)
-
-    testbenches = {}
-    data_files = {}
-    for lang in active_langs:
-        template = os.path.join(
-            os.path.dirname(__file__), "templates", f"template_tb.{lang}"
-        )
-        with open(template, "r") as f:
-            testbenches[lang] = f.read()
-        testbenches[lang] = prologue(testbench_config, testbenches[lang], lang)
-
-    if "sv" in active_langs:
-        testbenches["sv"], data_files["sv"] = create_sv_testbench(
-            testbench_config, testbenches["sv"], directory
-        )
-    if "cpp" in active_langs:
-        testbenches["cpp"], data_files["cpp"] = create_cpp_testbench(
-            testbench_config, testbenches["cpp"], directory
+    tb_profiler = profiler.Profiler() if profile else None
+    with profiler.profiling(tb_profiler):
+        if legalize:
+            with profiler.stage("legalize_config"):
+                testbench_config = legalize_config(
+                    testbench_config, parametrize_waits
+                )
+        generate_testbenches(
+            testbench_config,
+            active_langs,
+            sonar_tb_filepath,
+            force,
+            data_format,
+            parallel and not profile,
+            shards,
         )
 
-    for lang in active_langs:
-        with open(get_tb_filepath(sonar_tb_filepath, lang), "w+") as f:
-            f.write(testbenches[lang])
-        with open(get_data_filepath(sonar_tb_filepath, lang), "w+") as f:
-            f.write(data_files[lang])
+    if tb_profiler is None:
+        return None
+    report = tb_profiler.report()
+    with open(os.path.join(directory, PROFILE_FILENAME), "w") as f:
+        json.dump(report, f, indent=2)
+    return report
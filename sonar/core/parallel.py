@@ -0,0 +1,79 @@
+"""
+Build test vectors concurrently in worker processes. The vectors are pickled
+back to this process in their compact form and returned in the order of their
+parameters, regardless of which finishes first, so the testbench is the same
+as if they were built serially.
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import sonar.testbench
+from sonar.core.generate import available_cpus
+from sonar.exceptions import SonarInvalidArgError
+
+# the builder inherited by forked worker processes
+_builder = None
+
+
+def _build_inherited(param):
+    """
+    Build a test vector with the builder inherited from the parent process
+
+    Args:
+        param (object): Parameter to pass to the builder
+
+    Returns:
+        TestVector: The test vector
+    """
+    return _builder(param)
+
+
+def build_vectors(builder, params, workers=None):
+    """
+    Build test vectors concurrently. Where possible, the worker processes are
+    forked so the builder can use any state of the script building the
+    testbench (e.g. its interfaces) and needn't be picklable. Otherwise, the
+    builder must be a function that the workers can import.
+
+    Args:
+        builder (Callable): Called with each parameter to build a TestVector
+        params (Iterable): Parameters to build a test vector for
+        workers (int, optional): Number of worker processes. Defaults to None,
+            the number of available CPUs.
+
+    Raises:
+        SonarInvalidArgError: Raised if the number of workers isn't positive
+            or the builder doesn't return a TestVector
+
+    Returns:
+        list: The test vectors in the order of their parameters
+    """
+    global _builder  # pylint: disable=global-statement
+    params = list(params)
+    if workers is None:
+        workers = available_cpus()
+    if not isinstance(workers, int) or workers < 1:
+        raise SonarInvalidArgError(
+            f"Number of workers must be a positive integer, not {workers}"
+        )
+    workers = min(workers, len(params))
+    if workers <= 1:
+        vectors = [builder(param) for param in params]
+    elif "fork" in multiprocessing.get_all_start_methods():
+        _builder = builder
+        try:
+            context = multiprocessing.get_context("fork")
+            with ProcessPoolExecutor(workers, mp_context=context) as executor:
+                vectors = list(executor.map(_build_inherited, params))
+        finally:
+            _builder = None
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            vectors = list(executor.map(builder, params))
+    for vector in vectors:
+        if not isinstance(vector, sonar.testbench.TestVector):
+            raise SonarInvalidArgError(
+                f"Vector builders must return a TestVector, not {vector}"
+            )
+    return vectors
@@ -0,0 +1,127 @@
+"""
+Profile the stages of generating testbenches. The stages are marked in the
+generator and backends with stage(), which does nothing unless a profiler is
+active.
+"""
+
+import contextlib
+import gc
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# the profiler that stages are currently recorded in
+_active = None
+
+
+def get_peak_rss():
+    """
+    Get the peak resident set size of this process
+
+    Returns:
+        int: The peak RSS in bytes or None if it's not available
+    """
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports the size in kilobytes and macOS in bytes
+    if sys.platform != "darwin":
+        peak_rss *= 1024
+    return peak_rss
+
+
+class Profiler:
+    """
+    Records the wall time, peak RSS and the number of objects tracked by the
+    garbage collector for each stage. Stages can be nested and are named by
+    their path, e.g. "sv/write_data_file".
+    """
+
+    def __init__(self):
+        """
+        Initialize the profiler
+        """
+        self.stages = []
+        self._path = []
+        self._start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Record a stage while the context is active
+
+        Args:
+            name (str): Name of the stage
+
+        Yields:
+            dict: The record of the stage
+        """
+        self._path.append(name)
+        record = {"name": "/".join(self._path), "depth": len(self._path) - 1}
+        self.stages.append(record)
+        objects = len(gc.get_objects())
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["wall_time"] = time.perf_counter() - start
+            record["peak_rss"] = get_peak_rss()
+            record["objects"] = len(gc.get_objects())
+            record["objects_delta"] = record["objects"] - objects
+            self._path.pop()
+
+    def report(self):
+        """
+        Get the report of the stages recorded so far
+
+        Returns:
+            dict: The total wall time and peak RSS, and the stages in the
+                order they started
+        """
+        return {
+            "wall_time": time.perf_counter() - self._start,
+            "peak_rss": get_peak_rss(),
+            "stages": self.stages,
+        }
+
+
+@contextlib.contextmanager
+def profiling(profiler):
+    """
+    Record stages in a profiler while the context is active
+
+    Args:
+        profiler (Profiler): The profiler. If None, stages aren't recorded
+
+    Yields:
+        Profiler: The profiler
+    """
+    global _active  # pylint: disable=global-statement
+    previous = _active
+    _active = profiler
+    try:
+        yield profiler
+    finally:
+        _active = previous
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Record a stage in the active profiler, if there is one
+
+    Args:
+        name (str): Name of the stage
+
+    Yields:
+        dict: The record of the stage or None if not profiling
+    """
+    if _active is None:
+        yield None
+    else:
+        with _active.stage(name) as record:
+            yield record
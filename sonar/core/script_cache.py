@@ -0,0 +1,279 @@
+"""
+Cache the testbenches built by sonar scripts so they can be generated again
+without rerunning the scripts, which may spend a long time computing stimuli
+and golden models. A script is run once with its calls to
+Testbench.generate_tb() recorded: each testbench is saved, compressed, to the
+build directory along with the hashes of the script and the modules it
+imported. Later runs load the saved testbenches and generate them directly if
+none of these files changed.
+
+Only Python sources are tracked. If a script reads other files (e.g. input
+data), it must be run again with force when they change.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import runpy
+import sys
+import sysconfig
+
+import sonar
+import sonar.serialize
+from sonar.core import generate
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = ".sonar_build.json"
+
+# each recorded testbench is saved to a file named with its index
+TESTBENCH_FILENAME = ".sonar_build_{index}.json.gz"
+
+COMPRESS_LEVEL = 6
+
+# the calls to Testbench.generate_tb() recorded while running a script
+_calls = None
+
+
+def hash_file(filepath):
+    """
+    Hash the contents of a file
+
+    Args:
+        filepath (str): Path to the file
+
+    Returns:
+        str: The hash, or None if the file can't be read
+    """
+    digest = hashlib.sha256()
+    try:
+        with open(filepath, "rb") as f:
+            for chunk in iter(lambda: f.read(2**20), b""):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def get_sources(modules):
+    """
+    Get the source files of the modules that belong to the user, i.e. not
+    sonar, the standard library or installed packages
+
+    Args:
+        modules (Iterable): The modules
+
+    Returns:
+        list: Absolute paths of the source files
+    """
+    excluded = {
+        os.path.abspath(path)
+        for name, path in sysconfig.get_paths().items()
+        if name in ("stdlib", "platstdlib", "purelib", "platlib")
+    }
+    excluded.add(os.path.dirname(os.path.abspath(sonar.__file__)))
+    sources = set()
+    for module in modules:
+        filepath = getattr(module, "__file__", None)
+        if not filepath or not filepath.endswith(".py"):
+            continue
+        filepath = os.path.abspath(filepath)
+        if not any(
+            filepath.startswith(directory + os.sep) for directory in excluded
+        ):
+            sources.add(filepath)
+    return sorted(sources)
+
+
+def recording():
+    """
+    Check if the calls to Testbench.generate_tb() are being recorded
+
+    Returns:
+        bool: True while a script is run by run_script()
+    """
+    return _calls is not None
+
+
+def record(testbench, tb_filepath, kwargs):
+    """
+    Save a testbench that a script is generating so it can be generated again
+    without the script
+
+    Args:
+        testbench (Testbench): The testbench
+        tb_filepath (str): Path the testbench is generated for
+        kwargs (dict): The other arguments of Testbench.generate_tb()
+    """
+    _, directory = generate.parse_sonar_tb(tb_filepath)
+    os.makedirs(directory, exist_ok=True)
+    filename = TESTBENCH_FILENAME.format(index=len(_calls))
+    with gzip.open(
+        os.path.join(directory, filename),
+        "wt",
+        encoding="utf-8",
+        compresslevel=COMPRESS_LEVEL,
+    ) as f:
+        sonar.serialize.dump(testbench, f)
+    _calls.append(
+        {
+            "tb_filepath": os.path.abspath(tb_filepath),
+            "testbench": os.path.join(directory, filename),
+            "kwargs": kwargs,
+        }
+    )
+
+
+def get_manifest(script, argv, sources, calls):
+    """
+    Describe a run of a script so later runs can check if it's unchanged
+
+    Args:
+        script (str): Absolute path to the script
+        argv (list): Arguments passed to the script
+        sources (list): Absolute paths of the modules the script imported
+        calls (list): The recorded calls to Testbench.generate_tb()
+
+    Returns:
+        dict: The manifest
+    """
+    return {
+        "sonar_version": sonar.__version__,
+        "format_version": sonar.serialize.VERSION,
+        "python": sys.version,
+        "argv": list(argv),
+        "sources": {
+            filepath: hash_file(filepath) for filepath in [script] + sources
+        },
+        "calls": calls,
+    }
+
+
+def read_manifest(script):
+    """
+    Read the manifest of the last run of a script
+
+    Args:
+        script (str): Path to the script
+
+    Returns:
+        dict: The manifest. None if there's no valid manifest
+    """
+    _, directory = generate.parse_sonar_tb(os.path.abspath(script))
+    try:
+        with open(os.path.join(directory, MANIFEST_FILENAME), "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(manifest, dict):
+        return None
+    return manifest
+
+
+def is_fresh(manifest, script, argv):
+    """
+    Check if the testbenches saved by the last run of a script are still
+    valid for running it again
+
+    Args:
+        manifest (dict): The manifest of the last run
+        script (str): Path to the script
+        argv (list): Arguments to pass to the script
+
+    Returns:
+        bool: True if the script and its modules are unchanged
+    """
+    if manifest is None:
+        return False
+    if (
+        manifest.get("sonar_version") != sonar.__version__
+        or manifest.get("format_version") != sonar.serialize.VERSION
+        or manifest.get("python") != sys.version
+        or manifest.get("argv") != list(argv)
+    ):
+        return False
+    sources = manifest.get("sources", {})
+    if os.path.abspath(script) not in sources:
+        return False
+    if not all(
+        os.path.exists(call["testbench"]) for call in manifest["calls"]
+    ):
+        return False
+    return all(
+        hash_file(filepath) == digest for filepath, digest in sources.items()
+    )
+
+
+def run_script(script, argv=()):
+    """
+    Run a script as if from the command line, recording the testbenches it
+    generates, and write the manifest of the run to the build directory
+
+    Args:
+        script (str): Path to the script
+        argv (Iterable, optional): Arguments to pass to the script. Defaults
+            to ().
+
+    Returns:
+        dict: The manifest
+    """
+    global _calls  # pylint: disable=global-statement
+    script = os.path.abspath(script)
+    argv = list(argv)
+    before = set(sys.modules)
+    old_argv = sys.argv
+    sys.argv = [script] + argv
+    sys.path.insert(0, os.path.dirname(script))
+    _calls = []
+    try:
+        runpy.run_path(script, run_name="__main__")
+        calls = _calls
+    finally:
+        _calls = None
+        sys.argv = old_argv
+        sys.path.remove(os.path.dirname(script))
+    modules = {name: sys.modules[name] for name in set(sys.modules) - before}
+    sources = get_sources(modules.values())
+    # the user's modules are imported again by the next run like they would
+    # be from the command line
+    for name, module in modules.items():
+        if getattr(module, "__file__", None) and (
+            os.path.abspath(module.__file__) in sources
+        ):
+            del sys.modules[name]
+    manifest = get_manifest(script, argv, sources, calls)
+    _, directory = generate.parse_sonar_tb(script)
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, MANIFEST_FILENAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def run(script, argv=(), force=False):
+    """
+    Generate the testbenches of a script, loading them from the testbenches
+    saved by its last run if the script and its modules are unchanged or
+    running it otherwise
+
+    Args:
+        script (str): Path to the script
+        argv (Iterable, optional): Arguments to pass to the script. Defaults
+            to ().
+        force (bool, optional): Run the script even if it's unchanged.
+            Defaults to False.
+
+    Returns:
+        bool: True if the script was run
+    """
+    manifest = read_manifest(script)
+    if force or not is_fresh(manifest, script, argv):
+        run_script(script, argv)
+        return True
+    logger.info("%s is unchanged, loading its testbenches", script)
+    for call in manifest["calls"]:
+        with gzip.open(call["testbench"], "rt", encoding="utf-8") as f:
+            testbench = sonar.serialize.load(f)
+        testbench.generate_tb(call["tb_filepath"], **call["kwargs"])
+    return False
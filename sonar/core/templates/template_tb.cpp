@@ -28,12 +28,39 @@ SOFTWARE.
 #include <iostream>
 #include <assert.h>
 #include <string>
+#include <vector>
 
 SONAR_HEADER_FILE
 
+SONAR_DATA_FORMAT
+
 #define DAT_FILE SONAR_DATA_FILE
 #define SONAR_MAX_STRING_SIZE 255
 
+#ifdef SONAR_BINARY_DATA
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#include <cstring>
+
+SONAR_STRING_IDS
+
+// compare the string of a record field by its index in the string table
+#define SONAR_IS(field, str) (field##Id == SONAR_ID_##str)
+
+// read a little-endian unsigned integer from the data file
+static inline unsigned long long readInt(const unsigned char* ptr, int size) {
+  unsigned long long value = 0;
+  for (int i = (size < 8 ? size : 8) - 1; i >= 0; i--) {
+    value = (value << 8) | ptr[i];
+  }
+  return value;
+}
+#else
+#define SONAR_IS(field, str) (!strcmp(field, #str))
+#endif
+
 int main(int argc, char* argv[]) {
   // int i;
   // bool printMatches = false;
@@ -54,17 +81,54 @@ int main(int argc, char* argv[]) {
 
   SONAR_TB_SIGNAL_LIST
 
+#ifdef SONAR_BINARY_DATA
+  int dataFd = open(DAT_FILE, O_RDONLY);
+  struct stat dataStat;
+  if (dataFd < 0 || fstat(dataFd, &dataStat) < 0) {
+    perror("Failed: ");
+    return 1;
+  }
+  const unsigned char* data = (const unsigned char*)mmap(
+      NULL, dataStat.st_size, PROT_READ, MAP_PRIVATE, dataFd, 0);
+  if (data == MAP_FAILED) {
+    perror("Failed: ");
+    return 1;
+  }
+  if (dataStat.st_size < 12 || memcmp(data, "SONR", 4)) {
+    std::cout << "Bad data file - not a binary sonar data file\n";
+    return 1;
+  }
+  // the preamble holds the magic number, version and string table
+  std::vector<std::string> strings(readInt(data + 8, 4));
+  const unsigned char* record = data + 12;
+  for (size_t i = 0; i < strings.size(); i++) {
+    int length = readInt(record, 4);
+    strings[i].assign((const char*)record + 4, length);
+    record += 4 + length;
+  }
+#else
   FILE* dataFile = fopen(DAT_FILE, "r");
   if (dataFile == NULL) {
     perror("Failed: ");
     return 1;
   }
+#endif
 
   std::cout << "\n*** Starting testbench ***\n\n";
 
+#ifdef SONAR_BINARY_DATA
+  const char* interfaceType;
+  const char* cStreamType;
+  const char* id;
+  unsigned int interfaceTypeId;
+  unsigned int cStreamTypeId;
+  unsigned int idId;
+  int argWidth;
+#else
   char interfaceType[SONAR_MAX_STRING_SIZE];
   char cStreamType[SONAR_MAX_STRING_SIZE];
   char id[SONAR_MAX_STRING_SIZE];
+#endif
   int argCount;
   // ap_uint<SONAR_MAX_DATA_SIZE> readArgs[SONAR_MAX_ARG_NUM];
   long long args[SONAR_MAX_ARG_NUM];
@@ -73,31 +137,111 @@ int main(int argc, char* argv[]) {
 #ifdef DEBUG
   int dbg_currentState;
 #endif
-  while (1) {
+  auto readRecord = [&]() {
+#ifdef SONAR_BINARY_DATA
+    interfaceTypeId = readInt(record, 4);
+    idId = readInt(record + 4, 4);
+    cStreamTypeId = readInt(record + 8, 4);
+    argCount = readInt(record + 12, 8);
+    argWidth = readInt(record + 20, 4);
+    record += 24;
+    for (int l = 0; l < argCount; l++) {
+      args[l] = readInt(record, argWidth);  // C++ can only support 64bit args
+      record += argWidth;
+    }
+    interfaceType = strings[interfaceTypeId].c_str();
+    id = strings[idId].c_str();
+    cStreamType = strings[cStreamTypeId].c_str();
+#else
     fscanf(dataFile, "%s %s %s %d", interfaceType, id, cStreamType,
            &argCount);
     for (int l = 0; l < argCount; l++) {
       fscanf(dataFile, "%lld", &(args[l]));  // C++ can only support 64bit args
     }
+#endif
+  };
+  // number of times left to evaluate the last record again
+  long long repeat = 0;
+  // the position of the body and remaining iterations of each loop being run
+#ifdef SONAR_BINARY_DATA
+  std::vector<const unsigned char*> loopSeeks;
+#else
+  std::vector<long> loopSeeks;
+#endif
+  std::vector<long long> loopCounts;
+  // count, stepped arg, step, periodic arg and period of the beats of the
+  // last record if it's a pattern and the index of the current beat
+  long long pattern[5];
+  long long beat = 0;
+  bool isPattern = false;
+  while (1) {
+    if (repeat > 0) {
+      repeat--;
+      if (isPattern) {
+        beat++;
+        args[pattern[1]] += pattern[2];
+        if (pattern[4] != 0) {
+          args[pattern[3]] = (beat + 1) % pattern[4] == 0;
+        }
+      }
+    } else {
+      readRecord();
+      isPattern = false;
+      if (SONAR_IS(interfaceType, repeat)) {
+        // the next record is evaluated args[0] times
+        repeat = args[0] - 1;
+        readRecord();
+      } else if (SONAR_IS(interfaceType, pattern)) {
+        // the next record is the first of args[0] beats in an arithmetic
+        // sequence
+        for (int l = 0; l < 5; l++) {
+          pattern[l] = args[l];
+        }
+        repeat = args[0] - 1;
+        beat = 0;
+        isPattern = true;
+        readRecord();
+      }
+    }
 
     SONAR_IF_ELSE_SIGNAL
     SONAR_ELSE_IF_INTERFACE_IN
     SONAR_ELSE_IF_INTERFACE_OUT
-    else if ((!strcmp(interfaceType, "timestamp")) ||
-             (!strcmp(interfaceType, "display"))) {
-      if (strcmp(id, "INIT")) {
+    else if (SONAR_IS(interfaceType, timestamp) ||
+             SONAR_IS(interfaceType, display)) {
+      if (!SONAR_IS(id, INIT)) {
         std::cout << id << "\n";
       }
     }
-    else if (!strcmp(interfaceType, "call_dut")) {
+    else if (SONAR_IS(interfaceType, loop)) {
+      if (SONAR_IS(id, begin)) {
+#ifdef SONAR_BINARY_DATA
+        loopSeeks.push_back(record);
+#else
+        loopSeeks.push_back(ftell(dataFile));
+#endif
+        loopCounts.push_back(args[0]);
+      } else if (--loopCounts.back() > 0) {
+        // replay the body of the loop
+#ifdef SONAR_BINARY_DATA
+        record = loopSeeks.back();
+#else
+        fseek(dataFile, loopSeeks.back(), SEEK_SET);
+#endif
+      } else {
+        loopSeeks.pop_back();
+        loopCounts.pop_back();
+      }
+    }
+    else if (SONAR_IS(interfaceType, call_dut)) {
       for (int l = 0; l < args[0]; l++) {
         CALL_TB
       }
     }
-    else if (!strcmp(interfaceType, "end")) {
+    else if (SONAR_IS(interfaceType, end)) {
       std::cout << "Test " << args[0] << " successful\n";
     }
-    else if (!strcmp(interfaceType, "finish")) {
+    else if (SONAR_IS(interfaceType, finish)) {
       break;
     }
     else {
@@ -108,7 +252,12 @@ int main(int argc, char* argv[]) {
 
   std::cout << "\n*** Finishing testbench ***\n";
 
+#ifdef SONAR_BINARY_DATA
+  munmap((void*)data, dataStat.st_size);
+  close(dataFd);
+#else
   fclose(dataFile);
+#endif
 
   return 0;
 }
@@ -16,8 +16,13 @@
 
 SONAR_HEADER_FILE
 
-//filename for the input data file
+SONAR_DATA_FORMAT
+
+//filename for the input data file. If the test vectors are split into shards,
+//it's a format string for the index of the shard, which is chosen at runtime
+//with +SONAR_SHARD=<index>
 string dataFileName = SONAR_DATA_FILE;
+localparam SHARDS = SONAR_SHARDS; //number of data files the vectors are split into
 
 localparam MAX_DATA_SIZE = SONAR_MAX_DATA_SIZE; //max width of the data to be read/writtn
 localparam MAX_VECTORS = SONAR_MAX_VECTORS; //number of test vectors
@@ -25,6 +30,7 @@ localparam MAX_PARALLEL = SONAR_MAX_PARALLEL;  //max number of threads in any ve
 localparam MAX_SEEK_SIZE = 64; //base 2 log of the max number to fseek
 localparam MAX_ARG_NUM = SONAR_MAX_ARG_NUM;
 localparam MAX_ARG_SIZE = $clog2(MAX_ARG_NUM) + 1;
+localparam MAX_ARG_BYTES = SONAR_MAX_ARG_BYTES; //max width of an arg in a binary data file
 
 SONAR_IMPORT_PACKAGES
 
@@ -53,6 +59,131 @@ module exerciser (
     SONAR_INCLUDE_ENDPOINTS
     SONAR_INCLUDE_INTERFACE_ENDPOINTS
 
+    function automatic string getDataFileName();
+        int shard;
+
+        if (SHARDS == 1) begin
+            return dataFileName;
+        end
+        if (!$value$plusargs("SONAR_SHARD=%d", shard)) begin
+            shard = 0;
+        end
+        if (shard < 0 || shard >= SHARDS) begin
+            $display("Bad shard %0d - there are %0d shards", shard, SHARDS);
+            $display("\n*** Finishing RTL Simulation *** \n");
+            $finish;
+        end
+        return $sformatf(dataFileName, shard);
+    endfunction
+
+`ifdef SONAR_BINARY_DATA
+    // size of a record header in bits: two string indices, the value and the
+    // width of the args
+    localparam RECORD_HEADER_SIZE = 32 + 32 + 64 + 32;
+
+    string dataStrings[];
+
+    function automatic int openDataFile();
+        return $fopen(getDataFileName(), "rb");
+    endfunction
+
+    // read the string table at the start of the binary data file
+    task automatic readStrings(input int dataFile_par);
+        int status_par;
+        logic [31:0] word;
+        logic [7:0] char;
+
+        status_par = $fread(word, dataFile_par);
+        if (word != "SONR") begin
+            $display("Bad data file - not a binary sonar data file");
+            $display("\n*** Finishing RTL Simulation *** \n");
+            $finish;
+        end
+        status_par = $fread(word, dataFile_par); // version
+        status_par = $fread(word, dataFile_par);
+        word = {<<8{word}};
+        dataStrings = new[word];
+        foreach (dataStrings[i]) begin
+            status_par = $fread(word, dataFile_par);
+            word = {<<8{word}};
+            dataStrings[i] = "";
+            for(int j = 0; j < word; j++) begin
+                status_par = $fread(char, dataFile_par);
+                dataStrings[i] = {dataStrings[i], string'(char)};
+            end
+        end
+    endtask
+
+    task automatic readHeader(
+        input int dataFile_par,
+        output string packetType_par,
+        output string interfaceType_par,
+        output logic [MAX_SEEK_SIZE-1:0] value,
+        output int argWidth
+    );
+        int status_par;
+        logic [RECORD_HEADER_SIZE-1:0] header;
+
+        status_par = $fread(header, dataFile_par);
+        header = {<<8{header}}; // the file is little-endian
+        packetType_par = dataStrings[header[31:0]];
+        interfaceType_par = dataStrings[header[63:32]];
+        value = header[127:64];
+        argWidth = header[159:128];
+    endtask
+
+    task automatic readArgs(
+        input int dataFile_par,
+        input int argCount,
+        input int argWidth,
+        ref logic [MAX_DATA_SIZE-1:0] args [MAX_ARG_NUM]
+    );
+        int status_par;
+        logic [7:0] argBytes [MAX_ARG_NUM*MAX_ARG_BYTES];
+
+        if (argCount * argWidth > 0) begin
+            status_par = $fread(argBytes, dataFile_par, 0, argCount * argWidth);
+        end
+        for(int l = 0; l < argCount; l++) begin
+            args[l] = 0;
+            for(int b = 0; b < argWidth && b * 8 < MAX_DATA_SIZE; b++) begin
+                args[l][b*8 +: 8] = argBytes[l * argWidth + b];
+            end
+        end
+    endtask
+`else
+    function automatic int openDataFile();
+        return $fopen(getDataFileName(), "r");
+    endfunction
+
+    task automatic readHeader(
+        input int dataFile_par,
+        output string packetType_par,
+        output string interfaceType_par,
+        output logic [MAX_SEEK_SIZE-1:0] value,
+        output int argWidth
+    );
+        int status_par;
+
+        status_par = $fscanf(dataFile_par, "%s %s %d\n", packetType_par,
+            interfaceType_par, value);
+        argWidth = 0;
+    endtask
+
+    task automatic readArgs(
+        input int dataFile_par,
+        input int argCount,
+        input int argWidth,
+        ref logic [MAX_DATA_SIZE-1:0] args [MAX_ARG_NUM]
+    );
+        int status_par;
+
+        for(int l = 0; l < argCount; l++) begin
+            status_par = $fscanf(dataFile_par, "%d", args[l]);
+        end
+    endtask
+`endif
+
     task automatic evaluateData(
         input logic [MAX_DATA_SIZE-1:0] args [MAX_ARG_NUM],
         input string packetType_par,
@@ -134,31 +265,40 @@ module exerciser (
         int status;
         string packetType;
         string interfaceType;
+        logic [MAX_SEEK_SIZE-1:0] value;
+        int argWidth;
 
         logic [MAX_SEEK_SIZE-1:0] testVectors [MAX_VECTORS];
 
         int dataFile_0;
         int parallelSectionCount;
 
-        dataFile_0 = $fopen(dataFileName, "r");
-        status = $fscanf(dataFile_0, "%s %s %d\n", packetType, interfaceType,
-            vectorCount);
+        dataFile_0 = openDataFile();
+`ifdef SONAR_BINARY_DATA
+        readStrings(dataFile_0);
+`endif
+        readHeader(dataFile_0, packetType, interfaceType, value, argWidth);
+        vectorCount = value;
         fileReady = 1;
         $display("\n*** Starting RTL Simulation *** \n");
+        if (SHARDS > 1) begin
+            $display("Data file: %s", getDataFileName());
+        end
         if (packetType == "TestVector" && interfaceType == "count") begin
             for(int i = 0; i < vectorCount; i++) begin
-                status = $fscanf(dataFile_0, "%s %s %d\n", packetType,
-                    interfaceType, testVectors[i]);
+                readHeader(dataFile_0, packetType, interfaceType,
+                    testVectors[i], argWidth);
             end
             for(int i = 0; i < vectorCount; i++) begin
                 status = $fseek(dataFile_0, testVectors[i], 0);
-                status = $fscanf(dataFile_0, "%s %s %d\n", packetType,
-                    interfaceType, parallelSectionCount);
+                readHeader(dataFile_0, packetType, interfaceType, value,
+                    argWidth);
+                parallelSectionCount = value;
                 if (packetType == "ParallelSection" &&
                     interfaceType == "count") begin
                     for(int j = 0; j < parallelSectionCount; j++) begin
-                        status = $fscanf(dataFile_0, "%s %s %d\n", packetType,
-                            interfaceType,threads[j]);
+                        readHeader(dataFile_0, packetType, interfaceType,
+                            threads[j], argWidth);
                     end
                     updateEnd = 1;
                     wait(|testVectorEnd == 1 && threadSync == threadSync_golden);
@@ -199,12 +339,23 @@ module exerciser (
                 int status_par;
                 int dataFile;
                 logic [MAX_DATA_SIZE-1:0] args [MAX_ARG_NUM];
-                logic [MAX_ARG_SIZE-1:0] argCount;
+                logic [MAX_SEEK_SIZE-1:0] argCount;
+                int argWidth;
                 string packetType_par;
                 string interfaceType_par;
-                int packetCount;
+                logic [MAX_SEEK_SIZE-1:0] packetCount;
+                logic [MAX_SEEK_SIZE-1:0] repeatCount;
+                // the position of the body, remaining iterations and index
+                // of the first packet of each loop being run
+                logic [MAX_SEEK_SIZE-1:0] loopSeeks [$];
+                logic [MAX_SEEK_SIZE-1:0] loopCounts [$];
+                int loopPackets [$];
+                // count, stepped arg, step, periodic arg and period of the
+                // beats of the next packet if it's a pattern
+                logic [MAX_DATA_SIZE-1:0] patternArgs [MAX_ARG_NUM];
+                bit pattern;
 
-                dataFile = $fopen(dataFileName, "r");
+                dataFile = openDataFile();
                 wait(fileReady == 1);
                 for(int w = 0; w < vectorCount; w++) begin
                     wait(updateEnd == 1'b1);
@@ -216,16 +367,63 @@ module exerciser (
                             begin
                                 status_par = $fseek(dataFile, threads[gen_i],
                                     0);
-                                status_par = $fscanf(dataFile, "%s %s %d",
-                                    packetType_par, interfaceType_par, packetCount);
+                                readHeader(dataFile, packetType_par,
+                                    interfaceType_par, packetCount, argWidth);
+                                repeatCount = 1;
+                                pattern = 0;
                                 for(int k = 0; k < packetCount; k++) begin
-                                    status_par = $fscanf(dataFile, "%s %s %d",
-                                        packetType_par, interfaceType_par, argCount);
-                                    for(int l = 0; l < argCount; l++) begin
-                                        status_par = $fscanf(dataFile, "%d", args[l]);
+                                    readHeader(dataFile, packetType_par,
+                                        interfaceType_par, argCount, argWidth);
+                                    readArgs(dataFile, argCount, argWidth,
+                                        args);
+                                    if (packetType_par == "repeat") begin
+                                        // the next packet is evaluated
+                                        // args[0] times
+                                        repeatCount = args[0];
+                                    end
+                                    else if (packetType_par == "pattern") begin
+                                        // the next packet is the first of
+                                        // args[0] beats in an arithmetic
+                                        // sequence
+                                        patternArgs = args;
+                                        repeatCount = args[0];
+                                        pattern = 1;
+                                    end
+                                    else if (packetType_par == "loop") begin
+                                        if (interfaceType_par == "begin") begin
+                                            loopSeeks.push_back($ftell(dataFile));
+                                            loopCounts.push_back(args[0]);
+                                            loopPackets.push_back(k);
+                                        end
+                                        else if (loopCounts[$] > 1) begin
+                                            // replay the body of the loop
+                                            loopCounts[$] = loopCounts[$] - 1;
+                                            status_par = $fseek(dataFile,
+                                                loopSeeks[$], 0);
+                                            k = loopPackets[$];
+                                        end
+                                        else begin
+                                            void'(loopSeeks.pop_back());
+                                            void'(loopCounts.pop_back());
+                                            void'(loopPackets.pop_back());
+                                        end
+                                    end
+                                    else begin
+                                        for(int r = 0; r < repeatCount; r++) begin
+                                            if (pattern && patternArgs[4] != 0) begin
+                                                args[patternArgs[3]] =
+                                                    (r + 1) % patternArgs[4] == 0;
+                                            end
+                                            evaluateData(args, packetType_par,
+                                                interfaceType_par, testVectorEnd[gen_i], errorCheck[gen_i]);
+                                            if (pattern) begin
+                                                args[patternArgs[1]] =
+                                                    args[patternArgs[1]] + patternArgs[2];
+                                            end
+                                        end
+                                        repeatCount = 1;
+                                        pattern = 0;
                                     end
-                                    evaluateData(args, packetType_par,
-                                        interfaceType_par, testVectorEnd[gen_i], errorCheck[gen_i]);
                                 end
                                 threadSync[gen_i] = 1'b1;
                             end
@@ -2,12 +2,25 @@
 Defines an AXI4-Stream interface
 """
 
+import hashlib
+import mmap
+import os
+import sys
 import textwrap
+from array import array
+from collections.abc import Sequence
 from math import ceil
 
 import sonar.base_types
 import sonar.endpoints
 import sonar.interfaces.base_interface as base
+from sonar.exceptions import SonarInvalidArgError
+
+# array typecodes of unsigned integers by their size in bytes
+WORD_TYPECODES = {array(typecode).itemsize: typecode for typecode in "BHILQ"}
+
+# bytes of a file converted into beats at a time when it's streamed lazily
+FILE_CHUNK_SIZE = 2**20
 
 
 class AXI4Stream(base.BaseInterface):
@@ -170,13 +183,82 @@ class AXI4Stream(base.BaseInterface):
 
         self._writes(thread, data)
 
-    def _write(self, thread, payload):
+    def write_pattern(
+        self, thread, start, step, count, tlast_every=None, **kwargs
+    ):
+        """
+        Writes beats whose tdata is an arithmetic sequence (start + i * step
+        for the ith beat) to the AXI stream. The beats are written to the data
+        file as one record that the testbench expands so even millions of
+        beats cost nothing to generate or store.
+
+        Args:
+            thread (Thread): The thread to write the beats to
+            start (int): Tdata of the first beat
+            step (int): Difference between the tdata of consecutive beats.
+                Tdata wraps around at its width
+            count (int): Number of beats
+            tlast_every (int, optional): Defaults to None. Assert tlast on
+                every tlast_every-th beat and deassert it on the others
+            kwargs (str): keyworded arguments where the keyword is another
+                AXI4Stream signal and is assigned to the given value in every
+                beat
+
+        Raises:
+            SonarInvalidArgError: Raised for invalid counts or periods of
+                tlast
+        """
+
+        if not isinstance(count, int) or count < 0:
+            raise SonarInvalidArgError(
+                f"Beat count must be a non-negative integer, not {count}"
+            )
+        if count == 0:
+            return
+        mask = 2 ** int(self.get_signal("tdata").size) - 1
+        pattern = {"count": count, "arg": "tdata", "step": step & mask}
+        if tlast_every is not None:
+            if not self.has_signal("tlast"):
+                raise SonarInvalidArgError(f"{self.name} has no tlast")
+            if not isinstance(tlast_every, int) or tlast_every < 1:
+                raise SonarInvalidArgError(
+                    f"tlast_every must be a positive integer, not {tlast_every}"
+                )
+            pattern["period_arg"] = "tlast"
+            pattern["period"] = tlast_every
+            kwargs["tlast"] = int(tlast_every == 1)
+        payload = self._payload(tdata=start & mask, **kwargs)
+        self._write(thread, [payload], pattern)
+
+    def read_pattern(
+        self, thread, start, step, count, tlast_every=None, **kwargs
+    ):
+        """
+        Reads beats whose tdata is an arithmetic sequence from an AXI stream
+        to verify output. See write_pattern().
+
+        Args:
+            thread (Thread): The thread to read the beats in
+            start (int): Tdata of the first beat
+            step (int): Difference between the tdata of consecutive beats
+            count (int): Number of beats
+            tlast_every (int, optional): Defaults to None. Expect tlast on
+                every tlast_every-th beat
+            kwargs (str): Values of the other AXI4Stream signals
+        """
+
+        self.write_pattern(thread, start, step, count, tlast_every, **kwargs)
+
+    def _write(self, thread, payload, pattern=None):
         """
         Writes the given payload to the AXI4Stream stream.
 
         Args:
             payload (list): Directly assigns a list containing valid
                 transaction dicts to be written
+            pattern (dict, optional): Defaults to None. Expand the only beat
+                of the payload into a sequence of beats in the testbench. See
+                InterfaceCore.pattern_args()
 
         Returns:
             dict: Dictionary representing the data transaction
@@ -190,9 +272,13 @@ class AXI4Stream(base.BaseInterface):
                 "payload": payload,
             }
         }
-        for command in payload:
-            if "endpoint_mode" not in command:
-                command["endpoint_mode"] = 0
+        if pattern is not None:
+            transaction["interface"]["pattern"] = pattern
+        # beats read from a file already have it
+        if not isinstance(payload, FilePayload):
+            for command in payload:
+                if "endpoint_mode" not in command:
+                    command["endpoint_mode"] = 0
         thread._add_transaction(transaction)
 
     def _payload(self, existing_payload=None, **kwargs):
@@ -276,9 +362,9 @@ class AXI4Stream(base.BaseInterface):
         """
 
         if bit_range is None:
-            wait_str = "(" + self.name + "_tdata == $value) "
+            wait_str = "(" + self.name + "_tdata == $0)"
         else:
-            wait_str = self.name + "_tdata[" + bit_range + "] == $value)"
+            wait_str = "(" + self.name + "_tdata[" + bit_range + "] == $0)"
 
         wait_str += " && (" + self.name + "_tvalid == 1'b1)"
         if self.has_signal("tready"):
@@ -286,7 +372,7 @@ class AXI4Stream(base.BaseInterface):
         thread.wait_level(wait_str, data)
 
     def file_to_stream(
-        self, thread, filepath, parsing_func=None, endian="little"
+        self, thread, filepath, parsing_func=None, endian="little", lazy=False
     ):
         """
         Converts the provided file into a series of AXI4Stream transactions.
@@ -299,12 +385,27 @@ class AXI4Stream(base.BaseInterface):
                 representing valid AXI4Stream transactions. The default function
                 assumes a binary file containing only tdata
             endian (str, optional): Defaults to 'little'. Must be little|big
+            lazy (bool, optional): Defaults to False. Read the beats of a
+                binary file containing only tdata from the file as the data
+                file is written instead of holding them in memory. The file
+                must not change until the testbench is generated
+
+        Raises:
+            SonarInvalidArgError: Raised if lazy is used with a parsing_func
 
         Returns:
             dict: Dictionary representing the data transaction
         """
 
-        with open(filepath) as f:
+        if lazy:
+            if parsing_func is not None:
+                raise SonarInvalidArgError(
+                    "A parsing function can't be used to stream lazily"
+                )
+            self._write(thread, self._f2s_file(filepath, endian))
+            return
+
+        with open(filepath, "rb") as f:
             data = f.read()
         self.data_to_stream(thread, data, parsing_func, endian)
 
@@ -327,103 +428,256 @@ class AXI4Stream(base.BaseInterface):
         transactions = parsing_func(data, endian)
         self._write(thread, transactions)
 
-    def _f2s_bin_data(self, data_str, endian):
+    def _f2s_bin_data(self, data, endian):
         """
         A file parsing function for file_to_stream. Assumes a binary file that
-        contains only tdata
+        contains only tdata. The data is split into beats the width of tdata
+        and the last beat is padded with zeros if needed.
 
         Args:
-            data_str (str): Read data from the file as a string
+            data (bytes-like): Data read from the file
             endian (str): little|big
 
         Returns:
             list: Contains dicts representing each beat of AXI4Stream transaction
         """
 
-        transactions = []
-        data = bytearray(data_str)
+        data = memoryview(data).cast("B")
         file_size = len(data)
-        beat_count = (ceil(file_size / 8.0)) * 8
-        beat = 0
         tdata_bytes = int(self.get_signal("tdata").size / 8)
-
-        while beat < beat_count:
-            tdata = 0
-            for i in range(beat, beat + tdata_bytes):
-                if endian == "little":
-                    if i < file_size:
-                        tdata = (tdata >> 8) | (data[i] << 56)
-                    elif i < beat + tdata_bytes:
-                        tdata = tdata >> 8
-                else:  # big endian
-                    if i < file_size:
-                        tdata = (tdata << 8) | (data[i])
-                    elif i < beat + tdata_bytes:
-                        tdata = tdata << 8
-            # payload = self._payload(tdata="0x" + format(tdata, "08x"))
-            payload = self._payload(tdata=tdata)
-
-            if self.has_signal("tkeep"):
-                tkeep = self._f2s_tkeep(file_size, tdata_bytes, beat, endian)
-                payload = self._payload(payload, tkeep=tkeep)
-            if self.has_signal("tlast"):
-                tlast = self._f2s_tlast(file_size, beat)
-                payload = self._payload(payload, tlast=tlast)
-
-            transactions.append(payload)
-            beat = beat + tdata_bytes
+        beat_num = ceil(file_size / tdata_bytes)
+        if beat_num == 0:
+            return []
+
+        payload = self._payload(tdata=0)
+        if self.has_signal("tkeep"):
+            payload["tkeep"] = (2 ** int(self.get_signal("tkeep").size)) - 1
+        full_size = (beat_num - 1) * tdata_bytes
+        transactions = [
+            {**payload, "tdata": tdata}
+            for tdata in self._f2s_words(data[:full_size], tdata_bytes, endian)
+        ]
+
+        last_beat = data[full_size:].tobytes()
+        padding = bytes(tdata_bytes - len(last_beat))
+        if endian == "little":
+            tdata = int.from_bytes(last_beat + padding, "little")
+        else:
+            tdata = int.from_bytes(last_beat + padding, "big")
+        payload = self._payload(tdata=tdata)
+        if self.has_signal("tkeep"):
+            payload["tkeep"] = self._f2s_tkeep(
+                len(last_beat), tdata_bytes, endian
+            )
+        if self.has_signal("tlast"):
+            payload["tlast"] = 1
+        transactions.append(payload)
 
         return transactions
 
-    def _f2s_tkeep(self, file_size, tdata_bytes, beat, endian):
+    def _f2s_file(self, filepath, endian):
         """
-        Calculates tkeep for a particular beat for file_to_stream since the last
-        beat may be smaller than a word.
+        A lazy version of _f2s_bin_data that reads the beats from the file
+        when they're iterated over.
 
         Args:
-            file_size (int): Size of data in bytes to send over tdata
-            tdata_bytes (int): Width of tdata in bytes
-            beat (int): Beat counter
+            filepath (str): Path to the binary file
             endian (str): little|big
 
         Returns:
-            str: Tkeep value for the current beat
+            FilePayload: The beats of the AXI4Stream transaction
         """
 
-        if beat < ((ceil(file_size / 8.0) - 1) * 8.0):
-            tkeep = (2 ** self.get_signal("tkeep").size) - 1
-        else:
-            size_last_transaction = file_size % tdata_bytes
-            if size_last_transaction != 0:
-                tkeep = ""
-                for _ in range(size_last_transaction):
-                    tkeep = tkeep + "1"
-                if endian != "little":
-                    for _ in range(tdata_bytes - size_last_transaction):
-                        tkeep = tkeep + "0"
-                tkeep = int(tkeep, 2)
-            else:
-                tkeep = (2 ** self.get_signal("tkeep").size) - 1
-        return int(tkeep)
+        payload = self._payload(tdata=0, endpoint_mode=0)
+        if self.has_signal("tkeep"):
+            payload["tkeep"] = (2 ** int(self.get_signal("tkeep").size)) - 1
+        last_payload = dict(payload)
+        if self.has_signal("tlast"):
+            last_payload["tlast"] = 1
+        tdata_bytes = int(self.get_signal("tdata").size / 8)
+        file_size = os.path.getsize(filepath)
+        if self.has_signal("tkeep") and file_size % tdata_bytes:
+            last_payload["tkeep"] = self._f2s_tkeep(
+                file_size % tdata_bytes, tdata_bytes, endian
+            )
+        return FilePayload(
+            filepath, file_size, tdata_bytes, endian, payload, last_payload
+        )
 
     @staticmethod
-    def _f2s_tlast(file_size, beat):
+    def _f2s_words(data, tdata_bytes, endian):
+        """
+        Converts data into words for file_to_stream. Words the size of a
+        machine integer are converted together in an array, others one at a
+        time.
+
+        Args:
+            data (memoryview): The data. Its size must be a multiple of the
+                word size
+            tdata_bytes (int): Width of tdata in bytes
+            endian (str): little|big
+
+        Returns:
+            list: The words as integers
+        """
+
+        typecode = WORD_TYPECODES.get(tdata_bytes)
+        if typecode is None:
+            return [
+                int.from_bytes(data[i : i + tdata_bytes], endian)
+                for i in range(0, len(data), tdata_bytes)
+            ]
+        words = array(typecode)
+        words.frombytes(data)
+        if endian != sys.byteorder:
+            words.byteswap()
+        return words.tolist()
+
+    def _f2s_tkeep(self, last_size, tdata_bytes, endian):
         """
-        Calculates tlast for a particular beat for file_to_stream. The last beat
-        must assert tlast
+        Calculates tkeep for the last beat for file_to_stream since it may be
+        smaller than a word.
 
         Args:
-            file_size (int): Size of data in bytes to send over tdata
-            beat (int): Beat counter
+            last_size (int): Size of the last beat in bytes
+            tdata_bytes (int): Width of tdata in bytes
+            endian (str): little|big
 
         Returns:
-            str: Tlast value for the current beat
+            int: Tkeep value for the last beat
         """
 
-        tlast = 0
-        if beat >= ((ceil(file_size / 8.0) - 1) * 8):
-            tlast = 1
-        return tlast
+        if last_size == tdata_bytes:
+            return (2 ** int(self.get_signal("tkeep").size)) - 1
+        tkeep = (2**last_size) - 1
+        if endian != "little":
+            tkeep <<= tdata_bytes - last_size
+        return tkeep
+
+
+class FilePayload(Sequence):
+    """
+    The beats of a binary file containing only tdata, read from the file as
+    they're needed. The file is memory-mapped and converted a chunk at a time
+    so streaming it takes a constant amount of memory no matter its size.
+    """
+
+    def __init__(
+        self, filepath, file_size, tdata_bytes, endian, payload, last_payload
+    ):
+        """
+        Initialize the beats of a file
+
+        Args:
+            filepath (str): Path to the binary file
+            file_size (int): Size of the file in bytes
+            tdata_bytes (int): Width of tdata in bytes
+            endian (str): little|big
+            payload (dict): The beats without their tdata
+            last_payload (dict): The last beat without its tdata
+        """
+        self.filepath = os.path.abspath(filepath)
+        self.file_size = file_size
+        self.tdata_bytes = tdata_bytes
+        self.endian = endian
+        self.payload = payload
+        self.last_payload = last_payload
+
+    def __len__(self):
+        return ceil(self.file_size / self.tdata_bytes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        beat_num = len(self)
+        if index < 0:
+            index += beat_num
+        if not 0 <= index < beat_num:
+            raise IndexError("beat index out of range")
+        start = index * self.tdata_bytes
+        with open(self.filepath, "rb") as f:
+            f.seek(start)
+            word = f.read(min(self.tdata_bytes, self.file_size - start))
+        return self._beat(index == beat_num - 1, word)
+
+    def __iter__(self):
+        beat_num = len(self)
+        if beat_num == 0:
+            return
+        full_size = (beat_num - 1) * self.tdata_bytes
+        chunk_size = max(
+            FILE_CHUNK_SIZE - FILE_CHUNK_SIZE % self.tdata_bytes,
+            self.tdata_bytes,
+        )
+        with open(self.filepath, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as data:
+            if len(data) < self.file_size:
+                raise EOFError(f"{self.filepath} changed after it was added")
+            for start in range(0, full_size, chunk_size):
+                chunk = data[start : min(start + chunk_size, full_size)]
+                for tdata in AXI4Stream._f2s_words(
+                    chunk, self.tdata_bytes, self.endian
+                ):
+                    yield {**self.payload, "tdata": tdata}
+            last_beat = data[full_size : self.file_size]
+        yield self._beat(True, last_beat)
+
+    def _beat(self, last, word):
+        """
+        Make a beat from its word in the file, which is padded with zeros if
+        it's smaller than tdata
+
+        Args:
+            last (bool): Whether this is the last beat
+            word (bytes): The word
+
+        Returns:
+            dict: The beat
+        """
+        word += bytes(self.tdata_bytes - len(word))
+        payload = self.last_payload if last else self.payload
+        return {**payload, "tdata": int.from_bytes(word, self.endian)}
+
+    def asdict(self):
+        """
+        Converts the object to a list of beats
+
+        Returns:
+            list: The beats
+        """
+        return list(self)
+
+    def cache_key(self):
+        """
+        Identify the beats by the contents of the file rather than its path so
+        the cache of generated testbenches notices if the file changes
+
+        Returns:
+            dict: The key
+        """
+        digest = hashlib.sha256()
+        with open(self.filepath, "rb") as f:
+            for chunk in iter(lambda: f.read(FILE_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return {
+            "sha256": digest.hexdigest(),
+            "file_size": self.file_size,
+            "tdata_bytes": self.tdata_bytes,
+            "endian": self.endian,
+            "payload": self.payload,
+            "last_payload": self.last_payload,
+        }
+
+    def __eq__(self, other):
+        if isinstance(other, FilePayload):
+            return self.cache_key() == other.cache_key()
+        if isinstance(other, list):
+            return list(self) == other
+        return NotImplemented
+
+    def __repr__(self):
+        return f"FilePayload({self.filepath!r}, {len(self)} beats)"
 
 
 class AXI4StreamCore(base.InterfaceCore):
@@ -456,17 +710,18 @@ class AXI4StreamCore(base.InterfaceCore):
     }
 
     @classmethod
-    def write_cpp(cls, packet, _identifier="NULL"):
+    def cpp_lines(cls, packet, _identifier="NULL"):
         """
-        Write one line of the C++ data file
+        Generate the lines of the C++ data file for a command, one per word of
+        its payload
 
         Args:
             packet (dict): The command to write
 
-        Returns:
-            str: The command as a line for the data file
+        Yields:
+            str: A line for the data file
         """
-        return super().write_cpp(packet, str(packet["iClass"]))
+        yield from super().cpp_lines(packet, str(packet["iClass"]))
 
 
 class EndpointManualMaster(sonar.endpoints.InterfaceEndpoint):
@@ -55,17 +55,60 @@ class InterfaceCore(base.SonarObject):
         Returns:
             str: The command as a line for the data file
         """
-        line = ""
+        return "\n".join(cls.sv_lines(packet))
+
+    @classmethod
+    def pattern_args(cls, packet, lang):
+        """
+        Get the arguments of the record that precedes a packet with a pattern.
+        The packet's only word is evaluated "count" times, adding "step" to
+        its "arg" each time. If there's a "period_arg", it's set to 1 every
+        "period" words and 0 otherwise.
+
+        Args:
+            packet (dict): The command to write
+            lang (str): Language of the data file
+
+        Returns:
+            list: The count, index of the arg, step, index of the periodic
+                arg and period
+        """
+        pattern = packet["pattern"]
+        names = [arg for arg in cls.args[lang] if arg in packet["payload"][0]]
+        if pattern.get("period_arg") in names:
+            period_index = names.index(pattern["period_arg"])
+            period = pattern["period"]
+        else:
+            period_index = 0
+            period = 0
+        return [
+            pattern["count"],
+            names.index(pattern["arg"]),
+            pattern["step"],
+            period_index,
+            period,
+        ]
+
+    @classmethod
+    def sv_lines(cls, packet):
+        """
+        Generate the lines of the SV data file for a command, one per word of
+        its payload. A packet with a pattern is preceded by a pattern record.
+
+        Args:
+            packet (dict): The command to write
+
+        Yields:
+            str: A line for the data file
+        """
+        if "pattern" in packet:
+            args = [str(arg) for arg in cls.pattern_args(packet, "sv")]
+            yield " ".join(["pattern", packet["name"], str(len(args)), *args])
         for word in packet["payload"]:
-            count = 0
-            line += packet["type"] + " " + packet["name"] + " $COUNT$"
-            for arg, _ in cls.args["sv"].items():
-                if arg in word:
-                    count += 1
-                    line += " " + str(word[arg])
-            line = line.replace("$COUNT$", str(count))
-            line += "\n"
-        return line[:-1]
+            args = [str(word[arg]) for arg in cls.args["sv"] if arg in word]
+            yield " ".join(
+                [packet["type"], packet["name"], str(len(args)), *args]
+            )
 
     @classmethod
     def write_cpp(cls, packet, identifier="NULL"):
@@ -78,19 +121,32 @@ class InterfaceCore(base.SonarObject):
         Returns:
             str: The command as a line for the data file
         """
-        line = ""
+        return "\n".join(cls.cpp_lines(packet, identifier))
+
+    @classmethod
+    def cpp_lines(cls, packet, identifier="NULL"):
+        """
+        Generate the lines of the C++ data file for a command, one per word of
+        its payload. A packet with a pattern is preceded by a pattern record.
+
+        Args:
+            packet (dict): The command to write
+            identifier (str, optional): Identifier of the interface in the
+                line. Defaults to "NULL".
+
+        Yields:
+            str: A line for the data file
+        """
+        if "pattern" in packet:
+            args = [str(arg) for arg in cls.pattern_args(packet, "cpp")]
+            yield " ".join(
+                ["pattern", "NULL", "NULL", str(len(args)), *args]
+            )
         for word in packet["payload"]:
-            count = 0
-            line += (
-                packet["name"] + " " + "NULL" + " " + identifier + " $COUNT$"
+            args = [str(word[arg]) for arg in cls.args["cpp"] if arg in word]
+            yield " ".join(
+                [packet["name"], "NULL", identifier, str(len(args)), *args]
             )
-            for arg, _ in cls.args["cpp"].items():
-                if arg in word:
-                    count += 1
-                    line += " " + str(word[arg])
-            line = line.replace("$COUNT$", str(count))
-            line += "\n"
-        return line[:-1]
 
     @classmethod
     def asdict(cls):
@@ -38,6 +38,7 @@ def parse_args():
     cli.env(subparser)
     cli.init(subparser)
     cli.repo(subparser)
+    cli.testbench(subparser)
     cli.tool(subparser)
 
     command_group = parser.add_argument_group("Options")
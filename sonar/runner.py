@@ -0,0 +1,265 @@
+"""
+Run simulations of a testbench whose test vectors are split into shards, one
+simulator process per shard, and merge their results. The simulator is run
+with a user-provided command so any simulator (or a stand-in for testing) can
+be used. Run from the command line with:
+
+    python -m sonar.runner --shards 4 -- ./run.sh ... +SONAR_SHARD={shard}
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sonar.core.generate import available_cpus
+from sonar.exceptions import SonarInvalidArgError
+
+# printed by the SV testbench if no errors were detected
+SUCCESS_LINE = "SUCCESS: all tests completed successfully!"
+
+# printed by the SV testbench at the end of each test vector
+VECTOR_LINE = re.compile(r"Test vector (\d+) complete")
+
+# lines that report an error in the current test vector
+ERROR_LINE = re.compile(r"^(?:Error|ERROR|Fatal|FATAL)\b|Timed out")
+
+LOG_FILENAME = "sim_{shard}.log"
+
+REPORT_FILENAME = "sim_report.json"
+
+
+def format_command(command, shard):
+    """
+    Substitute the index of the shard into the simulator command
+
+    Args:
+        command (str or list): The command. Each "{shard}" in it is replaced
+            by the index of the shard. A string is run in a shell
+        shard (int): Index of the shard
+
+    Returns:
+        str or list: The command for the shard
+    """
+    if isinstance(command, str):
+        return command.replace("{shard}", str(shard))
+    return [arg.replace("{shard}", str(shard)) for arg in command]
+
+
+def parse_log(lines, start):
+    """
+    Find the result of each test vector in the log of a simulation as it's
+    being written. Errors are attributed to the test vector that completes
+    after them.
+
+    Args:
+        lines (Iterable): Lines of the log
+        start (float): The time the simulation started as returned by
+            time.perf_counter()
+
+    Yields:
+        tuple(str, dict): Each line and, if it completes a test vector, the
+            result of the vector or otherwise None
+    """
+    errors = []
+    last_time = start
+    for line in lines:
+        line = line.rstrip("\n")
+        result = None
+        match = VECTOR_LINE.search(line)
+        if match:
+            now = time.perf_counter()
+            result = {
+                "vector": int(match.group(1)),
+                "passed": not errors,
+                "wall_time": now - last_time,
+                "errors": errors,
+            }
+            errors = []
+            last_time = now
+        elif ERROR_LINE.search(line):
+            errors.append(line)
+        yield line, result
+
+
+def run_shard(command, shard, log_dir, echo=None, env=None):
+    """
+    Run the simulation of one shard, writing its output to a log file
+
+    Args:
+        command (str or list): The simulator command. See format_command()
+        shard (int): Index of the shard
+        log_dir (str): Directory to write the log to
+        echo (Callable, optional): Called with each line of the output as
+            it's read. Defaults to None.
+        env (dict, optional): Environment of the simulator. Defaults to the
+            environment of this process.
+
+    Returns:
+        dict: The result of the shard
+    """
+    command = format_command(command, shard)
+    log_path = os.path.join(log_dir, LOG_FILENAME.format(shard=shard))
+    vectors = []
+    success = False
+    start = time.perf_counter()
+    with open(log_path, "w") as log, subprocess.Popen(
+        command,
+        shell=isinstance(command, str),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+        env=env,
+    ) as process:
+        for line, result in parse_log(process.stdout, start):
+            log.write(line + "\n")
+            if echo is not None:
+                echo(shard, line)
+            if result is not None:
+                result["shard"] = shard
+                vectors.append(result)
+            elif line.strip() == SUCCESS_LINE:
+                success = True
+    returncode = process.wait()
+    return {
+        "shard": shard,
+        "returncode": returncode,
+        "passed": success and returncode == 0,
+        "wall_time": time.perf_counter() - start,
+        "log": log_path,
+        "vectors": vectors,
+    }
+
+
+def run_shards(command, shards, log_dir=".", jobs=None, echo=False, env=None):
+    """
+    Run the simulations of all the shards, up to a number of them at once,
+    and merge their results
+
+    Args:
+        command (str or list): The simulator command. See format_command()
+        shards (int): Number of shards
+        log_dir (str, optional): Directory to write the logs and report to.
+            Defaults to ".".
+        jobs (int, optional): Max number of simulations to run at once.
+            Defaults to the number of CPUs available.
+        echo (bool, optional): Print the output of the simulations as it's
+            read, prefixed with the index of the shard. Defaults to False.
+        env (dict, optional): Environment of the simulators. Defaults to the
+            environment of this process.
+
+    Raises:
+        SonarInvalidArgError: Raised for invalid numbers of shards or jobs
+
+    Returns:
+        dict: The merged report. It's also written to the log directory
+    """
+    if shards < 1:
+        raise SonarInvalidArgError("There must be at least one shard")
+    if jobs is None:
+        jobs = available_cpus()
+    if jobs < 1:
+        raise SonarInvalidArgError("There must be at least one job")
+    os.makedirs(log_dir, exist_ok=True)
+
+    print_lock = threading.Lock()
+
+    def echo_line(shard, line):
+        with print_lock:
+            print(f"[{shard}] {line}", flush=True)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(min(jobs, shards)) as executor:
+        results = list(
+            executor.map(
+                lambda shard: run_shard(
+                    command,
+                    shard,
+                    log_dir,
+                    echo_line if echo else None,
+                    env,
+                ),
+                range(shards),
+            )
+        )
+
+    vectors = sorted(
+        (vector for result in results for vector in result.pop("vectors")),
+        key=lambda vector: vector["vector"],
+    )
+    report = {
+        "passed": all(result["passed"] for result in results)
+        and all(vector["passed"] for vector in vectors),
+        "wall_time": time.perf_counter() - start,
+        "shards": results,
+        "vectors": vectors,
+    }
+    with open(os.path.join(log_dir, REPORT_FILENAME), "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def main():
+    """
+    Run the simulations given on the command line and print the results
+
+    Returns:
+        int: Exit code, non-zero if any simulation failed
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--shards", type=int, required=True, help="Number of shards"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="Max number of simulations to run at once. Defaults to the "
+        "number of CPUs",
+    )
+    parser.add_argument(
+        "--log-dir",
+        default=".",
+        help="Directory to write the logs and report to",
+    )
+    parser.add_argument(
+        "--quiet",
+        action="store_true",
+        help="Don't print the output of the simulations",
+    )
+    parser.add_argument(
+        "command",
+        nargs="+",
+        help="The simulator command. {shard} is replaced with the shard",
+    )
+    args = parser.parse_args()
+
+    report = run_shards(
+        args.command, args.shards, args.log_dir, args.jobs, not args.quiet
+    )
+    for vector in report["vectors"]:
+        status = "passed" if vector["passed"] else "FAILED"
+        print(
+            f"Test vector {vector['vector']} (shard {vector['shard']}): "
+            f"{status} in {vector['wall_time']:.3f} s"
+        )
+    for shard in report["shards"]:
+        if not shard["passed"]:
+            print(
+                f"Shard {shard['shard']} failed with exit code "
+                f"{shard['returncode']}. See {shard['log']}"
+            )
+    print(
+        f"{'SUCCESS' if report['passed'] else 'FAILURE'}: "
+        f"{len(report['vectors'])} test vectors in {len(report['shards'])} "
+        f"shards took {report['wall_time']:.3f} s"
+    )
+    return 0 if report["passed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,405 @@
+"""
+Save testbench definitions as JSON and load them back so a testbench can be
+generated again without rerunning the script that defined it. Unlike
+Testbench.asjson(), the output holds everything needed to rebuild the
+testbench and it's streamed to the file a thread at a time rather than built
+in memory first. Each command is written on its own line.
+"""
+
+import importlib
+import json
+
+import sonar.base_types as base
+import sonar.endpoints
+import sonar.interfaces.base_interface as base_interface
+import sonar.testbench
+from sonar.commands import Commands
+from sonar.exceptions import SonarInvalidArgError
+from sonar.interfaces.axi4_stream import FilePayload
+
+FORMAT = "sonar_testbench"
+VERSION = 1
+
+# commands are written to the file this many at a time
+BATCH_SIZE = 1024
+
+_encoder = json.JSONEncoder(ensure_ascii=False)
+
+
+def class_path(cls):
+    """
+    Identify a class so it can be imported when the testbench is loaded
+
+    Args:
+        cls (type): The class
+
+    Returns:
+        str: The module and name of the class
+    """
+    return f"{cls.__module__}:{cls.__qualname__}"
+
+
+def load_class(path, base_class):
+    """
+    Import a class identified by class_path()
+
+    Args:
+        path (str): The module and name of the class
+        base_class (type): The class must be a subclass of this one
+
+    Raises:
+        SonarInvalidArgError: Raised if the class isn't a subclass of
+            base_class
+
+    Returns:
+        type: The class
+    """
+    module_name, _, name = path.partition(":")
+    cls = importlib.import_module(module_name)
+    for attribute in name.split("."):
+        cls = getattr(cls, attribute)
+    if not isinstance(cls, type) or not issubclass(cls, base_class):
+        raise SonarInvalidArgError(
+            f"{path} is not a subclass of {base_class.__name__}"
+        )
+    return cls
+
+
+def dump_endpoint(endpoint):
+    """
+    Convert an endpoint to a dictionary
+
+    Args:
+        endpoint (type): The endpoint class
+
+    Returns:
+        dict: The endpoint
+    """
+    return {"class": class_path(endpoint), "arguments": endpoint.arguments}
+
+
+def load_endpoint(endpoint):
+    """
+    Rebuild an endpoint. Like when it was added, its arguments are set on its
+    class.
+
+    Args:
+        endpoint (dict): The endpoint as converted by dump_endpoint()
+
+    Returns:
+        type: The endpoint class
+    """
+    cls = load_class(endpoint["class"], sonar.endpoints.Endpoint)
+    cls.arguments = endpoint["arguments"]
+    return cls
+
+
+def dump_interface(interface):
+    """
+    Convert an interface to a dictionary. All of its attributes are kept so
+    it's rebuilt as it was after being added to its module.
+
+    Args:
+        interface (BaseInterface): The interface
+
+    Returns:
+        dict: The interface
+    """
+    attributes = {
+        key: value
+        for key, value in vars(interface).items()
+        if key not in ("signals", "core", "endpoints")
+    }
+    return {
+        "class": class_path(type(interface)),
+        "core": class_path(interface.core),
+        "attributes": attributes,
+        "signals": {
+            signal_type: signal.asdict()
+            for signal_type, signal in interface.signals.items()
+        },
+        "endpoints": [
+            dump_endpoint(endpoint) for endpoint in interface.endpoints
+        ],
+    }
+
+
+def load_interface(interface):
+    """
+    Rebuild an interface
+
+    Args:
+        interface (dict): The interface as converted by dump_interface()
+
+    Returns:
+        BaseInterface: The interface
+    """
+    cls = load_class(interface["class"], base_interface.BaseInterface)
+    obj = cls.__new__(cls)
+    vars(obj).update(interface["attributes"])
+    obj.core = load_class(interface["core"], base_interface.InterfaceCore)
+    obj.signals = {
+        signal_type: base.Signal(signal["name"], signal["size"])
+        for signal_type, signal in interface["signals"].items()
+    }
+    obj.endpoints = [
+        load_endpoint(endpoint) for endpoint in interface["endpoints"]
+    ]
+    return obj
+
+
+def dump_module(module):
+    """
+    Convert a module to a dictionary
+
+    Args:
+        module (Module): The module
+
+    Returns:
+        dict: The module
+    """
+    ports = module.ports
+    return {
+        "name": module.name,
+        "type": module.type,
+        "parameters": module.parameters,
+        "clocks": [clock.asdict() for clock in ports.get_clocks()],
+        "resets": [reset.asdict() for reset in ports.get_resets()],
+        "signals": [signal.asdict() for signal in ports.get_signals()],
+        "interfaces": [
+            dump_interface(interface) for interface in ports.get_interfaces()
+        ],
+        "interface_count": ports.interfaces.count,
+        "endpoints": {
+            port: [dump_endpoint(endpoint) for endpoint in endpoints]
+            for port, endpoints in module.endpoints.items()
+        },
+    }
+
+
+def load_module(module):
+    """
+    Rebuild a module
+
+    Args:
+        module (dict): The module as converted by dump_module()
+
+    Returns:
+        Module: The module
+    """
+    obj = sonar.testbench.Module.default(module["name"])
+    obj.type = module["type"]
+    obj.parameters = [tuple(parameter) for parameter in module["parameters"]]
+    for clock in module["clocks"]:
+        obj.ports.add_clock(
+            base.ClockPort(
+                clock["name"],
+                clock["size"],
+                clock["period"],
+                clock["direction"],
+            )
+        )
+    for reset in module["resets"]:
+        obj.ports.add_reset(
+            base.SignalPort(reset["name"], reset["size"], reset["direction"])
+        )
+    for signal in module["signals"]:
+        obj.ports.add_signal(
+            base.SignalPort(
+                signal["name"], signal["size"], signal["direction"]
+            )
+        )
+    for interface in module["interfaces"]:
+        obj.ports.add_interface(load_interface(interface))
+    obj.ports.interfaces.count = module["interface_count"]
+    for port, endpoints in module["endpoints"].items():
+        for endpoint in endpoints:
+            obj.add_endpoint(port, load_endpoint(endpoint))
+    return obj
+
+
+def encode_command(command):
+    """
+    Convert a command to JSON. Beats streamed lazily from a file are saved as
+    a reference to the file.
+
+    Args:
+        command (dict): The command
+
+    Returns:
+        str: The command as JSON
+    """
+    if "interface" in command and isinstance(
+        command["interface"]["payload"], FilePayload
+    ):
+        payload = command["interface"]["payload"]
+        command = {
+            **command,
+            "interface": {
+                **command["interface"],
+                "payload": {
+                    "file": {
+                        "filepath": payload.filepath,
+                        "file_size": payload.file_size,
+                        "tdata_bytes": payload.tdata_bytes,
+                        "endian": payload.endian,
+                        "payload": payload.payload,
+                        "last_payload": payload.last_payload,
+                    }
+                },
+            },
+        }
+    return _encoder.encode(command)
+
+
+def decode_command(command):
+    """
+    Rebuild a command converted by encode_command()
+
+    Args:
+        command (dict): The command as read from JSON
+
+    Returns:
+        dict: The command
+    """
+    if "interface" in command and isinstance(
+        command["interface"]["payload"], dict
+    ):
+        command["interface"]["payload"] = FilePayload(
+            **command["interface"]["payload"]["file"]
+        )
+    return command
+
+
+def write_thread(f, thread):
+    """
+    Write a thread as JSON, streaming its commands
+
+    Args:
+        f (file): The file to write to
+        thread (Thread): The thread
+    """
+    f.write(
+        '{"timestamps": '
+        + _encoder.encode(
+            [
+                thread._enable_timestamps,  # pylint: disable=protected-access
+                thread.timestamp_prefix,
+                thread.timestamp_index,
+            ]
+        )
+        + ', "commands": ['
+    )
+    batch = []
+    separator = "\n"
+    for command in thread.commands:
+        batch.append(encode_command(command))
+        if len(batch) == BATCH_SIZE:
+            f.write(separator + ",\n".join(batch))
+            separator = ",\n"
+            batch = []
+    if batch:
+        f.write(separator + ",\n".join(batch))
+    f.write("\n]}")
+
+
+def load_thread(thread):
+    """
+    Rebuild a thread
+
+    Args:
+        thread (dict): The thread as written by write_thread()
+
+    Returns:
+        Thread: The thread
+    """
+    obj = sonar.testbench.Thread()
+    # pylint: disable=protected-access
+    (
+        obj._enable_timestamps,
+        obj.timestamp_prefix,
+        obj.timestamp_index,
+    ) = thread["timestamps"]
+    obj.commands = Commands(
+        decode_command(command) for command in thread["commands"]
+    )
+    return obj
+
+
+def dump(testbench, f):
+    """
+    Write a testbench as JSON. The test vectors are streamed to the file.
+
+    Args:
+        testbench (Testbench): The testbench
+        f (file): The file to write to, opened in text mode
+    """
+    f.write(
+        "{\n"
+        + f'"format": "{FORMAT}",\n"version": {VERSION},\n'
+        + '"metadata": '
+        + _encoder.encode(testbench.metadata)
+        + ',\n"modules": '
+        + _encoder.encode(
+            {
+                name: dump_module(module)
+                for name, module in testbench.modules.items()
+            }
+        )
+        + ',\n"wait_conditions": '
+        + _encoder.encode(testbench.wait_conditions)
+        + ',\n"prologue_thread": '
+    )
+    if testbench.prologue_thread is None:
+        f.write("null")
+    else:
+        write_thread(f, testbench.prologue_thread)
+    f.write(',\n"vectors": [')
+    for i, vector in enumerate(testbench.vectors):
+        f.write(",\n[" if i else "\n[")
+        for j, thread in enumerate(vector.threads):
+            f.write(",\n" if j else "\n")
+            write_thread(f, thread)
+        f.write("\n]")
+    f.write("\n]\n}\n")
+
+
+def load(f):
+    """
+    Read a testbench written by dump()
+
+    Args:
+        f (file): The file to read from
+
+    Raises:
+        SonarInvalidArgError: Raised if the file isn't a testbench in a
+            supported version of the format
+
+    Returns:
+        Testbench: The testbench
+    """
+    data = json.load(f)
+    if not isinstance(data, dict) or data.get("format") != FORMAT:
+        raise SonarInvalidArgError("The file is not a sonar testbench")
+    if data["version"] != VERSION:
+        raise SonarInvalidArgError(
+            f"Unsupported testbench version {data['version']}"
+        )
+    testbench = sonar.testbench.Testbench()
+    testbench.metadata = data["metadata"]
+    testbench.modules = {
+        name: load_module(module) for name, module in data["modules"].items()
+    }
+    testbench.wait_conditions = data["wait_conditions"]
+    if data["prologue_thread"] is not None:
+        testbench.prologue_thread = load_thread(data["prologue_thread"])
+    vectors = data.pop("vectors")
+    # each vector is released once it's rebuilt
+    vectors.reverse()
+    while vectors:
+        testbench.add_test_vector(
+            sonar.testbench.TestVector(
+                threads=[load_thread(thread) for thread in vectors.pop()]
+            )
+        )
+    return testbench
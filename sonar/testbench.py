@@ -2,11 +2,15 @@
 Main module to define a testbench in sonar
 """
 
+import contextlib
 import json
 
 import sonar.base_types as base
 import sonar.endpoints
-from sonar.core import generate
+import sonar.serialize
+from sonar.commands import Commands, SpilledCommands
+from sonar.core import generate, parallel, script_cache
+from sonar.exceptions import SonarInvalidArgError
 
 
 class Testbench(base.SonarObject):
@@ -119,6 +123,29 @@ class Testbench(base.SonarObject):
 
         self.vectors.append(vector)
 
+    def add_vectors_parallel(self, builder, params, workers=None):
+        """
+        Build test vectors in worker processes and add them to the testbench
+        in the order of their parameters so the generated testbenches are the
+        same as if they were built and added one at a time. See
+        parallel.build_vectors()
+
+        Args:
+            builder (Callable): Called with each parameter to build a
+                TestVector
+            params (Iterable): Parameters to build a test vector for
+            workers (int, optional): Number of worker processes. Defaults to
+                None, the number of available CPUs.
+
+        Returns:
+            list: The added test vectors
+        """
+
+        vectors = parallel.build_vectors(builder, params, workers)
+        for vector in vectors:
+            self.add_test_vector(vector)
+        return vectors
+
     def set_prologue_thread(self, thread):
         """
         Set a thread to act as a prologue prior to every test vector. Typically,
@@ -160,9 +187,68 @@ class Testbench(base.SonarObject):
             str: Testbench object dumped as JSON string
         """
 
-        return json.dumps(self.asdict(), indent=2)
+        # lazy payloads (e.g. from file_to_stream) are converted to lists
+        return json.dumps(
+            self.asdict(), indent=2, default=lambda obj: obj.asdict()
+        )
+
+    def to_json(self, filepath):
+        """
+        Save the testbench to a JSON file that it can be loaded from with
+        from_json() later. The test vectors are streamed to the file rather
+        than converted to a dictionary first.
+
+        Args:
+            filepath (str): Path of the JSON file
+        """
+
+        with open(filepath, "w", encoding="utf-8") as f:
+            sonar.serialize.dump(self, f)
+
+    @classmethod
+    def from_json(cls, filepath):
+        """
+        Load a testbench saved with to_json(). It can be generated without
+        rerunning the script that defined it.
+
+        Args:
+            filepath (str): Path of the JSON file
+
+        Returns:
+            Testbench: The testbench
+        """
+
+        with open(filepath, "r", encoding="utf-8") as f:
+            return sonar.serialize.load(f)
+
+    def compile(self, parametrize_waits=False):
+        """
+        Legalize the testbench into the form that the backends generate
+        testbenches from. The testbench itself is left unchanged. The compiled
+        testbench can be passed to sonar.core.generate.sonar() any number of
+        times without being legalized again.
+
+        Args:
+            parametrize_waits (bool, optional): Share keys between wait
+                conditions that differ only in the integers they compare
+                against. Defaults to False
 
-    def generate_tb(self, tb_filepath, languages, force=False):
+        Returns:
+            CompiledTestbench: The compiled testbench
+        """
+
+        return generate.legalize_config(self, parametrize_waits)
+
+    def generate_tb(
+        self,
+        tb_filepath,
+        languages,
+        force=False,
+        data_format="text",
+        parametrize_waits=False,
+        profile=False,
+        shards=1,
+    ):
         """
         After the Testbench object is complete, this will invoke the Sonar Core
         to generate the testbench(es) based on the information
@@ -170,10 +256,35 @@ class Testbench(base.SonarObject):
         Args:
             tb_filepath (str): path to the sonar testbench script
             languages (str): sv or all to choose which languages
-            force (bool, optional): Force testbench generation. Defaults to False
+            force (bool, optional): Generate the testbenches even if they're
+                unchanged since they were last generated. Defaults to False
+            data_format (str, optional): text or bin to choose the format of
+                the data files. Defaults to "text"
+            parametrize_waits (bool, optional): Share keys between wait
+                conditions that differ only in the integers they compare
+                against. Defaults to False
+            profile (bool, optional): Profile the stages of the generation.
+                Defaults to False
+            shards (int, optional): Number of data files to split the test
+                vectors of the SV testbench into. Defaults to 1
+
+        Returns:
+            dict: The profiling report if profile is set, otherwise None
         """
 
-        generate.sonar(self, tb_filepath, languages, force)
+        kwargs = {
+            "languages": languages,
+            "force": force,
+            "data_format": data_format,
+            "parametrize_waits": parametrize_waits,
+            "profile": profile,
+            "shards": shards,
+        }
+        if script_cache.recording():
+            # the script is being run by "sonar testbench" so the testbench is
+            # saved to be generated again without rerunning the script
+            script_cache.record(self, tb_filepath, kwargs)
+        return generate.sonar(self, tb_filepath, **kwargs)
 
     def get_from_dut(self, key):
         """
@@ -451,11 +562,27 @@ class Thread(base.SonarObject):
         Initializes a default empty thread
         """
 
-        self.commands = []
+        self.commands = Commands()
         self._enable_timestamps = False
         self.timestamp_prefix = ""
         self.timestamp_index = 0
 
+    def spill(self, directory=None):
+        """
+        Store the commands of this thread in a temporary file rather than in
+        memory so it can hold more commands than fit in memory. Commands
+        already added are moved to the file and later ones are written to it
+        as they're added. Once spilled, commands can only be added and
+        removed at the end of the thread.
+
+        Args:
+            directory (str, optional): Directory to create the temporary file
+                in. Defaults to None, the default temporary directory.
+        """
+
+        if not isinstance(self.commands, SpilledCommands):
+            self.commands = SpilledCommands(self.commands, directory)
+
     def add_delay(self, delay):
         """
         Add a timed delay to the thread
@@ -487,6 +614,41 @@ class Thread(base.SonarObject):
 
         self.commands.append({"macro": "INIT_SIGNALS"})
 
+    @contextlib.contextmanager
+    def loop(self, count):
+        """
+        Repeat the commands added to the thread in this context some number
+        of times. The commands are only added once and the testbench replays
+        them so a long loop doesn't make the data file any larger. Loops can
+        be nested. If the context raises an exception, the commands added in
+        it are removed.
+
+        Args:
+            count (int): Number of times to run the commands
+
+        Raises:
+            SonarInvalidArgError: Raised if count isn't a non-negative integer
+
+        Yields:
+            Thread: This thread
+        """
+
+        if not isinstance(count, int) or count < 0:
+            raise SonarInvalidArgError(
+                f"Loop count must be a non-negative integer, not {count}"
+            )
+        start = len(self.commands)
+        self.commands.append({"loop": {"begin": count}})
+        try:
+            yield self
+        except BaseException:
+            del self.commands[start:]
+            raise
+        if count == 0:
+            del self.commands[start:]
+        else:
+            self.commands.append({"loop": {"end": count}})
+
     def call_dut(self, num):
         """
         Call the DUT function some number of times (only for C++ TBs)
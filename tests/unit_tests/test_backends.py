@@ -0,0 +1,531 @@
+"""
+Test the language backends used to generate testbenches
+"""
+
+import io
+import struct
+
+import pytest
+
+from sonar.commands import command_type
+from sonar.core.backends import cpp, include, sv
+from sonar.core.backends.data_file import (
+    BINARY_MAGIC,
+    BINARY_RESERVED_STRINGS,
+    BinaryDataFile,
+    DataFile,
+)
+from sonar.core.backends.template import Template
+from sonar.exceptions import SonarInvalidArgError
+from sonar.interfaces.axi4_stream import AXI4Stream
+from sonar.testbench import Module, Testbench, TestVector
+
+
+def make_testbench(vector_num, thread_num, command_num):
+    """
+    Make a testbench with some number of vectors, threads and commands
+
+    Args:
+        vector_num (int): Number of test vectors
+        thread_num (int): Number of threads in each test vector
+        command_num (int): Number of commands in each thread
+
+    Returns:
+        Testbench: The testbench
+    """
+    testbench = Testbench.default("test")
+    for _ in range(vector_num):
+        vector = TestVector()
+        for _ in range(thread_num):
+            thread = vector.add_thread()
+            for i in range(command_num):
+                thread.set_signal("signal", i)
+        vector.threads[-1].end_vector()
+        testbench.add_test_vector(vector)
+    return testbench
+
+
+def get_offsets(data_file, prefix):
+    """
+    Get the character offsets of all the lines in the data file with a prefix
+
+    Args:
+        data_file (str): The data file
+        prefix (str): Prefix of the lines to find
+
+    Returns:
+        list: Offsets of the matching lines
+    """
+    offsets = []
+    offset = 0
+    for line in data_file.split("\n"):
+        if line.startswith(prefix):
+            offsets.append(offset)
+        offset += len(line) + 1
+    return offsets
+
+
+def get_seeks(data_file, prefix):
+    """
+    Get the values of all the seek lines in the data file with a prefix
+
+    Args:
+        data_file (str): The data file
+        prefix (str): Prefix of the seek lines to find
+
+    Returns:
+        list: Values on the seek lines
+    """
+    return [
+        int(line.split()[2])
+        for line in data_file.split("\n")
+        if line.startswith(prefix)
+    ]
+
+
+def test_sv_seeks():
+    """
+    The seek table in the SV data file must point to the start of each test
+    vector and thread, including when the widths of the seek values change
+    """
+    testbench = make_testbench(30, 5, 20)
+    stream = io.BytesIO()
+    max_args, max_threads = sv.write_data_file(testbench, DataFile(stream, 2))
+    data_file = stream.getvalue().decode()
+
+    assert max_args == 1
+    assert max_threads == 5
+    assert get_seeks(data_file, "TestVector seek") == get_offsets(
+        data_file, "ParallelSection count"
+    )
+    assert get_seeks(data_file, "ParallelSection seek") == get_offsets(
+        data_file, "Packet count"
+    )
+
+
+def test_sv_calculate_seeks():
+    """
+    Seeks are computed only from the sizes of the thread sections
+    """
+    vector_seeks, thread_seeks = sv.calculate_seeks([[10], [20, 30]])
+
+    # header: "TestVector count 2" + "TestVector seek 58" + "TestVector seek 117"
+    assert vector_seeks == [19 + 19 + 20, 117]
+    # vector: "ParallelSection count N" + N * "ParallelSection seek XXX"
+    assert thread_seeks == [[58 + 24 + 25], [117 + 24 + 50, 191 + 20]]
+
+
+def read_binary_data_file(data, arg_index):
+    """
+    Decode a binary data file by following its seek table, the same way the
+    testbench reads it
+
+    Args:
+        data (bytes): The binary data file
+        arg_index (int): Number of strings in each record
+
+    Returns:
+        list: For each test vector, a list of the packet lines of its threads
+    """
+    header = struct.Struct(f"<{arg_index}IQI")
+    assert data[:4] == BINARY_MAGIC
+    string_num = struct.unpack_from("<I", data, 8)[0]
+    offset = 12
+    strings = []
+    for _ in range(string_num):
+        length = struct.unpack_from("<I", data, offset)[0]
+        strings.append(data[offset + 4 : offset + 4 + length].decode())
+        offset += 4 + length
+
+    def read_record(offset, packet=False):
+        *indices, value, width = header.unpack_from(data, offset)
+        offset += header.size
+        words = [strings[index] for index in indices] + [str(value)]
+        for _ in range(value if packet else 0):
+            arg = int.from_bytes(data[offset : offset + width], "little")
+            words.append(str(arg))
+            offset += width
+        return words, value, offset
+
+    words, vector_num, offset = read_record(offset)
+    assert words[:2] == ["TestVector", "count"]
+    vector_seeks = []
+    for _ in range(vector_num):
+        _, seek, offset = read_record(offset)
+        vector_seeks.append(seek)
+    vectors = []
+    for vector_seek in vector_seeks:
+        words, thread_num, offset = read_record(vector_seek)
+        assert words[:2] == ["ParallelSection", "count"]
+        thread_seeks = []
+        for _ in range(thread_num):
+            _, seek, offset = read_record(offset)
+            thread_seeks.append(seek)
+        threads = []
+        for thread_seek in thread_seeks:
+            words, packet_num, offset = read_record(thread_seek)
+            assert words[:2] == ["Packet", "count"]
+            packets = []
+            for _ in range(packet_num):
+                words, _, offset = read_record(offset, True)
+                packets.append(" ".join(words))
+            threads.append(packets)
+        vectors.append(threads)
+    return vectors
+
+
+def test_sv_binary_data_file():
+    """
+    The binary data file must hold the same packets as the text data file and
+    its seek table must point to the start of each test vector and thread
+    """
+    testbench = make_testbench(30, 5, 20)
+    testbench.vectors[0].threads[0].set_signal("signal", 2**70)
+    testbench.vectors[0].threads[0].display("a_message")
+    text_stream = io.BytesIO()
+    sv.write_data_file(testbench, DataFile(text_stream, 2))
+    bin_stream = io.BytesIO()
+    bin_file = BinaryDataFile(bin_stream, 2)
+    max_args, max_threads = sv.write_data_file(testbench, bin_file)
+
+    assert max_args == 1
+    assert max_threads == 5
+    assert bin_file.max_arg_width == 9
+
+    text_data_file = text_stream.getvalue().decode()
+    vectors = read_binary_data_file(bin_stream.getvalue(), 2)
+    lines = [
+        line.replace('"', "")
+        for line in text_data_file.splitlines()
+        if not line.startswith(("TestVector", "ParallelSection", "Packet"))
+    ]
+    assert [
+        packet
+        for threads in vectors
+        for packets in threads
+        for packet in packets
+    ] == lines
+
+
+@pytest.mark.parametrize("value", [-1, "0x1f"])
+def test_sv_binary_data_file_invalid(tmp_path, value):
+    """
+    Arguments that the binary data file can't encode are rejected with an
+    error naming the command
+
+    Args:
+        tmp_path (Path): Defined in pytest as a temporary directory
+        value (int|str): Value of the signal
+    """
+    testbench = Testbench.default("test")
+    dut = Module.default("DUT")
+    dut.add_clock_port("ap_clk", "20ns")
+    dut.add_port("val", "input", 8)
+    testbench.add_dut(dut)
+    vector = TestVector()
+    thread = vector.add_thread()
+    thread.set_signal("val", value)
+    thread.end_vector()
+    testbench.add_test_vector(vector)
+    filepath = str(tmp_path / "test.py")
+    testbench.generate_tb(filepath, "sv", True, data_format="text")
+    with pytest.raises(SonarInvalidArgError, match=f"signal val 1 {value}"):
+        testbench.generate_tb(filepath, "sv", True, data_format="bin")
+
+
+def test_cpp_binary_data_file():
+    """
+    The binary C++ data file must hold the same lines as the text data file
+    and reserved strings must be at the start of its string table
+    """
+    testbench = make_testbench(3, 2, 5)
+    testbench.vectors[0].threads[0].display("a_message")
+    text_stream = io.BytesIO()
+    cpp.write_data_file(testbench, DataFile(text_stream, 3))
+    bin_stream = io.BytesIO()
+    bin_file = BinaryDataFile(bin_stream, 3)
+    bin_file.reserve(cpp.TEMPLATE_STRINGS)
+    cpp.write_data_file(testbench, bin_file)
+
+    data = bin_stream.getvalue()
+    header = struct.Struct("<3IQI")
+    string_num = struct.unpack_from("<I", data, 8)[0]
+    offset = 12
+    strings = []
+    for _ in range(string_num):
+        length = struct.unpack_from("<I", data, offset)[0]
+        strings.append(data[offset + 4 : offset + 4 + length].decode())
+        offset += 4 + length
+    start = len(BINARY_RESERVED_STRINGS)
+    assert strings[start : start + len(cpp.TEMPLATE_STRINGS)] == list(
+        cpp.TEMPLATE_STRINGS
+    )
+
+    lines = []
+    while offset < len(data):
+        *indices, value, width = header.unpack_from(data, offset)
+        offset += header.size
+        words = [strings[index] for index in indices] + [str(value)]
+        for _ in range(value):
+            words.append(
+                str(int.from_bytes(data[offset : offset + width], "little"))
+            )
+            offset += width
+        lines.append(" ".join(words))
+    assert lines == [
+        line.replace('"', "")
+        for line in text_stream.getvalue().decode().splitlines()
+    ][:-1] + ["finish NULL NULL 0"]
+    assert bin_file.count == text_stream.getvalue().count(b"\n")
+
+
+def test_template():
+    """
+    Rendering a template must give the same testbench as replacing each
+    string in turn
+    """
+    text = (
+        "module SONAR_MODULE_NAME_tb;\n"
+        "    SONAR_A\n"
+        "  SONAR_B SONAR_A\n"
+        "SONAR_C SONAR_UNUSED not a placeholder\n"
+    )
+    replacements = [
+        ("SONAR_A", "a SONAR_B SONAR_C"),
+        ("SONAR_MODULE_NAME", "test"),
+        ("SONAR_C", "c SONAR_A"),
+        ("SONAR_B", "b"),
+        ("SONAR_A", "late"),
+        ("not a placeholder", "x"),
+    ]
+    template = Template(text)
+    expected = text
+    assert include.get_indentation("SONAR_A", template) == "    "
+    assert include.get_indentation("SONAR_B", template) == "  "
+    for search_str, replace_str in replacements:
+        include.replace_in_testbenches(template, search_str, replace_str)
+        expected = expected.replace(search_str, replace_str)
+    assert str(template) == expected
+
+
+def test_data_file_repeat():
+    """
+    Runs of identical packets that are long enough are written as a repeat
+    record followed by the packet, but never across sections of the data file
+    """
+    testbench = Testbench.default("test")
+    vector = TestVector()
+    for values in ([0, 0, 1, 1, 1, 1, 2, 2, 2], [2, 2, 2]):
+        thread = vector.add_thread()
+        for value in values:
+            thread.set_signal("signal", value)
+    vector.threads[-1].end_vector()
+    testbench.add_test_vector(vector)
+    stream = io.BytesIO()
+    sv.write_data_file(testbench, DataFile(stream, 2))
+    uncompressed = io.BytesIO()
+    sv.write_data_file(testbench, DataFile(uncompressed, 2, None))
+
+    lines = stream.getvalue().decode().splitlines()
+    packets = [line for line in lines if line.startswith(("signal", "repeat"))]
+    assert packets == [
+        "signal signal 1 0",
+        "signal signal 1 0",
+        "repeat NULL 1 4",
+        "signal signal 1 1",
+        "repeat NULL 1 3",
+        "signal signal 1 2",
+        "repeat NULL 1 3",
+        "signal signal 1 2",
+    ]
+    assert "Packet count 6" in lines
+    assert "Packet count 3" in lines
+    assert get_seeks("\n".join(lines), "ParallelSection seek") == get_offsets(
+        "\n".join(lines), "Packet count"
+    )
+    assert len(uncompressed.getvalue()) > len(stream.getvalue())
+
+
+def expand_loops(packets):
+    """
+    Replay the loops in the packets of a thread like the testbench does
+
+    Args:
+        packets (list): The packets
+
+    Returns:
+        list: The packets with the loops unrolled
+    """
+    expanded = []
+    loops = []
+    index = 0
+    while index < len(packets):
+        words = packets[index].split()
+        if words[:2] == ["loop", "begin"]:
+            loops.append([index + 1, int(words[3])])
+        elif words[:2] == ["loop", "end"]:
+            loops[-1][1] -= 1
+            if loops[-1][1] > 0:
+                index = loops[-1][0]
+                continue
+            loops.pop()
+        else:
+            expanded.append(packets[index])
+        index += 1
+    return expanded
+
+
+def test_sv_loop():
+    """
+    Loops are written to the data file once and replaying them gives the same
+    packets as unrolling them in Python
+    """
+    testbench = Testbench.default("test")
+    vector = TestVector()
+    looped = vector.add_thread()
+    unrolled = vector.add_thread()
+    with looped.loop(2):
+        looped.set_signal("a", 0)
+        with looped.loop(3), looped.loop(4):
+            looped.set_signal("a", 1)
+            looped.add_delay("10ns")
+        with looped.loop(0):
+            looped.set_signal("a", 2)
+    for _ in range(2):
+        unrolled.set_signal("a", 0)
+        for _ in range(12):
+            unrolled.set_signal("a", 1)
+            unrolled.add_delay("10ns")
+    testbench.add_test_vector(vector)
+    stream = io.BytesIO()
+    sv.write_data_file(testbench, DataFile(stream, 2))
+
+    data_file = stream.getvalue().decode()
+    threads = data_file.split("Packet count")[1:]
+    packets = [thread.splitlines()[1:] for thread in threads]
+    assert len(packets[0]) == 9
+    assert expand_loops(packets[0]) == packets[1]
+    assert "loop end 0\nloop end 0\nloop end 0" in data_file
+    with pytest.raises(SonarInvalidArgError):
+        with looped.loop(-1):
+            pass
+
+
+def test_loop_exception():
+    """
+    The commands of a loop that raises an exception are removed so the
+    thread can still be generated
+    """
+    thread = TestVector().add_thread()
+    thread.set_signal("a", 0)
+    with pytest.raises(ValueError):
+        with thread.loop(2):
+            thread.set_signal("a", 1)
+            with thread.loop(3):
+                raise ValueError()
+    thread.add_delay("10ns")
+
+    assert thread.asdict() == [
+        {"signal": {"name": "a", "value": 0}},
+        {"delay": "10ns"},
+    ]
+
+
+def expand_patterns(packets):
+    """
+    Expand the beats of the patterns in the packets of a thread like the
+    testbench does
+
+    Args:
+        packets (list): The packets
+
+    Returns:
+        list: The packets with the patterns expanded
+    """
+    expanded = []
+    pattern = None
+    for packet in packets:
+        words = packet.split()
+        if words[0] == "pattern":
+            pattern = [int(word) for word in words[3:]]
+            continue
+        if pattern is None:
+            expanded.append(packet)
+            continue
+        count, arg, step, period_arg, period = pattern
+        args = [int(word) for word in words[3:]]
+        for beat in range(count):
+            if period:
+                args[period_arg] = int((beat + 1) % period == 0)
+            expanded.append(" ".join(words[:3] + [str(x) for x in args]))
+            args[arg] = (args[arg] + step) % 2**32
+        pattern = None
+    return expanded
+
+
+def test_sv_pattern():
+    """
+    A pattern of beats is written to the data file as one record and the
+    beats it expands to are the same as writing them one by one
+    """
+    testbench = Testbench.default("test")
+    stream = AXI4Stream("axis", "slave", "clk", "rst")
+    stream.init_signals("tkeep", 32, False)
+    vector = TestVector()
+    pattern = vector.add_thread()
+    explicit = vector.add_thread()
+    stream.write_pattern(pattern, 5, 3, 7, tlast_every=3, tkeep=0xF)
+    stream.write_pattern(pattern, 2**32 - 2, 1, 3)
+    stream.write_pattern(pattern, 0, 1, 0)
+    stream.writes(
+        explicit,
+        [
+            {"tdata": 5 + 3 * i, "tlast": int(i % 3 == 2), "tkeep": 0xF}
+            for i in range(7)
+        ],
+    )
+    stream.writes(explicit, [{"tdata": x} for x in (2**32 - 2, 2**32 - 1, 0)])
+    testbench.add_test_vector(vector)
+    data = io.BytesIO()
+    sv.write_data_file(testbench, DataFile(data, 2))
+
+    threads = data.getvalue().decode().split("Packet count")[1:]
+    packets = [thread.splitlines()[1:] for thread in threads]
+    assert len(packets[0]) == 4
+    assert packets[0][0] == "pattern axis 5 7 1 3 2 3"
+    assert expand_patterns(packets[0]) == packets[1]
+    with pytest.raises(SonarInvalidArgError):
+        stream.write_pattern(pattern, 0, 1, -1)
+    with pytest.raises(SonarInvalidArgError):
+        stream.write_pattern(pattern, 0, 1, 2, tlast_every=0)
+
+
+def test_writers(caplog):
+    """
+    Both backends know how to write every type of command and unknown types
+    are reported and skipped
+    """
+    thread = TestVector().add_thread()
+    thread.init_signals()
+    thread.set_signal("signal", 1)
+    thread.add_delay("10ns")
+    thread.display("display")
+    thread.call_dut(1)
+    thread.enable_timestamps("t_", 0)
+    thread.set_flag(0)
+    thread.wait_flag(0)
+    with thread.loop(2):
+        thread.end_vector()
+    stream = AXI4Stream("axis", "slave", "clk", "rst")
+    stream.init_signals("default", 32)
+    stream.write(thread, 1)
+    types = {command_type(command) for command in thread.commands}
+    assert types <= set(sv.WRITERS)
+    assert types <= set(cpp.WRITERS)
+
+    data_file = DataFile(io.BytesIO(), 2)
+    sv.write_line(data_file, {"unknown": None}, 0)
+    cpp.write_line(data_file, {"unknown": None}, 0)
+    data_file.flush()
+    assert data_file.count == 0
+    assert caplog.text.count("Unhandled packet type") == 2
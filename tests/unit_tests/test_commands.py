@@ -0,0 +1,189 @@
+"""
+Test the compact storage of the commands in a thread
+"""
+
+import io
+import pickle
+
+import pytest
+
+import sonar.commands
+from sonar.commands import OP_OBJECT, Commands, SpilledCommands
+from sonar.core.backends import sv
+from sonar.core.backends.data_file import DataFile
+from sonar.exceptions import SonarInvalidOpError
+from sonar.testbench import Testbench, TestVector, Thread
+
+
+def make_commands():
+    """
+    Make a list of commands covering the compact and object forms
+
+    Returns:
+        list: The commands
+    """
+    return [
+        {"signal": {"name": "a", "value": 1}},
+        {"signal": {"name": "a", "value": 2**64 - 1}},
+        {"signal": {"name": "b", "value": 2**64}},
+        {"signal": {"name": "b", "value": -1}},
+        {"signal": {"name": "b", "value": True}},
+        {"signal": {"name": "b", "value": "0x10"}},
+        {"signal": {"name": "b", "value": 1, "value2": 2}},
+        {"delay": "10ns"},
+        {"timestamp": "INIT"},
+        {"display": "hello"},
+        {"call_dut": 3},
+        {"flag": {"set_flag": 1}},
+        {"flag": {"clear_flag": 1}},
+        {"macro": "END"},
+        {"wait": {"key": "flag", "args": [0]}},
+        {"interface": {"type": "axis", "name": "x", "payload": []}},
+    ]
+
+
+def test_commands():
+    """
+    Commands read back the same as they were added and only common ones with
+    values that fit the arrays are stored compactly
+    """
+    commands = make_commands()
+    store = Commands(commands)
+
+    assert list(store) == commands
+    assert [store[i] for i in range(len(store))] == commands
+    assert store[-1] == commands[-1]
+    assert store[2:5] == commands[2:5]
+    assert [type(store[i]["signal"]["value"]) for i in range(4, 6)] == [
+        bool,
+        str,
+    ]
+    assert list(store.opcodes).count(OP_OBJECT) == 8
+    assert store.strings == ["a", "10ns", "INIT", "hello"]
+
+
+def test_commands_mutable():
+    """
+    The commands can be modified like a list and objects are shared so
+    modifying them in place is preserved
+    """
+    commands = make_commands()
+    store = Commands(commands)
+    store[-2]["wait"]["key"] = "0"
+    commands[-2]["wait"]["key"] = "0"
+    store.insert(0, {"delay": "1ns"})
+    commands.insert(0, {"delay": "1ns"})
+    store.insert(-100, {"macro": "INIT_SIGNALS"})
+    commands.insert(-100, {"macro": "INIT_SIGNALS"})
+    store[3] = {"call_dut": 1}
+    commands[3] = {"call_dut": 1}
+    del store[5]
+    del commands[5]
+    del store[1:8:3]
+    del commands[1:8:3]
+    store[:2] = [{"display": "x"}]
+    commands[:2] = [{"display": "x"}]
+
+    assert store == commands
+    assert pickle.loads(pickle.dumps(store)) == commands
+    assert len(store.objects) == list(store.opcodes).count(OP_OBJECT)
+
+
+def test_commands_delete_slice():
+    """
+    Deleting a slice of commands drops the objects that only they used
+    """
+    commands = make_commands() * 3
+    store = Commands(commands)
+    del store[5:30]
+    del commands[5:30]
+    del store[::4]
+    del commands[::4]
+    store[1] = {"delay": "1ns"}
+    commands[1] = {"delay": "1ns"}
+
+    assert store == commands
+    assert len(store.objects) == list(store.opcodes).count(OP_OBJECT)
+
+
+def test_thread_commands():
+    """
+    Threads store their commands compactly and still convert to a list
+    """
+    thread = Thread()
+    thread.set_signal("a", 1)
+    thread.add_delay("10ns")
+    thread.wait_flag(0)
+    thread.end_vector()
+
+    assert isinstance(thread.commands, Commands)
+    assert thread.asdict() == [
+        {"signal": {"name": "a", "value": 1}},
+        {"delay": "10ns"},
+        {"wait": {"key": "flag", "args": [0]}},
+        {"flag": {"clear_flag": 0}},
+        {"macro": "END"},
+    ]
+
+
+def test_spilled_commands(tmp_path, monkeypatch):
+    """
+    Spilled commands read back the same as they were added, even when they're
+    larger than a block, and can only be changed at the end
+
+    Args:
+        tmp_path (Path): Defined in pytest as a temporary directory
+        monkeypatch (MonkeyPatch): Defined in pytest for monkeypatching code
+    """
+    monkeypatch.setattr(sonar.commands, "SPILL_BLOCK_SIZE", 64)
+    commands = make_commands()
+    commands.append(
+        {"interface": {"type": "axis", "name": "x", "payload": [0] * 100}}
+    )
+    store = SpilledCommands(commands[:5], str(tmp_path))
+    store.extend(commands[5:])
+
+    assert list(store) == commands
+    assert store[-1] == commands[-1]
+    assert store[2:5] == commands[2:5]
+    assert store == Commands(commands)
+    assert pickle.loads(pickle.dumps(store)) == commands
+    del store[-3:]
+    store.insert(100, {"delay": "1ns"})
+    assert store == commands[:-3] + [{"delay": "1ns"}]
+    with pytest.raises(SonarInvalidOpError):
+        store.insert(0, {"delay": "1ns"})
+    with pytest.raises(SonarInvalidOpError):
+        store[0] = {"delay": "1ns"}
+    with pytest.raises(SonarInvalidOpError):
+        del store[0]
+    store.clear()
+    assert not list(store)
+    store.close()
+
+
+def test_thread_spill():
+    """
+    A spilled thread is written to the data file the same as one in memory
+    """
+    testbench = Testbench.default("test")
+    vector = TestVector()
+    for spill in (False, True):
+        thread = vector.add_thread()
+        thread.set_signal("a", 1)
+        if spill:
+            thread.spill()
+        with thread.loop(0):
+            thread.set_signal("a", 2)
+        with thread.loop(2):
+            thread.add_delay("10ns")
+        thread.wait_flag(0)
+        thread.end_vector()
+    testbench.add_test_vector(vector)
+    data = io.BytesIO()
+    sv.write_data_file(testbench, DataFile(data, 2))
+
+    assert isinstance(vector.threads[1].commands, SpilledCommands)
+    assert vector.threads[0].asdict() == vector.threads[1].asdict()
+    threads = data.getvalue().decode().split("Packet count")[1:]
+    assert threads[0] == threads[1]
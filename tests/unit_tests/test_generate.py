@@ -0,0 +1,399 @@
+"""
+Test the legalization steps performed on the testbench before generation
+"""
+
+import json
+import os
+import shutil
+
+import pytest
+
+import sonar
+from sonar.core import cache, generate
+from sonar.exceptions import SonarInvalidArgError
+from sonar.interfaces.axi4_stream import AXI4Stream
+from sonar.testbench import Module, Testbench, TestVector, Thread
+
+
+def make_testbench(conditions):
+    """
+    Make a testbench with one thread that waits on each condition
+
+    Args:
+        conditions (list): Tuples of the condition and its args
+
+    Returns:
+        Testbench: The testbench
+    """
+    testbench = Testbench.default("test")
+    vector = TestVector()
+    thread = vector.add_thread()
+    for condition, *args in conditions:
+        thread.wait_level(condition, *args)
+    thread.wait_flag(0)
+    thread.end_vector()
+    testbench.add_test_vector(vector)
+    return testbench
+
+
+def get_waits(testbench):
+    """
+    Get the wait commands in the testbench
+
+    Args:
+        testbench (Testbench): The testbench
+
+    Returns:
+        list: The keys and args of the wait commands
+    """
+    return [
+        (command["wait"]["key"], tuple(command["wait"].get("args", ())))
+        for command in testbench.vectors[0].threads[0].commands
+        if "wait" in command
+    ]
+
+
+def test_finalize_waits():
+    """
+    Identical conditions share a key and each new condition gets the next key
+    """
+    testbench = make_testbench(
+        [("x == $0", 1), ("y == 1",), ("x == $0", 2), ("y == 1",)]
+    )
+    compiled = generate.finalize_waits(testbench)
+
+    assert list(compiled.wait_conditions) == [
+        {"condition": "wait(x == $0);", "key": "0"},
+        {"condition": "wait(y == 1);", "key": "1"},
+        {"condition": "wait(flags[args[0]]);", "key": "flag"},
+    ]
+    assert get_waits(compiled) == [
+        ("0", (1,)),
+        ("1", ()),
+        ("0", (2,)),
+        ("1", ()),
+        ("flag", (0,)),
+    ]
+    assert not testbench.wait_conditions
+    assert get_waits(testbench)[0] == ("wait(x == $0);", (1,))
+
+
+def test_finalize_waits_parametrize():
+    """
+    With parametrization, conditions that differ only in the integers they
+    compare against share a key and the integers are passed as args
+    """
+    testbench = make_testbench(
+        [
+            ("x == 5",),
+            ("x == 6",),
+            ("x[7:0] == $0 && y >= 10", 3),
+            ("x[7:0] == $0 && y >= 12", 4),
+            ("valid == 1'b1",),
+        ]
+    )
+    compiled = generate.finalize_waits(testbench, parametrize=True)
+
+    assert list(compiled.wait_conditions) == [
+        {"condition": "wait(x == $0);", "key": "0"},
+        {"condition": "wait(x[7:0] == $0 && y >= $1);", "key": "1"},
+        {"condition": "wait(valid == 1'b1);", "key": "2"},
+        {"condition": "wait(flags[args[0]]);", "key": "flag"},
+    ]
+    assert get_waits(compiled) == [
+        ("0", (5,)),
+        ("0", (6,)),
+        ("1", (3, 10)),
+        ("1", (4, 12)),
+        ("2", ()),
+        ("flag", (0,)),
+    ]
+
+
+def test_add_endpoint_combinations():
+    """
+    Every combination of endpoints gets a copy of each test vector that starts
+    by selecting the endpoints, and the commands are shared between copies
+    """
+    testbench = Testbench.default("test")
+    dut = Module.default("DUT")
+    dut.add_clock_port("clk", "10ns")
+    dut.add_reset_port("rst")
+    for name, endpoint_num in (("a", 2), ("b", 1), ("c", 3)):
+        interface = AXI4Stream(name, "master", "clk", "rst")
+        interface.init_signals("default", 64, False)
+        for _ in range(endpoint_num):
+            interface.add_endpoint("manual")
+        dut.add_interface(interface)
+    testbench.add_dut(dut)
+    for _ in range(2):
+        vector = TestVector()
+        vector.add_thread().set_signal("x", 1)
+        vector.add_thread().set_signal("y", 1)
+        testbench.add_test_vector(vector)
+    vectors = list(testbench.vectors)
+    compiled = generate.add_endpoint_combinations(testbench)
+
+    assert testbench.vectors == vectors
+    assert len(compiled.vectors) == 2 * 2 * 1 * 3
+    for i, vector in enumerate(compiled.vectors):
+        original = vectors[i % 2]
+        selects = [
+            command["signal"]["value2"]
+            for command in vector.threads[0].commands[:3]
+        ]
+        assert selects == [i // 4 % 3, 0, i // 2 % 2]
+        assert vector.threads[0].commands[3] == original.threads[0].commands[0]
+        assert vector.threads[0].thread.thread is original.threads[0]
+        assert vector.threads[1].thread is original.threads[1]
+
+
+def test_generate_parallel(tmp_path):
+    """
+    Generating the testbenches concurrently must give the same output as
+    generating them one after the other
+
+    Args:
+        tmp_path (Path): Defined in pytest as a temporary directory
+    """
+    testbench = Testbench.default("test")
+    dut = Module.default("DUT")
+    dut.add_clock_port("clk", "10ns")
+    dut.add_reset_port("rst")
+    interface = AXI4Stream("axis", "slave", "clk", "rst")
+    interface.init_signals("default", 64, False)
+    interface.iClass = "axis_t"
+    interface.flit = "axis_word_t"
+    interface.add_endpoint("manual")
+    dut.add_interface(interface)
+    testbench.add_dut(dut)
+    init = Thread()
+    init.init_signals()
+    testbench.set_prologue_thread(init)
+    vector = TestVector()
+    thread = vector.add_thread()
+    interface.writes(thread, [{"tdata": i} for i in range(10)])
+    thread.end_vector()
+    testbench.add_test_vector(vector)
+    testbench = generate.legalize_config(testbench)
+
+    filepaths = [str(tmp_path / f"{mode}/test.py") for mode in ("a", "b")]
+    for filepath in filepaths:
+        os.makedirs(generate.parse_sonar_tb(filepath)[1])
+    for lang in ("sv", "cpp"):
+        generate.generate_testbench(testbench, lang, filepaths[0], "text")
+    generate.generate_parallel(testbench, ("sv", "cpp"), filepaths[1], "text")
+
+    for lang in ("sv", "cpp"):
+        for get_filepath in (
+            generate.get_data_filepath,
+            generate.get_tb_filepath,
+        ):
+            files = []
+            for filepath in filepaths:
+                with open(get_filepath(filepath, lang)) as f:
+                    files.append(
+                        [
+                            line.replace(filepath[:-7], "")
+                            for line in f
+                            if "Create Date" not in line
+                        ]
+                    )
+            assert files[0] == files[1]
+
+
+def make_cached_testbench(value):
+    """
+    Make a testbench with one thread that sets a signal
+
+    Args:
+        value (int): Value to set the signal to
+
+    Returns:
+        Testbench: The testbench
+    """
+    testbench = Testbench.default("test")
+    dut = Module.default("DUT")
+    dut.add_clock_port("clk", "10ns")
+    dut.add_reset_port("rst")
+    dut.add_port("x", "input", 8)
+    testbench.add_dut(dut)
+    vector = TestVector()
+    thread = vector.add_thread()
+    thread.set_signal("x", value)
+    thread.end_vector()
+    testbench.add_test_vector(vector)
+    return testbench
+
+
+def test_generate_cache(tmp_path):
+    """
+    Generation is skipped if the testbench is unchanged and redone if it
+    changed, the generated files are missing or it's forced
+
+    Args:
+        tmp_path (Path): Defined in pytest as a temporary directory
+    """
+    filepath = str(tmp_path / "test.py")
+    tb_filepath = generate.get_tb_filepath(filepath, "sv")
+
+    def generate_and_mark(value, force=False):
+        generate.sonar(make_cached_testbench(value), filepath, force=force)
+        with open(tb_filepath) as f:
+            regenerated = f.read() != "marker"
+        with open(tb_filepath, "w") as f:
+            f.write("marker")
+        return regenerated
+
+    assert generate_and_mark(1)
+    assert not generate_and_mark(1)
+    assert generate_and_mark(2)
+    assert not generate_and_mark(2)
+    assert generate_and_mark(2, force=True)
+    os.remove(generate.get_data_filepath(filepath, "sv"))
+    assert generate_and_mark(2)
+
+
+def test_hash_sources(tmp_path, monkeypatch):
+    """
+    The source hash changes if any module of sonar changes, not only the
+    backends
+
+    Args:
+        tmp_path (Path): Defined in pytest as a temporary directory
+        monkeypatch (MonkeyPatch): Defined in pytest for monkeypatching code
+    """
+    root = tmp_path / "sonar"
+    shutil.copytree(
+        os.path.dirname(sonar.__file__),
+        root,
+        ignore=shutil.ignore_patterns("__pycache__"),
+    )
+    monkeypatch.setattr(sonar, "__file__", str(root / "__init__.py"))
+    hashes = []
+    for filename in ("endpoints.py", "commands.py", "testbench.py"):
+        cache.hash_sources.cache_clear()
+        hashes.append(cache.hash_sources())
+        with open(root / filename, "a") as f:
+            f.write("# changed\n")
+    cache.hash_sources.cache_clear()
+    hashes.append(cache.hash_sources())
+    monkeypatch.undo()
+    cache.hash_sources.cache_clear()
+
+    assert len(set(hashes)) == len(hashes)
+
+
+def test_generate_profile(tmp_path):
+    """
+    Profiling records each stage of the generation and writes the report to
+    the build directory
+
+    Args:
+        tmp_path (Path): Defined in pytest as a temporary directory
+    """
+    filepath = str(tmp_path / "test.py")
+    report = generate.sonar(make_cached_testbench(1), filepath, profile=True)
+
+    names = [stage["name"] for stage in report["stages"]]
+    assert names == [
+        "legalize_config",
+        "legalize_config/configure_prologue",
+        "legalize_config/finalize_waits",
+        "legalize_config/add_endpoint_combinations",
+        "hash_testbench",
+        "sv",
+        "sv/substitute_template",
+        "sv/write_data_file",
+        "sv/write_data_file/calculate_seeks",
+        "sv/render_template",
+    ]
+    for stage in report["stages"]:
+        assert stage["wall_time"] >= 0
+        assert stage["objects"] > 0
+    with open(tmp_path / "build/test" / generate.PROFILE_FILENAME) as f:
+        assert json.load(f)["stages"] == report["stages"]
+    assert generate.sonar(make_cached_testbench(1), filepath) is None
+
+
+def test_generate_shards(tmp_path):
+    """
+    Sharding splits the test vectors between data files, which together hold
+    the same packets as the data file of the unsharded testbench
+
+    Args:
+        tmp_path (Path): Defined in pytest as a temporary directory
+    """
+
+    def make_testbench():
+        testbench = make_cached_testbench(0)
+        for value in range(1, 5):
+            vector = TestVector()
+            thread = vector.add_thread()
+            thread.set_signal("x", value)
+            thread.end_vector()
+            testbench.add_test_vector(vector)
+        return testbench
+
+    def get_packets(filepath):
+        with open(filepath) as f:
+            lines = f.read().splitlines()
+        vector_num = int(lines[0].split()[2])
+        packets = [
+            line
+            for line in lines
+            if not line.startswith(("TestVector", "ParallelSection", "Packet"))
+        ]
+        return vector_num, packets
+
+    filepath = str(tmp_path / "test.py")
+    generate.sonar(make_testbench(), filepath)
+    generate.sonar(make_testbench(), filepath, shards=2)
+    _, packets = get_packets(generate.get_data_filepath(filepath, "sv"))
+    shards = [
+        get_packets(data_filepath)
+        for data_filepath in generate.get_data_filepaths(filepath, "sv", 2)
+    ]
+
+    assert [vector_num for vector_num, _ in shards] == [2, 3]
+    assert shards[0][1] + shards[1][1] == packets
+    with open(generate.get_tb_filepath(filepath, "sv")) as f:
+        testbench = f.read()
+    assert "localparam SHARDS = 2;" in testbench
+    assert "test_sv_%0d.dat" in testbench
+    with pytest.raises(SonarInvalidArgError):
+        generate.sonar(make_testbench(), filepath, shards=0)
+
+
+def test_legalize_config_reuse(tmp_path):
+    """
+    Legalization leaves the testbench unchanged so legalizing or generating
+    it again gives the same result, and a compiled testbench can be generated
+    more than once
+
+    Args:
+        tmp_path (Path): Defined in pytest as a temporary directory
+    """
+    testbench = make_cached_testbench(1)
+    init = Thread()
+    init.init_signals()
+    init.wait_level("x == 1")
+    testbench.set_prologue_thread(init)
+    before = testbench.asjson()
+    compiled = generate.legalize_config(testbench)
+
+    assert testbench.asjson() == before
+    assert generate.legalize_config(compiled) is compiled
+    again = generate.legalize_config(testbench)
+    assert again.asdict() == compiled.asdict()
+    assert compiled.prologue_thread is None
+    assert len(compiled.vectors[0].threads) == 2
+
+    outputs = []
+    for testbench_config in (testbench, testbench, compiled, compiled):
+        filepath = str(tmp_path / f"{len(outputs)}/test.py")
+        generate.sonar(testbench_config, filepath, force=True)
+        with open(generate.get_data_filepath(filepath, "sv")) as f:
+            outputs.append(f.read())
+    assert all(output == outputs[0] for output in outputs)
+    assert "x 1 0" in outputs[0]
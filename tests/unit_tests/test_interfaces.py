@@ -0,0 +1,134 @@
+"""
+Test the interfaces used in testbenches
+"""
+
+import json
+
+import pytest
+
+from sonar.core.cache import _encode_default
+from sonar.exceptions import SonarInvalidArgError
+from sonar.interfaces.axi4_stream import (
+    AXI4Stream,
+    AXI4StreamCore,
+    FilePayload,
+)
+from sonar.testbench import Thread
+
+
+def make_stream(width):
+    """
+    Make an AXI4Stream interface with tkeep and tlast
+
+    Args:
+        width (int): Width of tdata in bits
+
+    Returns:
+        AXI4Stream: The interface
+    """
+    stream = AXI4Stream("axis", "slave", "clk", "rst")
+    stream.init_signals("tkeep", width, False)
+    return stream
+
+
+@pytest.mark.parametrize("width", [8, 24, 64, 128, 1024])
+@pytest.mark.parametrize("endian", ["little", "big"])
+def test_file_to_stream(tmp_path, width, endian):
+    """
+    A file is split into beats of the width of tdata with a partial last beat
+    padded with zeros. Only the last beat asserts tlast and has a partial
+    tkeep.
+
+    Args:
+        tmp_path (Path): Defined in pytest as a temporary directory
+        width (int): Width of tdata in bits
+        endian (str): Endianness of the data
+    """
+    tdata_bytes = width // 8
+    data = bytes(range(256)) * 3
+    data = data[: tdata_bytes * 5 + tdata_bytes // 2 + 1]
+    filepath = tmp_path / "data.bin"
+    filepath.write_bytes(data)
+    stream = make_stream(width)
+    thread = Thread()
+    stream.file_to_stream(thread, str(filepath), endian=endian)
+    beats = thread.commands[0]["interface"]["payload"]
+
+    assert len(beats) == 6
+    for i, beat in enumerate(beats):
+        word = data[i * tdata_bytes : (i + 1) * tdata_bytes]
+        word += bytes(tdata_bytes - len(word))
+        assert beat["tdata"] == int.from_bytes(word, endian)
+        assert beat["tlast"] == (1 if i == 5 else 0)
+    last_size = tdata_bytes // 2 + 1
+    full = 2**tdata_bytes - 1
+    assert [beat["tkeep"] for beat in beats[:-1]] == [full] * 5
+    if last_size == tdata_bytes:
+        assert beats[-1]["tkeep"] == full
+    elif endian == "little":
+        assert beats[-1]["tkeep"] == 2**last_size - 1
+    else:
+        assert beats[-1]["tkeep"] == (2**last_size - 1) << (
+            tdata_bytes - last_size
+        )
+
+
+def test_file_to_stream_empty():
+    """
+    Empty data has no beats
+    """
+    assert not make_stream(64)._f2s_bin_data(b"", "little")
+
+
+@pytest.mark.parametrize("width", [8, 24, 64])
+@pytest.mark.parametrize("endian", ["little", "big"])
+def test_file_to_stream_lazy(tmp_path, width, endian):
+    """
+    Streaming a file lazily produces the same beats as reading it at once
+    and they're read from the file each time they're iterated over
+
+    Args:
+        tmp_path (Path): Defined in pytest as a temporary directory
+        width (int): Width of tdata in bits
+        endian (str): Endianness of the data
+    """
+    filepath = tmp_path / "data.bin"
+    filepath.write_bytes(bytes(range(256)) * 3)
+    stream = make_stream(width)
+    thread = Thread()
+    stream.file_to_stream(thread, str(filepath), endian=endian)
+    stream.file_to_stream(thread, str(filepath), endian=endian, lazy=True)
+    beats = thread.commands[0]["interface"]["payload"]
+    lazy_beats = thread.commands[1]["interface"]["payload"]
+
+    assert isinstance(lazy_beats, FilePayload)
+    assert len(lazy_beats) == len(beats)
+    assert list(lazy_beats) == beats
+    assert list(lazy_beats) == beats
+    assert lazy_beats[-1] == beats[-1]
+    assert lazy_beats[1:3] == beats[1:3]
+    assert list(
+        AXI4StreamCore.sv_lines(thread.commands[1]["interface"])
+    ) == list(AXI4StreamCore.sv_lines(thread.commands[0]["interface"]))
+
+
+def test_file_to_stream_lazy_cache(tmp_path):
+    """
+    Lazy beats are keyed in the cache by the contents of the file
+
+    Args:
+        tmp_path (Path): Defined in pytest as a temporary directory
+    """
+    filepath = tmp_path / "data.bin"
+    filepath.write_bytes(b"\x00" * 100)
+    stream = make_stream(64)
+    thread = Thread()
+    stream.file_to_stream(thread, str(filepath), lazy=True)
+    key = json.dumps(thread.commands[0], default=_encode_default)
+    filepath.write_bytes(b"\x01" * 100)
+
+    assert json.dumps(thread.commands[0], default=_encode_default) != key
+    with pytest.raises(SonarInvalidArgError):
+        stream.file_to_stream(
+            thread, str(filepath), lambda data, endian: [], lazy=True
+        )
@@ -0,0 +1,74 @@
+"""
+Test building test vectors in worker processes
+"""
+
+import io
+
+import pytest
+
+from sonar.commands import SpilledCommands
+from sonar.core.backends import sv
+from sonar.core.backends.data_file import DataFile
+from sonar.exceptions import SonarInvalidArgError
+from sonar.interfaces.axi4_stream import AXI4Stream
+from sonar.testbench import Testbench, TestVector
+
+
+def test_add_vectors_parallel():
+    """
+    Vectors built in parallel are added in the order of their parameters and
+    write the same data file as building them serially
+    """
+    stream = AXI4Stream("axis", "slave", "clk", "rst")
+    stream.init_signals("default", 32)
+
+    def build(beat_num):
+        vector = TestVector()
+        thread = vector.add_thread()
+        thread.set_signal("signal", beat_num)
+        stream.writes(thread, [{"tdata": i} for i in range(beat_num)])
+        thread.end_vector()
+        return vector
+
+    data = []
+    for workers in (1, 3):
+        testbench = Testbench.default("test")
+        vectors = testbench.add_vectors_parallel(
+            build, range(5, 0, -1), workers
+        )
+        assert vectors == testbench.vectors
+        stream_data = io.BytesIO()
+        sv.write_data_file(testbench, DataFile(stream_data, 2))
+        data.append(stream_data.getvalue())
+    assert data[0] == data[1]
+    assert b"signal signal 1 5" in data[0]
+
+    testbench = Testbench.default("test")
+    with pytest.raises(SonarInvalidArgError):
+        testbench.add_vectors_parallel(build, range(2), 0)
+    with pytest.raises(SonarInvalidArgError):
+        testbench.add_vectors_parallel(lambda _: None, range(2), 2)
+
+
+def test_add_vectors_parallel_spilled():
+    """
+    Spilled threads built in worker processes are still spilled when they're
+    added to the testbench and hold the same commands
+    """
+
+    def build(value):
+        vector = TestVector()
+        thread = vector.add_thread()
+        thread.spill()
+        for i in range(100):
+            thread.set_signal("signal", value * 100 + i)
+        thread.end_vector()
+        return vector
+
+    testbench = Testbench.default("test")
+    vectors = testbench.add_vectors_parallel(build, range(3), 2)
+
+    for value, vector in enumerate(vectors):
+        commands = vector.threads[0].commands
+        assert isinstance(commands, SpilledCommands)
+        assert commands == build(value).threads[0].commands
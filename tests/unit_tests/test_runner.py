@@ -0,0 +1,57 @@
+"""
+Test running the simulations of sharded testbenches
+"""
+
+import json
+import sys
+import textwrap
+
+from sonar import runner
+
+# stands in for the simulator. Shard 1 fails its second test vector
+SIMULATOR = textwrap.dedent(
+    """\
+    import sys
+
+    shard = int(sys.argv[1])
+    print("*** Starting RTL Simulation ***")
+    for vector in range(shard * 2, shard * 2 + 2):
+        if shard == 1 and vector == 3:
+            print("Error: AXI-S Assert failed")
+        print(f"Test vector {vector} complete")
+    if shard != 1:
+        print("SUCCESS: all tests completed successfully!")
+    sys.exit(shard == 2)
+    """
+)
+
+
+def test_run_shards(tmp_path):
+    """
+    Each shard is simulated in its own process and the results of their test
+    vectors are merged in order
+
+    Args:
+        tmp_path (Path): Defined in pytest as a temporary directory
+    """
+    script = tmp_path / "simulator.py"
+    script.write_text(SIMULATOR)
+    log_dir = tmp_path / "logs"
+    report = runner.run_shards(
+        [sys.executable, str(script), "{shard}"], 3, str(log_dir), jobs=2
+    )
+
+    assert not report["passed"]
+    passed = [shard["passed"] for shard in report["shards"]]
+    assert passed == [True, False, False]
+    assert report["shards"][2]["returncode"] == 1
+    assert [vector["vector"] for vector in report["vectors"]] == list(range(6))
+    shards = [vector["shard"] for vector in report["vectors"]]
+    assert shards == [0, 0, 1, 1, 2, 2]
+    passed = [vector["passed"] for vector in report["vectors"]]
+    assert passed == [True, True, True, False, True, True]
+    assert report["vectors"][3]["errors"] == ["Error: AXI-S Assert failed"]
+    with open(log_dir / "sim_1.log") as f:
+        assert "Test vector 3 complete\n" in f.read()
+    with open(log_dir / runner.REPORT_FILENAME) as f:
+        assert json.load(f) == report
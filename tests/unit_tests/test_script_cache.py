@@ -0,0 +1,63 @@
+"""
+Test generating the testbenches of scripts without rerunning them
+"""
+
+import textwrap
+
+from sonar.core import generate, script_cache
+
+SCRIPT = textwrap.dedent(
+    """\
+    import sys
+
+    from stimulus import VALUES
+    from sonar.testbench import Module, Testbench, TestVector
+
+    with open(sys.argv[0] + ".runs", "a") as f:
+        f.write("run\\n")
+    testbench = Testbench.default("test")
+    dut = Module.default("DUT")
+    dut.add_clock_port("clk", "10ns")
+    dut.add_reset_port("rst")
+    dut.add_port("x", "input", 8)
+    testbench.add_dut(dut)
+    vector = TestVector()
+    thread = vector.add_thread()
+    for value in VALUES + [int(arg) for arg in sys.argv[1:]]:
+        thread.set_signal("x", value)
+    thread.end_vector()
+    testbench.add_test_vector(vector)
+    testbench.generate_tb(__file__, "sv", True)
+    """
+)
+
+
+def test_script_cache(tmp_path):
+    """
+    The script is only run again if it, a module it imports or its arguments
+    change and otherwise its saved testbench is generated
+
+    Args:
+        tmp_path (Path): Defined in pytest as a temporary directory
+    """
+    script = tmp_path / "test.py"
+    script.write_text(SCRIPT)
+    (tmp_path / "stimulus.py").write_text("VALUES = [1, 2]\n")
+    data_filepath = generate.get_data_filepath(str(script), "sv")
+
+    def run(argv=(), force=False):
+        ran = script_cache.run(str(script), argv, force)
+        with open(data_filepath) as f:
+            lines = [line for line in f if line.startswith("signal x ")]
+        return ran, lines
+
+    assert run() == (True, ["signal x 1 1\n", "signal x 1 2\n"])
+    manifest = script_cache.read_manifest(str(script))
+    assert str(tmp_path / "stimulus.py") in manifest["sources"]
+    assert run() == (False, ["signal x 1 1\n", "signal x 1 2\n"])
+    (tmp_path / "stimulus.py").write_text("VALUES = [3]\n")
+    assert run() == (True, ["signal x 1 3\n"])
+    assert run() == (False, ["signal x 1 3\n"])
+    assert run(["4"]) == (True, ["signal x 1 3\n", "signal x 1 4\n"])
+    assert run(["4"], force=True)[0]
+    assert (tmp_path / "test.py.runs").read_text() == "run\n" * 4
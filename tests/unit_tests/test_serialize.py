@@ -0,0 +1,168 @@
+"""
+Test saving testbenches as JSON and loading them back
+"""
+
+import json
+
+import pytest
+
+from sonar.core import generate
+from sonar.exceptions import SonarInvalidArgError
+from sonar.interfaces.axi4_lite_slave import AXI4LiteSlave
+from sonar.interfaces.axi4_stream import AXI4Stream, FilePayload
+from sonar.testbench import Module, Testbench, TestVector, Thread
+
+
+def make_testbench(data_filepath):
+    """
+    Make a testbench using most of the features of sonar
+
+    Args:
+        data_filepath (str): Path to a binary file to stream lazily
+
+    Returns:
+        Testbench: The testbench
+    """
+    testbench = Testbench.default("serialize")
+    testbench.set_metadata("Headers", ["serialize.hpp"])
+    dut = Module.cpp_vivado("DUT", "20ns")
+    dut.add_port("ack", "output")
+    dut.add_parameter("WIDTH", 64)
+    clock = dut.ports.get_clocks("input")[0]
+    reset = dut.ports.get_resets("input")[0]
+    testbench.add_dut(dut)
+
+    axis_out = AXI4Stream("axis_output", "master", clock, reset)
+    axis_out.init_signals("default", 64)
+    axis_out.iClass = "axis_t"
+    axis_out.flit = "axis_word_t"
+    axis_out.add_endpoint("manual")
+    axis_out.add_endpoint("variable", cycle=2, limit=10)
+    dut.add_interface(axis_out)
+    axis_in = AXI4Stream("axis_input", "slave", clock, reset)
+    axis_in.init_signals("tkeep", 64)
+    axis_in.iClass = "axis_t"
+    axis_in.flit = "axis_word_t"
+    axis_in.add_endpoint("manual")
+    dut.add_interface(axis_in)
+    ctrl_bus = AXI4LiteSlave("s_axi_ctrl_bus", clock, reset)
+    ctrl_bus.add_register("enable", 0x10)
+    ctrl_bus.set_address("4K", 0)
+    ctrl_bus.init_signals(mode="default", data_width=32, addr_width=5)
+    ctrl_bus.add_endpoint("manual")
+    dut.add_interface(ctrl_bus)
+
+    init = Thread()
+    init.wait_negedge(clock.name)
+    init.init_signals()
+    init.add_delay("40ns")
+    init.set_signal(reset.name, 1)
+    testbench.set_prologue_thread(init)
+
+    vector = TestVector()
+    writer = vector.add_thread()
+    writer.enable_timestamps("t_", 0)
+    ctrl_bus.write(writer, "enable", 1)
+    with writer.loop(3):
+        axis_in.write(writer, 0xABCD, tkeep=0xFF)
+        writer.call_dut(2)
+    axis_in.write_pattern(writer, 1, 2, 10, tlast_every=5, tkeep=0xFF)
+    axis_in.file_to_stream(writer, data_filepath, lazy=True)
+    writer.wait_level("ack == $0", 1)
+    writer.set_flag(0)
+    reader = vector.add_thread()
+    axis_out.reads(reader, [{"tdata": i, "tlast": 0} for i in range(5)])
+    reader.wait_flag(0)
+    ctrl_bus.read(reader, "enable", 1)
+    reader.display("done")
+    reader.end_vector()
+    testbench.add_test_vector(vector)
+    return testbench
+
+
+def read_outputs(filepath):
+    """
+    Read the generated testbenches and data files, without the lines that
+    differ between builds
+
+    Args:
+        filepath (str): Path used to generate the testbenches
+
+    Returns:
+        list: Lines of each file
+    """
+    outputs = []
+    for lang in ("sv", "cpp"):
+        for get_filepath in (
+            generate.get_data_filepath,
+            generate.get_tb_filepath,
+        ):
+            with open(get_filepath(filepath, lang)) as f:
+                outputs.append(
+                    [
+                        line.replace(filepath[:-7], "")
+                        for line in f
+                        if "Create Date" not in line
+                    ]
+                )
+    return outputs
+
+
+def test_json_round_trip(tmp_path, monkeypatch):
+    """
+    A testbench loaded from JSON generates the same testbenches as the
+    original and saves to the same JSON
+
+    Args:
+        tmp_path (Path): Defined in pytest as a temporary directory
+        monkeypatch (MonkeyPatch): Defined in pytest for monkeypatching code
+    """
+    monkeypatch.setenv("SONAR_CAD_VERSION", "2018.1")
+    data_filepath = tmp_path / "data.bin"
+    data_filepath.write_bytes(bytes(range(100)))
+    testbench = make_testbench(str(data_filepath))
+    testbench.to_json(str(tmp_path / "a.json"))
+    loaded = Testbench.from_json(str(tmp_path / "a.json"))
+    loaded.to_json(str(tmp_path / "b.json"))
+
+    assert (tmp_path / "a.json").read_text() == (
+        tmp_path / "b.json"
+    ).read_text()
+    commands = loaded.vectors[0].threads[0].commands
+    assert any(
+        isinstance(command["interface"]["payload"], FilePayload)
+        for command in commands
+        if "interface" in command
+    )
+    dut = loaded.modules["DUT"]
+    assert [interface.name for interface in dut.ports.get_interfaces()] == [
+        "axis_output",
+        "axis_input",
+        "s_axi_ctrl_bus",
+    ]
+    assert dut.parameters == [("WIDTH", 64)]
+
+    outputs = []
+    for name, tb in (("original", testbench), ("loaded", loaded)):
+        filepath = str(tmp_path / f"{name}/test.py")
+        tb.generate_tb(filepath, "all", force=True)
+        outputs.append(read_outputs(filepath))
+    assert outputs[0] == outputs[1]
+
+
+def test_json_invalid(tmp_path):
+    """
+    Files that aren't saved testbenches are rejected
+
+    Args:
+        tmp_path (Path): Defined in pytest as a temporary directory
+    """
+    filepath = tmp_path / "invalid.json"
+    filepath.write_text(json.dumps({"metadata": {}}))
+    with pytest.raises(SonarInvalidArgError):
+        Testbench.from_json(str(filepath))
+    filepath.write_text(
+        json.dumps({"format": "sonar_testbench", "version": 1000})
+    )
+    with pytest.raises(SonarInvalidArgError):
+        Testbench.from_json(str(filepath))